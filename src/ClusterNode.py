@@ -0,0 +1,442 @@
+"""
+ClusterNode.py shards chatrooms across several server nodes.
+
+Every chatroom is owned by exactly one node, chosen by consistent hashing of the room
+name over the nodes listed in a static cluster configuration. The owner keeps the
+room's live member list and recent history and performs its fan-out. A node that
+receives a room command for a room it does not own forwards it to the owner over an
+inter-node TCP link, and the owner sends the resulting frames (the ack, the join
+replay and the room's chat messages) back over its own link to that node, which
+hands them to the client.
+
+On the owner, a forwarded client is represented by a RemoteSession, which has the
+same send_frame, getpeername and close methods as a local connection, so the usual
+command handlers and the SessionRegistry serve it unchanged.
+
+Messages received from other nodes run on a small pool of dispatch threads. All
+messages about one client go to the same thread, so a client's commands and
+deliveries keep their order while different clients are served in parallel.
+
+Links carry the length-prefixed framing of Protocol.py. Each frame holds one JSON
+object with a "type":
+    hello   - first frame of a link, names the connecting node
+    command - a client command forwarded to the room's owner
+    deliver - an encoded event for one forwarded client
+    close   - a forwarded client disconnected
+    event   - a private message, unread count change, login or logout for the other
+              nodes' sessions, relayed like the worker bus relays them between workers
+
+Only chatrooms are sharded. Every node opens the same SQLite database file and the
+same archive directory, so all nodes must run on one host or share them through a
+file system with working SQLite locking; this is a hard limit of cluster mode, which
+spreads the chat load over several processes but not the storage.
+
+The configuration is a JSON file:
+    {"nodes": [{"id": "a", "host": "127.0.0.1", "port": 7632, "cluster_port": 7732}, ...]}
+where port serves clients and cluster_port serves the other nodes.
+
+@author Osagie Owie
+@email owieo204@potsdam.edu
+"""
+
+import json
+import queue
+import logging
+import socket
+import bisect
+import hashlib # Stable hashes; the built-in hash of a string differs between processes
+import itertools
+import threading
+import Protocol # Length-prefixed framing, shared with the chat protocol
+import OutboundQueue # Queued sends, so a slow peer does not stall a room's fan-out
+
+CONNECT_TIMEOUT = 2.0 # Seconds to wait for a peer node to accept a link
+PEER_QUEUE_BYTES = 16 * 1024 * 1024 # Frames queued for one peer node before its chat deliveries are dropped
+DISPATCH_THREADS = 8 # Threads running the messages received from other nodes
+log = logging.getLogger("chitchat.cluster")
+
+
+"""
+load_config Reads the node list of a cluster configuration file
+
+@param path String path of the JSON configuration
+@return List of node dictionaries with "id", "host", "port" and "cluster_port"
+@raise ValueError if the file does not describe at least one node
+"""
+def load_config(path):
+    with open(path) as config_file:
+        nodes = json.load(config_file).get("nodes")
+    if not nodes:
+        raise ValueError(f"Cluster configuration '{path}' lists no nodes")
+    for node in nodes:
+        missing = {"id", "host", "port", "cluster_port"} - set(node)
+        if missing:
+            raise ValueError(f"Cluster node {node} is missing {', '.join(sorted(missing))}")
+    return nodes
+
+
+"""
+ClusterRing maps keys to nodes with consistent hashing.
+
+Each node is placed on the ring at several points (virtual nodes) so rooms spread
+evenly, and adding or removing a node only moves the rooms next to its points.
+"""
+class ClusterRing:
+    """
+    Initializes the ring
+
+    @param self ClusterRing instance
+    @param node_ids Iterable of node id strings
+    @param replicas Integer points per node on the ring
+    """
+    def __init__(self, node_ids, replicas=100):
+        points = sorted((self.hash(f"{node_id}#{index}"), node_id)
+                        for node_id in node_ids for index in range(replicas))
+        self.hashes = [point[0] for point in points]
+        self.node_ids = [point[1] for point in points]
+
+    @staticmethod
+    def hash(key):
+        return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], "big")
+
+    """
+    owner Returns the node owning a key
+
+    @param self ClusterRing instance
+    @param key String key, for example a chatroom name
+    @return String node id of the first point clockwise from the key's hash
+    """
+    def owner(self, key):
+        index = bisect.bisect(self.hashes, self.hash(key)) % len(self.hashes)
+        return self.node_ids[index]
+
+
+"""
+RemoteSession stands for a client of another node on the node owning its rooms.
+"""
+class RemoteSession:
+    def __init__(self, node, origin, session_id):
+        self.node = node
+        self.origin = origin # Node the client is connected to
+        self.session_id = session_id # The client's id on that node
+
+    """
+    send_frame Sends an encoded event to the client through its node
+
+    @param self RemoteSession instance
+    @param frame Bytes produced by Protocol.encode_frame
+    @param coalesce_key Ignored, the client's own node applies its queue policy
+    @param droppable Boolean the link and the client's node may discard the frame when behind
+    @raise OSError if the client's node cannot be reached
+    """
+    def send_frame(self, frame, coalesce_key=None, droppable=False):
+        self.node.send(self.origin, {"type": "deliver", "session": self.session_id, "droppable": droppable,
+                                     "event": frame[Protocol.HEADER.size:].decode('utf-8')}, droppable)
+
+    def send_message(self, message, coalesce_key=None):
+        self.send_frame(Protocol.encode_frame(message), coalesce_key)
+
+    def getpeername(self):
+        return (f"node {self.origin}", self.session_id)
+
+    def close(self):
+        self.node.drop_remote(self.origin, self.session_id)
+
+
+"""
+ClusterNode is one server's view of the cluster: the ring, its links to the other
+nodes and the sessions forwarded in either direction.
+"""
+class ClusterNode:
+    """
+    Initializes the node and starts accepting links from the other nodes
+
+    @param self ClusterNode instance
+    @param node_id String id of this node in the configuration
+    @param nodes List of node dictionaries returned by load_config
+    @param handler Function called with (origin node id, message dictionary) for every
+                   message another node sends, and with a "node_down" message when a
+                   node's link closes
+    @raise ValueError if node_id is not in the configuration
+    """
+    def __init__(self, node_id, nodes, handler):
+        self.nodes = {node["id"]: node for node in nodes}
+        if node_id not in self.nodes:
+            raise ValueError(f"Node '{node_id}' is not in the cluster configuration")
+        self.node_id = node_id
+        self.handler = handler
+        self.ring = ClusterRing(self.nodes)
+        self.lock = threading.Lock()
+        self.links = {} # Node id -> QueuedConnection used to send to that node
+        self.session_ids = itertools.count(1)
+        self.local_ids = {} # Local session -> id used on the links
+        self.local_sessions = {} # Id -> local session
+        self.forwarded = {} # Id -> node ids the session's commands were forwarded to
+        self.remote_sessions = {} # (origin node id, session id) -> RemoteSession
+        self.forwarded_commands = 0
+        self.remote_commands = 0
+        self.dispatch_queues = [queue.Queue() for _ in range(DISPATCH_THREADS)]
+        for index, messages in enumerate(self.dispatch_queues):
+            threading.Thread(target=self.dispatch_loop, args=(messages,), name=f"ClusterDispatch-{index}",
+                             daemon=True).start()
+
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind((self.nodes[node_id]["host"], self.nodes[node_id]["cluster_port"]))
+        self.socket.listen()
+        threading.Thread(target=self.accept_loop, daemon=True).start()
+
+    """
+    route Decides where a room command runs
+
+    @param self ClusterNode instance
+    @param session Connection the command came from
+    @param room String chatroom name
+    @return String id of the node to forward the command to, or None to handle it here
+    """
+    def route(self, session, room):
+        if isinstance(session, RemoteSession):
+            return None # Forwarded to this node as the owner, never forwarded again
+        owner = self.ring.owner(room)
+        return None if owner == self.node_id else owner
+
+    """
+    forward Sends a client's command to the node owning its room
+
+    @param self ClusterNode instance
+    @param node_id String id of the owning node
+    @param session Local connection of the client
+    @param username String username the client is logged in as
+    @param message String command exactly as the client sent it
+    @raise OSError if the node cannot be reached
+    """
+    def forward(self, node_id, session, username, message):
+        with self.lock:
+            session_id = self.local_ids.get(session)
+            if session_id is None:
+                session_id = next(self.session_ids)
+                self.local_ids[session] = session_id
+                self.local_sessions[session_id] = session
+            self.forwarded.setdefault(session_id, set()).add(node_id)
+            self.forwarded_commands += 1
+        self.send(node_id, {"type": "command", "session": session_id, "username": username, "message": message})
+
+    """
+    session_closed Tells the owners of a disconnected client's rooms to forget it
+
+    @param self ClusterNode instance
+    @param session Local connection of the client
+    """
+    def session_closed(self, session):
+        with self.lock:
+            session_id = self.local_ids.pop(session, None)
+            if session_id is None:
+                return
+            del self.local_sessions[session_id]
+            node_ids = self.forwarded.pop(session_id, ())
+        for node_id in node_ids:
+            try:
+                self.send(node_id, {"type": "close", "session": session_id})
+            except OSError:
+                pass # That node already dropped it with the link
+
+    def local_session(self, session_id):
+        return self.local_sessions.get(session_id)
+
+    """
+    remote_session Returns the RemoteSession of a client forwarded by another node
+
+    @param self ClusterNode instance
+    @param origin String id of the client's node
+    @param session_id Integer id of the client on that node
+    @return RemoteSession, created on the client's first forwarded command
+    """
+    def remote_session(self, origin, session_id):
+        with self.lock:
+            self.remote_commands += 1
+            key = (origin, session_id)
+            if key not in self.remote_sessions:
+                self.remote_sessions[key] = RemoteSession(self, origin, session_id)
+            return self.remote_sessions[key]
+
+    """
+    drop_remote Forgets a client forwarded by another node
+
+    @param self ClusterNode instance
+    @param origin String id of the client's node
+    @param session_id Integer id of the client on that node
+    @return The RemoteSession, or None if it was not known
+    """
+    def drop_remote(self, origin, session_id):
+        with self.lock:
+            return self.remote_sessions.pop((origin, session_id), None)
+
+    """
+    drop_node Forgets every client forwarded by a node whose link closed
+
+    @param self ClusterNode instance
+    @param origin String id of the node
+    @return List of the node's RemoteSessions
+    """
+    def drop_node(self, origin):
+        with self.lock:
+            keys = [key for key in self.remote_sessions if key[0] == origin]
+            return [self.remote_sessions.pop(key) for key in keys]
+
+    """
+    publish Sends an event to other nodes, as the worker bus does between workers
+
+    A node that cannot be reached is skipped: it has no users logged in, and it is
+    told who is logged in here when it starts and publishes its hello.
+
+    @param self ClusterNode instance
+    @param event_type String event type
+    @param node_ids Iterable of node ids to send to, or None for every other node
+    @param fields Keyword arguments with the event's JSON-serializable fields
+    """
+    def publish(self, event_type, node_ids=None, **fields):
+        message = {"type": "event", "event": {"type": event_type, "origin": self.node_id, **fields}}
+        for node_id in (node_ids if node_ids is not None else [node for node in self.nodes if node != self.node_id]):
+            try:
+                self.send(node_id, message)
+            except OSError as e:
+                log.debug("Node unreachable for event", extra={"node": node_id, "event": event_type, "error": str(e)})
+
+    """
+    send Queues a message on the link to another node, connecting it first if needed
+
+    @param self ClusterNode instance
+    @param node_id String id of the receiving node
+    @param message JSON-serializable dictionary
+    @param droppable Boolean the link's queue may discard the message when the node falls behind
+    @raise OSError if the node cannot be reached
+    """
+    def send(self, node_id, message, droppable=False):
+        frame = Protocol.encode_frame(json.dumps(message, separators=(",", ":"), ensure_ascii=False))
+        self.link(node_id).send_frame(frame, droppable=droppable)
+
+    """
+    link Returns the open link to another node, connecting it first if needed
+
+    The connection is made without holding the lock, so a node that is slow to
+    answer does not hold up sends to the others. When two threads connect at once,
+    the link stored first is kept and the other is closed.
+
+    @param self ClusterNode instance
+    @param node_id String id of the node
+    @return QueuedConnection to the node
+    @raise OSError if the node cannot be reached
+    """
+    def link(self, node_id):
+        with self.lock:
+            link = self.links.get(node_id)
+        if link is not None and not link.outbound.closed:
+            return link
+
+        node = self.nodes[node_id] # Never connected, or the peer went away
+        sock = socket.create_connection((node["host"], node["cluster_port"]), timeout=CONNECT_TIMEOUT)
+        sock.settimeout(None)
+        connected = OutboundQueue.QueuedConnection(sock, OutboundQueue.OutboundQueue(PEER_QUEUE_BYTES))
+        connected.send_message(json.dumps({"type": "hello", "node": self.node_id})) # Ahead of any other frame
+        with self.lock:
+            link = self.links.get(node_id)
+            if link is None or link.outbound.closed:
+                link = self.links[node_id] = connected
+        if link is not connected: # Another thread connected first
+            connected.abort()
+            return link
+        threading.Thread(target=self.watch_link, args=(link,), daemon=True).start()
+        return link
+
+    """
+    watch_link Closes an outgoing link as soon as the peer node goes away
+
+    Peers never send on a link they accepted, so the read only returns when the
+    connection closes. The next send then reconnects, or reports the node unreachable,
+    instead of queueing frames on a dead connection.
+
+    @param self ClusterNode instance
+    @param link QueuedConnection to another node
+    """
+    def watch_link(self, link):
+        try:
+            link.recv_message()
+        except OSError:
+            pass
+        link.abort()
+
+    def accept_loop(self):
+        while True:
+            try:
+                sock, _ = self.socket.accept()
+            except OSError:
+                break # Node closed
+            threading.Thread(target=self.receive_loop, args=(Protocol.Connection(sock),), daemon=True).start()
+
+    """
+    receive_loop Passes the messages of one incoming link to the dispatch threads until it closes
+
+    @param self ClusterNode instance
+    @param link Protocol.Connection accepted from another node
+    """
+    def receive_loop(self, link):
+        origin = None
+        try:
+            while True:
+                message = link.recv_message()
+                if message is None:
+                    break
+                message = json.loads(message)
+                if origin is None:
+                    origin = message.get("node") # The hello frame
+                    continue
+                self.dispatch(origin, message)
+        except (OSError, ValueError):
+            pass
+        finally:
+            link.close()
+            if origin is not None:
+                self.dispatch(origin, {"type": "node_down"})
+
+    """
+    dispatch Queues a received message on the dispatch thread of its client
+
+    A node_down message goes to every thread, behind the messages already queued
+    there, so no command of the node's clients runs after its sessions were dropped.
+
+    @param self ClusterNode instance
+    @param origin String id of the sending node
+    @param message Dictionary message
+    """
+    def dispatch(self, origin, message):
+        if message.get("type") == "node_down":
+            for messages in self.dispatch_queues:
+                messages.put((origin, message))
+        else:
+            key = hash((origin, message.get("session")))
+            self.dispatch_queues[key % len(self.dispatch_queues)].put((origin, message))
+
+    def dispatch_loop(self, messages):
+        while True:
+            item = messages.get()
+            if item is None:
+                break # Node closed
+            origin, message = item
+            try:
+                self.handler(origin, message)
+            except Exception:
+                log.exception("Error handling cluster message", extra={"node": origin})
+
+    """
+    close Stops accepting links and closes the links to the other nodes
+
+    @param self ClusterNode instance
+    """
+    def close(self):
+        self.socket.close()
+        for messages in self.dispatch_queues:
+            messages.put(None)
+        with self.lock:
+            for link in self.links.values():
+                link.close()
+            self.links.clear()
@@ -0,0 +1,199 @@
+"""
+DatabasePool.py keeps a pool of long-lived SQLite connections for the chat server.
+
+Opening a new SQLite connection for every query costs a file open and a schema parse.
+DatabasePool opens a fixed number of connections once, switches the database to WAL
+journaling so readers never block the writer (and the writer never blocks readers),
+and hands the connections out to server threads one at a time.
+
+@author Osagie Owie
+@email owieo204@potsdam.edu
+"""
+
+import sqlite3 # Manages user accounts and chat history in SQL database
+import queue # Thread-safe storage for idle connections
+import re
+import time
+import functools
+from contextlib import contextmanager
+
+# Pragmas applied to every pooled connection
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL", # Readers and the writer work concurrently
+    "PRAGMA synchronous=NORMAL", # WAL stays consistent, fsync only at checkpoints
+    "PRAGMA busy_timeout=5000", # Wait up to 5s for another writer instead of failing
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000", # 16 MB page cache per connection
+    "PRAGMA mmap_size=268435456", # Memory-map up to 256 MB of the database file
+)
+
+
+"""
+query_label Names a statement by its verb and first table for per-query metrics
+
+@param sql String SQL statement
+@return String such as "SELECT users" or "INSERT messages"
+"""
+@functools.lru_cache(maxsize=1024) # Statements are constant strings, so each is parsed once
+def query_label(sql):
+    verb = sql.split(None, 1)[0].upper() if sql.strip() else "EMPTY"
+    table = re.search(r"\b(?:FROM|INTO|UPDATE(?!\s+OF\b)|TABLE|ON)\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+)", sql, re.IGNORECASE)
+    if verb == "PRAGMA":
+        return "PRAGMA " + sql.split(None, 1)[1].split("=", 1)[0].strip()
+    return f"{verb} {table.group(1)}" if table else verb
+
+
+"""
+TimedCursor reports the time spent executing and fetching each statement.
+"""
+class TimedCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        self.sql = sql
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self.connection.observer(sql, time.perf_counter() - started)
+
+    def executemany(self, sql, seq_of_parameters):
+        self.sql = sql
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self.connection.observer(sql, time.perf_counter() - started)
+
+    # SQLite produces the rows while they are fetched, so every fetch is timed as well
+    def fetchone(self):
+        started = time.perf_counter()
+        try:
+            return super().fetchone()
+        finally:
+            self.connection.observer(self.sql, time.perf_counter() - started)
+
+    def fetchmany(self, size=None):
+        started = time.perf_counter()
+        try:
+            return super().fetchmany(self.arraysize if size is None else size)
+        finally:
+            self.connection.observer(self.sql, time.perf_counter() - started)
+
+    def fetchall(self):
+        started = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            self.connection.observer(self.sql, time.perf_counter() - started)
+
+
+"""
+TimedConnection is the connection class used when the pool has an observer.
+
+Every statement goes through a TimedCursor, including the ones run with the
+connection's execute shortcut, and commits are reported as "COMMIT".
+"""
+class TimedConnection(sqlite3.Connection):
+    observer = None # Function called with (sql, seconds)
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def commit(self):
+        started = time.perf_counter()
+        try:
+            super().commit()
+        finally:
+            self.observer("COMMIT", time.perf_counter() - started)
+
+
+class DatabasePool:
+    """
+    Initializes the pool and opens all of its connections
+
+    @param self DatabasePool instance
+    @param path String path of the SQLite database file
+    @param size Integer number of connections kept open
+    @param observer Function called with (sql, seconds) for every statement, or None
+                    to use plain connections
+    """
+    def __init__(self, path='chat_app.db', size=8, observer=None):
+        self.path = path
+        self.size = size
+        self.observer = observer
+        self.idle = queue.LifoQueue() # LIFO keeps the most recently used (warm) connection in use
+        for _ in range(size):
+            self.idle.put(self.connect())
+
+    """
+    connect Opens a new connection configured with the pool pragmas
+
+    Pooled connections move between threads, so the same-thread check is disabled;
+    the pool guarantees a connection is only used by one thread at a time.
+
+    @param self DatabasePool instance
+    @return sqlite3.Connection
+    """
+    def connect(self):
+        if self.observer is None:
+            conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+        else:
+            conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False, factory=TimedConnection)
+            conn.observer = self.observer
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    """
+    acquire Takes an idle connection from the pool, waiting if all are in use
+
+    @param self DatabasePool instance
+    @return sqlite3.Connection that must be handed back with release
+    """
+    def acquire(self):
+        return self.idle.get()
+
+    """
+    release Returns a connection to the pool
+
+    Any transaction the caller left open is rolled back so the next user of the
+    connection starts from a clean state.
+
+    @param self DatabasePool instance
+    @param conn sqlite3.Connection previously returned by acquire
+    """
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        self.idle.put(conn)
+
+    """
+    connection Context manager that acquires a connection and always releases it
+
+    @param self DatabasePool instance
+    @return sqlite3.Connection for the duration of the with block
+    """
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    """
+    close Closes every idle connection in the pool
+
+    @param self DatabasePool instance
+    """
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                break
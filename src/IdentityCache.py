@@ -0,0 +1,97 @@
+"""
+IdentityCache.py caches username -> user_id and chatroom name -> chatroom_id lookups.
+
+Almost every chat command needs to turn a username or chatroom name into its database
+id. IdentityCache is a bounded, thread-safe LRU cache in front of those lookups: a hit
+is a dictionary access, a miss runs the loader once and remembers the result. Only ids
+that exist are cached, so a name that is created later is found on the next lookup.
+Hit and miss counters are kept for the server dashboard.
+
+@author Osagie Owie
+@email owieo204@potsdam.edu
+"""
+
+import threading # Guards the cache shared by all client handler threads
+from collections import OrderedDict # Keeps entries in least-recently-used order
+
+
+class IdentityCache:
+    """
+    Initializes an empty cache
+
+    @param self IdentityCache instance
+    @param loader Function taking a name and returning its id, or None if it does not exist
+    @param capacity Integer maximum number of cached entries
+    """
+    def __init__(self, loader, capacity=10000):
+        self.loader = loader
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.generation = 0 # Bumped by invalidate so in-flight loads cannot store stale ids
+        self.hits = 0
+        self.misses = 0
+
+    """
+    get Resolves a name to its id, loading and caching it on a miss
+
+    @param self IdentityCache instance
+    @param name String username or chatroom name
+    @return Integer id, or None if the name does not exist
+    """
+    def get(self, name):
+        with self.lock:
+            if name in self.entries:
+                self.entries.move_to_end(name)
+                self.hits += 1
+                return self.entries[name]
+            self.misses += 1
+            generation = self.generation
+
+        value = self.loader(name) # Query outside the lock so other lookups are not blocked
+
+        if value is not None:
+            with self.lock:
+                if generation == self.generation:
+                    self._store(name, value)
+        return value
+
+    """
+    put Stores a known id, for example right after the row was inserted
+
+    @param self IdentityCache instance
+    @param name String username or chatroom name
+    @param value Integer id
+    """
+    def put(self, name, value):
+        with self.lock:
+            self.generation += 1
+            self._store(name, value)
+
+    """
+    invalidate Forgets a cached id after its row was changed or deleted
+
+    @param self IdentityCache instance
+    @param name String username or chatroom name
+    """
+    def invalidate(self, name):
+        with self.lock:
+            self.generation += 1
+            self.entries.pop(name, None)
+
+    # Must be called with self.lock held
+    def _store(self, name, value):
+        self.entries[name] = value
+        self.entries.move_to_end(name)
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last=False) # Evict the least recently used entry
+
+    """
+    hit_rate Returns the share of lookups answered from the cache
+
+    @param self IdentityCache instance
+    @return Float between 0 and 1
+    """
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
@@ -0,0 +1,530 @@
+"""
+MessageArchive.py moves old messages out of the live database into compressed archive segments.
+
+Every query, backup and index on messages and private_messages gets slower as the
+tables grow. Compaction moves messages past their retention period into segment
+files instead: each segment holds a run of consecutive messages of one chatroom, or
+of one private conversation, as zlib-compressed JSON. Segments are written once and
+never modified, and are listed in the archive_segments table with their message_id
+range, which is the index history, inbox and search use to find them. The live
+tables then only hold recent messages and stay small enough to be cached.
+
+A segment file is written and synced before the transaction that records it and
+deletes its messages from the live table, so a crash in between leaves at worst an
+unreferenced file, which the next compaction of the same messages overwrites.
+
+Retention is given in days per chatroom (chatrooms.retention_days, where NULL means
+the server default and 0 means never archive). Private messages use one server-wide
+period and are only archived once they have been read.
+
+The senders of each chatroom segment are listed in archive_senders, so removing a
+user only rewrites the segments that hold their messages.
+
+Archived text is searched through archive_fts, a contentless FTS5 index filled in
+the transaction that records each segment. The rowid of an entry is the segment_id
+times SEGMENT_ROWS plus the message's position in the segment, so a match leads
+straight to the one segment file to read.
+
+@author Osagie Owie
+@email owieo204@potsdam.edu
+"""
+
+import os
+import json
+import time
+import zlib # Compresses segment files
+import threading
+from collections import OrderedDict
+
+SEGMENT_MAGIC = b"CHATSEG1" # Identifies segment files and their format version
+SEGMENT_SIZE = 5000 # Messages per segment at most
+DELETE_CHUNK = 500 # Message ids per DELETE, below SQLite's bound parameter limit
+STATS_SECONDS = 60 # Age at which cached stats are read again, as other processes may compact too
+SEGMENT_ROWS = 1 << 20 # archive_fts rowids per segment: rowid = segment_id * SEGMENT_ROWS + position
+
+
+class MessageArchive:
+    """
+    Initializes the archive and creates its directory
+
+    @param self MessageArchive instance
+    @param db DatabasePool of the chat database
+    @param directory String path of the directory holding segment files, used for this database only
+    @param segment_size Integer maximum messages per segment
+    @param cache_segments Integer number of decoded segments kept in memory
+    @raise ValueError if segment_size does not fit in the search index's rowids
+    """
+    def __init__(self, db, directory, segment_size=SEGMENT_SIZE, cache_segments=32):
+        if not 0 < segment_size <= SEGMENT_ROWS:
+            raise ValueError(f"segment_size must be between 1 and {SEGMENT_ROWS}")
+        self.db = db
+        self.directory = directory
+        self.segment_size = segment_size
+        self.cache_segments = cache_segments
+        self.cache = OrderedDict() # Segment path -> list of message records
+        self.lock = threading.Lock() # Guards the cache
+        self.compact_lock = threading.Lock() # One compaction at a time
+        self.cached_stats = None # (monotonic time, stats) of the last stats query, reset by every write
+        self.private_mark = 0 # Highest private message_id scanned by compact_private
+        with db.connection() as conn: # The schema is migrated before the archive is opened
+            self.search_index = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'archive_fts'").fetchone() is not None
+        self.text_backfilled = not self.search_index # Set once no segment from before the index is left
+        os.makedirs(directory, exist_ok=True)
+
+    """
+    compact Archives every message older than its retention period
+
+    @param self MessageArchive instance
+    @param room_days Integer default retention in days for chatrooms without their own, None to keep forever
+    @param private_days Integer retention in days for read private messages, None to keep forever
+    @param now Float Unix time to measure retention from, defaults to the current time
+    @return Integer number of messages moved into the archive
+    """
+    def compact(self, room_days=None, private_days=None, now=None):
+        now = time.time() if now is None else now
+        with self.compact_lock:
+            with self.db.connection() as conn:
+                rooms = conn.execute("SELECT chatroom_id, retention_days FROM chatrooms").fetchall()
+            moved = 0
+            for chatroom_id, days in rooms:
+                days = room_days if days is None else days
+                if days: # None and 0 keep the room's messages live
+                    moved += self.compact_room(chatroom_id, self.cutoff(now, days))
+            if private_days:
+                moved += self.compact_private(self.cutoff(now, private_days))
+            self.index_old_segments()
+            if moved:
+                self.cached_stats = None
+            return moved
+
+    """
+    cutoff Formats the oldest timestamp that is still kept live
+
+    @param self MessageArchive instance
+    @param now Float Unix time
+    @param days Number of days of retention
+    @return String UTC timestamp in the format of CURRENT_TIMESTAMP
+    """
+    def cutoff(self, now, days):
+        return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(now - days * 86400))
+
+    """
+    compact_room Archives a chatroom's messages older than the cutoff
+
+    Messages are taken in message_id order and archiving stops at the first message
+    that is still recent, so every segment holds a contiguous message_id range.
+
+    @param self MessageArchive instance
+    @param chatroom_id Integer chatroom id
+    @param cutoff String timestamp; older messages are archived
+    @return Integer number of messages archived
+    """
+    def compact_room(self, chatroom_id, cutoff):
+        moved = 0
+        while True:
+            with self.db.connection() as conn:
+                rows = conn.execute("""
+                    SELECT m.message_id, m.user_id, u.username, m.message, m.timestamp
+                    FROM messages m
+                    LEFT JOIN users u ON m.user_id = u.user_id
+                    WHERE m.chatroom_id = ?
+                    ORDER BY m.message_id
+                    LIMIT ?
+                """, (chatroom_id, self.segment_size)).fetchall()
+                records = []
+                for message_id, sender_id, sender, message, timestamp in rows:
+                    if timestamp >= cutoff:
+                        break
+                    records.append({"message_id": message_id, "sender_id": sender_id, "sender": sender,
+                                    "message": message, "timestamp": timestamp})
+                if not records:
+                    return moved
+
+                path = self.write_segment(f"room-{chatroom_id}", records)
+                try:
+                    segment_id = conn.execute("""
+                        INSERT INTO archive_segments
+                        (kind, chatroom_id, first_message_id, last_message_id, message_count, path, senders_indexed,
+                         text_indexed)
+                        VALUES ('chat', ?, ?, ?, ?, ?, 1, ?)
+                    """, (chatroom_id, records[0]["message_id"], records[-1]["message_id"], len(records), path,
+                          int(self.search_index))).lastrowid
+                    self.index_senders(conn, segment_id, records)
+                    self.index_text(conn, segment_id, records)
+                    conn.execute("DELETE FROM messages WHERE chatroom_id = ? AND message_id BETWEEN ? AND ?",
+                                 (chatroom_id, records[0]["message_id"], records[-1]["message_id"]))
+                    conn.commit()
+                except:
+                    conn.rollback()
+                    raise
+            moved += len(records)
+            if len(records) < self.segment_size:
+                return moved
+
+    """
+    compact_private Archives read private messages older than the cutoff
+
+    Messages are grouped into one segment per conversation, so both participants
+    find them through the segment's user_a and user_b columns. Messages are only
+    scanned once: below private_mark, the highest message_id scanned before, only
+    the messages that were still unread then and have been read since are archived.
+
+    @param self MessageArchive instance
+    @param cutoff String timestamp; older read messages are archived
+    @return Integer number of messages archived
+    """
+    def compact_private(self, cutoff):
+        moved, _ = self.archive_private(cutoff, 0, self.private_mark) # Read since the last compaction
+        new_moved, self.private_mark = self.archive_private(cutoff, self.private_mark)
+        return moved + new_moved
+
+    """
+    archive_private Archives the read private messages older than the cutoff in a message_id range
+
+    @param self MessageArchive instance
+    @param cutoff String timestamp; older read messages are archived
+    @param after_id Integer exclusive lower bound on message_id
+    @param upto_id Integer inclusive upper bound on message_id, or None for no bound
+    @return Tuple (Integer number of messages archived, Integer highest message_id scanned)
+    """
+    def archive_private(self, cutoff, after_id, upto_id=None):
+        moved = 0
+        while True:
+            with self.db.connection() as conn:
+                rows = conn.execute("""
+                    SELECT p.message_id, p.sender_id, s.username, p.recipient_id, r.username,
+                           p.message, p.timestamp
+                    FROM private_messages p
+                    LEFT JOIN users s ON p.sender_id = s.user_id
+                    LEFT JOIN users r ON p.recipient_id = r.user_id
+                    WHERE p.message_id > ? AND p.message_id <= ? AND p.read = 1
+                    ORDER BY p.message_id
+                    LIMIT ?
+                """, (after_id, 2 ** 63 - 1 if upto_id is None else upto_id, self.segment_size)).fetchall()
+                conversations = {} # (user_a, user_b) -> records, oldest first
+                done = len(rows) < self.segment_size
+                for message_id, sender_id, sender, recipient_id, recipient, message, timestamp in rows:
+                    if timestamp >= cutoff:
+                        done = True
+                        break
+                    after_id = message_id
+                    pair = (min(sender_id, recipient_id), max(sender_id, recipient_id))
+                    conversations.setdefault(pair, []).append({
+                        "message_id": message_id, "sender_id": sender_id, "sender": sender,
+                        "recipient_id": recipient_id, "recipient": recipient,
+                        "message": message, "timestamp": timestamp})
+
+                for (user_a, user_b), records in conversations.items():
+                    path = self.write_segment(f"private-{user_a}-{user_b}", records)
+                    try:
+                        segment_id = conn.execute("""
+                            INSERT INTO archive_segments
+                            (kind, user_a, user_b, first_message_id, last_message_id, message_count, path, text_indexed)
+                            VALUES ('private', ?, ?, ?, ?, ?, ?, ?)
+                        """, (user_a, user_b, records[0]["message_id"], records[-1]["message_id"], len(records), path,
+                              int(self.search_index))).lastrowid
+                        self.index_text(conn, segment_id, records)
+                        ids = [record["message_id"] for record in records]
+                        for start in range(0, len(ids), DELETE_CHUNK):
+                            chunk = ids[start:start + DELETE_CHUNK]
+                            conn.execute(f"DELETE FROM private_messages WHERE message_id IN ({','.join('?' * len(chunk))})",
+                                         chunk)
+                        conn.commit()
+                    except:
+                        conn.rollback()
+                        raise
+                    moved += len(records)
+            if done:
+                return moved, after_id
+
+    """
+    write_segment Writes records to a new segment file and syncs it to disk
+
+    @param self MessageArchive instance
+    @param prefix String naming the chatroom or conversation
+    @param records List of message dictionaries, oldest first
+    @return String path of the segment file
+    """
+    def write_segment(self, prefix, records):
+        name = f"{prefix}-{records[0]['message_id']}-{records[-1]['message_id']}.seg" # Same name when redone after a crash
+        path = os.path.join(self.directory, name)
+        payload = zlib.compress(json.dumps(records, separators=(",", ":"), ensure_ascii=False).encode("utf-8"), 9)
+        temporary = path + ".tmp"
+        with open(temporary, "wb") as segment:
+            segment.write(SEGMENT_MAGIC + payload)
+            segment.flush()
+            os.fsync(segment.fileno())
+        os.replace(temporary, path) # Readers never see a partly written segment
+        return path
+
+    """
+    index_senders Lists the senders of a chatroom segment in archive_senders
+
+    @param self MessageArchive instance
+    @param conn sqlite3.Connection in the transaction that records the segment
+    @param segment_id Integer id of the segment in archive_segments
+    @param records List of the segment's message dictionaries
+    """
+    def index_senders(self, conn, segment_id, records):
+        senders = {record["sender_id"] for record in records if record["sender_id"] is not None}
+        conn.executemany("INSERT OR IGNORE INTO archive_senders (user_id, segment_id) VALUES (?, ?)",
+                         [(sender_id, segment_id) for sender_id in senders])
+
+    """
+    index_text Adds a segment's messages to archive_fts, or removes them
+
+    A contentless index cannot look up what it indexed, so removing entries takes
+    the same records that added them.
+
+    @param self MessageArchive instance
+    @param conn sqlite3.Connection in the transaction that records, rewrites or deletes the segment
+    @param segment_id Integer id of the segment in archive_segments
+    @param records List of the segment's message dictionaries, in segment order
+    @param remove Boolean remove the entries instead of adding them
+    """
+    def index_text(self, conn, segment_id, records, remove=False):
+        if not self.search_index:
+            return
+        entries = [(segment_id * SEGMENT_ROWS + position, record["message"] or "", f"user{record['sender_id']}")
+                   for position, record in enumerate(records)]
+        if remove:
+            conn.executemany("INSERT INTO archive_fts (archive_fts, rowid, message, sender) VALUES ('delete', ?, ?, ?)",
+                             entries)
+        else:
+            conn.executemany("INSERT INTO archive_fts (rowid, message, sender) VALUES (?, ?, ?)", entries)
+
+    """
+    index_old_segments Indexes the text of segments archived before archive_fts existed
+
+    Runs with compact_lock held, so purge_user cannot rewrite a segment meanwhile. The
+    text_indexed flag is claimed in the transaction that adds the entries, so a segment
+    another process indexed first is skipped.
+
+    @param self MessageArchive instance
+    """
+    def index_old_segments(self):
+        if self.text_backfilled or not self.search_index:
+            return
+        with self.db.connection() as conn:
+            pending = conn.execute("SELECT segment_id, path FROM archive_segments WHERE text_indexed = 0").fetchall()
+            for segment_id, path in pending:
+                try:
+                    if conn.execute("UPDATE archive_segments SET text_indexed = 1 WHERE segment_id = ? AND text_indexed = 0",
+                                    (segment_id,)).rowcount:
+                        self.index_text(conn, segment_id, self.read_segment(path))
+                    conn.commit()
+                except:
+                    conn.rollback()
+                    raise
+        self.text_backfilled = True
+
+    """
+    read_segment Reads a segment's records, using the cache of recently read segments
+
+    @param self MessageArchive instance
+    @param path String path of the segment file
+    @return List of message dictionaries, oldest first
+    @raise ValueError if the file is not a segment
+    """
+    def read_segment(self, path):
+        with self.lock:
+            if path in self.cache:
+                self.cache.move_to_end(path)
+                return self.cache[path]
+        with open(path, "rb") as segment:
+            data = segment.read()
+        if not data.startswith(SEGMENT_MAGIC):
+            raise ValueError(f"{path} is not an archive segment")
+        records = json.loads(zlib.decompress(data[len(SEGMENT_MAGIC):]).decode("utf-8"))
+        with self.lock:
+            self.cache[path] = records
+            if len(self.cache) > self.cache_segments:
+                self.cache.popitem(last=False)
+        return records
+
+    """
+    collect Gathers the newest matching records below a message_id from a set of segments
+
+    @param self MessageArchive instance
+    @param segments List of (last_message_id, path) rows ordered by last_message_id, newest first
+    @param before_id Integer exclusive upper bound on message_id, 0 for no bound
+    @param count Integer maximum number of records
+    @param accept Function taking a record and returning True if it belongs in the result
+    @return List of records, newest first
+    """
+    def collect(self, segments, before_id, count, accept=lambda record: True):
+        found = []
+        for last_message_id, path in segments:
+            if len(found) >= count and found[count - 1]["message_id"] > last_message_id:
+                break # Every remaining segment only holds older messages
+            for record in self.read_segment(path):
+                if (before_id <= 0 or record["message_id"] < before_id) and accept(record):
+                    found.append(record)
+            found.sort(key=lambda record: record["message_id"], reverse=True)
+        return found[:count]
+
+    """
+    room_messages Reads the newest archived messages of a chatroom below a message_id
+
+    @param self MessageArchive instance
+    @param chatroom_id Integer chatroom id
+    @param before_id Integer exclusive upper bound on message_id, 0 for no bound
+    @param count Integer maximum number of messages
+    @return List of records, oldest first
+    """
+    def room_messages(self, chatroom_id, before_id, count):
+        with self.db.connection() as conn:
+            segments = conn.execute("""
+                SELECT last_message_id, path FROM archive_segments
+                WHERE kind = 'chat' AND chatroom_id = ? AND first_message_id < ?
+                ORDER BY last_message_id DESC
+            """, (chatroom_id, before_id if before_id > 0 else 2 ** 63 - 1)).fetchall()
+        return list(reversed(self.collect(segments, before_id, count)))
+
+    """
+    private_messages Reads the newest archived private messages a user received below a message_id
+
+    @param self MessageArchive instance
+    @param user_id Integer id of the recipient
+    @param before_id Integer exclusive upper bound on message_id, 0 for no bound
+    @param count Integer maximum number of messages
+    @return List of records, newest first
+    """
+    def private_messages(self, user_id, before_id, count):
+        segments = self.conversation_segments(user_id, before_id)
+        return self.collect(segments, before_id, count, lambda record: record["recipient_id"] == user_id)
+
+    """
+    conversation_segments Lists the private segments of every conversation of a user
+
+    @param self MessageArchive instance
+    @param user_id Integer user id
+    @param before_id Integer exclusive upper bound on message_id, 0 for no bound
+    @return List of (last_message_id, path) rows, newest first
+    """
+    def conversation_segments(self, user_id, before_id=0):
+        with self.db.connection() as conn:
+            return conn.execute("""
+                SELECT last_message_id, path FROM archive_segments
+                WHERE kind = 'private' AND (user_a = ? OR user_b = ?) AND first_message_id < ?
+                ORDER BY last_message_id DESC
+            """, (user_id, user_id, before_id if before_id > 0 else 2 ** 63 - 1)).fetchall()
+
+    """
+    search Finds the archived messages that best match a full-text query
+
+    @param self MessageArchive instance
+    @param match String FTS5 MATCH expression of the words to find
+    @param user_id Integer id of the searching user, whose conversations are searched
+    @param chatroom_id Integer chatroom id to search only one room, or None for every room
+    @param sender_id Integer user id to search only messages sent by that user, or None
+    @param rooms Boolean search chatroom segments
+    @param private Boolean search the user's private segments
+    @param limit Integer maximum number of records
+    @return List of records with a "kind" of "chat" or "private", the segment's chatroom_id and
+            the bm25 "rank" of the match, best match first; empty without an archive_fts index
+    """
+    def search(self, match, user_id, chatroom_id=None, sender_id=None, rooms=True, private=True, limit=20):
+        if not self.search_index or not (rooms or private):
+            return []
+        if not self.text_backfilled:
+            with self.compact_lock:
+                self.index_old_segments()
+
+        scopes, params = [], []
+        if rooms:
+            scopes.append("(s.kind = 'chat'" + (" AND s.chatroom_id = ?)" if chatroom_id is not None else ")"))
+            params += [chatroom_id] if chatroom_id is not None else []
+        if private:
+            scopes.append("(s.kind = 'private' AND (s.user_a = ? OR s.user_b = ?))")
+            params += [user_id, user_id]
+        match = f"message : ({match})" # Words are only looked up in the text, never in the sender tokens
+        if sender_id is not None:
+            match += f" AND sender : user{int(sender_id)}"
+        with self.db.connection() as conn:
+            rows = conn.execute(f"""
+                SELECT archive_fts.rowid, bm25(archive_fts, 1.0, 0.0) AS rank, s.kind, s.chatroom_id, s.path
+                FROM archive_fts
+                JOIN archive_segments s ON s.segment_id = archive_fts.rowid / {SEGMENT_ROWS}
+                WHERE archive_fts MATCH ? AND ({' OR '.join(scopes)})
+                ORDER BY rank
+                LIMIT ?
+            """, (match, *params, limit)).fetchall()
+        return [dict(self.read_segment(path)[rowid % SEGMENT_ROWS], kind=kind, chatroom_id=segment_room, rank=rank)
+                for rowid, rank, kind, segment_room, path in rows]
+
+    """
+    purge_user Removes a deleted user's messages from the archive
+
+    Segments holding the user's messages are rewritten without them, or deleted when
+    nothing is left. This is the only operation that replaces a segment. Chatroom
+    segments are found through archive_senders; segments archived before it existed
+    are read once to list their senders.
+
+    @param self MessageArchive instance
+    @param user_id Integer id of the removed user
+    """
+    def purge_user(self, user_id):
+        with self.compact_lock, self.db.connection() as conn:
+            unindexed = conn.execute(
+                "SELECT segment_id, path FROM archive_segments WHERE kind = 'chat' AND senders_indexed = 0").fetchall()
+            for segment_id, path in unindexed:
+                self.index_senders(conn, segment_id, self.read_segment(path))
+                conn.execute("UPDATE archive_segments SET senders_indexed = 1 WHERE segment_id = ?", (segment_id,))
+                conn.commit()
+
+            segments = conn.execute("""
+                SELECT segment_id, chatroom_id, user_a, user_b, path, text_indexed FROM archive_segments
+                WHERE segment_id IN (SELECT segment_id FROM archive_senders WHERE user_id = ?)
+                UNION
+                SELECT segment_id, chatroom_id, user_a, user_b, path, text_indexed FROM archive_segments
+                WHERE user_a = ? OR user_b = ?
+            """, (user_id, user_id, user_id)).fetchall()
+            for segment_id, chatroom_id, user_a, user_b, path, text_indexed in segments:
+                records = self.read_segment(path)
+                kept = [record for record in records
+                        if user_id not in (record["sender_id"], record.get("recipient_id"))]
+                if len(kept) == len(records):
+                    continue
+                if text_indexed: # Positions shift, so the whole segment is indexed again
+                    self.index_text(conn, segment_id, records, remove=True)
+                    self.index_text(conn, segment_id, kept)
+                if kept:
+                    prefix = f"room-{chatroom_id}" if chatroom_id is not None else f"private-{user_a}-{user_b}"
+                    new_path = self.write_segment(prefix, kept)
+                    conn.execute("""
+                        UPDATE archive_segments
+                        SET first_message_id = ?, last_message_id = ?, message_count = ?, path = ?
+                        WHERE segment_id = ?
+                    """, (kept[0]["message_id"], kept[-1]["message_id"], len(kept), new_path, segment_id))
+                else:
+                    new_path = None
+                    conn.execute("DELETE FROM archive_segments WHERE segment_id = ?", (segment_id,))
+                # The other senders of a rewritten segment keep their entries
+                conn.execute("DELETE FROM archive_senders WHERE user_id = ? AND segment_id = ?", (user_id, segment_id))
+                conn.commit()
+                with self.lock:
+                    self.cache.pop(path, None)
+                if new_path != path: # The old file is no longer referenced
+                    os.remove(path)
+                self.cached_stats = None
+
+    """
+    stats Summarizes the archive for the server dashboard
+
+    The summary is cached until this archive writes a segment, or for STATS_SECONDS
+    when segments are written by another process.
+
+    @param self MessageArchive instance
+    @return Tuple (Integer segments, Integer archived messages)
+    """
+    def stats(self):
+        cached = self.cached_stats
+        if cached is not None and time.monotonic() - cached[0] < STATS_SECONDS:
+            return cached[1]
+        with self.db.connection() as conn:
+            segments, messages = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(message_count), 0) FROM archive_segments").fetchone()
+        self.cached_stats = (time.monotonic(), (segments, messages))
+        return segments, messages
@@ -0,0 +1,193 @@
+"""
+MessageWriter.py persists chat messages in batches on a dedicated writer thread.
+
+Committing every chat line on the sender's handler thread makes each message wait for
+a disk sync. MessageWriter queues the inserts instead and commits them in groups: a
+batch closes when it holds max_batch rows or max_delay seconds after its first row,
+whichever comes first, so one sync covers many messages under sustained traffic.
+Rows that are already queued when the deadline passes still join the batch. A flush
+closes the current batch right away instead of waiting for the deadline.
+
+Durability modes:
+    batched - callers continue immediately, the row is committed with the next batch
+    sync    - callers wait until the batch holding their row has been committed
+
+@author Osagie Owie
+@email owieo204@potsdam.edu
+"""
+
+import queue # Hands inserts from handler threads to the writer thread
+import logging
+import time
+from threading import Thread
+from concurrent.futures import Future # Reports the committed row id back to the caller
+
+DURABILITY_MODES = ("batched", "sync")
+_STOP = object() # Queue sentinel that ends the writer thread
+log = logging.getLogger("chitchat.writer")
+
+
+"""
+_report_failure Logs a row that could not be committed after its caller moved on
+
+@param future Future returned by MessageWriter.write
+"""
+def _report_failure(future):
+    if future.exception() is not None:
+        log.error("Error persisting message", extra={"error": str(future.exception())})
+
+
+class MessageWriter(Thread):
+    """
+    Initializes the writer and opens its dedicated database connection
+
+    @param self MessageWriter instance
+    @param db DatabasePool used to open the writer connection
+    @param durability String durability mode, "batched" or "sync"
+    @param max_batch Integer maximum number of rows per commit
+    @param max_delay Float maximum seconds a row waits for its batch to fill. Defaults
+                     to 0.02 in batched mode and 0 in sync mode, where callers are
+                     blocked and rows queued during the previous commit form the batch
+    """
+    def __init__(self, db, durability="batched", max_batch=256, max_delay=None):
+        super().__init__(name="MessageWriter", daemon=True)
+        if durability not in DURABILITY_MODES:
+            raise ValueError(f"Unknown durability mode '{durability}'")
+        self.durability = durability
+        self.max_batch = max_batch
+        self.max_delay = max_delay if max_delay is not None else (0.0 if durability == "sync" else 0.02)
+        self.queue = queue.Queue()
+        self.conn = db.connect() # Only ever used by the writer thread
+        if durability == "sync":
+            self.conn.execute("PRAGMA synchronous=FULL") # Each acknowledged batch survives power loss
+        self.batches_committed = 0
+        self.rows_committed = 0
+
+    """
+    write Queues an insert and returns without waiting for the commit in batched mode
+
+    @param self MessageWriter instance
+    @param sql String SQL statement to execute
+    @param params Tuple of statement parameters
+    @return Future resolving to the row id once the row is committed
+    """
+    def write(self, sql, params):
+        return self.wait(self.submit(sql, params))
+
+    """
+    submit Queues an insert without waiting, whatever the durability mode
+
+    Callers that must queue rows in a particular order under a lock use submit and
+    call wait once the lock is released.
+
+    @param self MessageWriter instance
+    @param sql String SQL statement to execute
+    @param params Tuple of statement parameters
+    @return Future resolving to the row id once the row is committed
+    """
+    def submit(self, sql, params):
+        future = Future()
+        self.queue.put((sql, params, future))
+        return future
+
+    """
+    wait Applies the durability mode to a submitted row
+
+    @param self MessageWriter instance
+    @param future Future returned by submit
+    @return The same future
+    """
+    def wait(self, future):
+        if self.durability == "sync":
+            future.result() # Wait for the batch holding this row to be committed
+        else:
+            future.add_done_callback(_report_failure)
+        return future
+
+    """
+    flush Blocks until every row queued before the call has been committed
+
+    @param self MessageWriter instance
+    @param timeout Float maximum seconds to wait
+    """
+    def flush(self, timeout=None):
+        barrier = Future()
+        self.queue.put((None, None, barrier))
+        barrier.result(timeout)
+
+    """
+    stop Commits the remaining rows and ends the writer thread
+
+    @param self MessageWriter instance
+    """
+    def stop(self):
+        self.queue.put(_STOP)
+        self.join()
+
+    """
+    run Collects queued rows into batches and commits them until stopped
+
+    @param self MessageWriter instance
+    """
+    def run(self):
+        stopping = False
+        while not stopping:
+            item = self.queue.get()
+            if item is _STOP:
+                break
+
+            batch = [item]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch and batch[-1][0] is not None: # A flush barrier closes the batch
+                remaining = deadline - time.monotonic()
+                try:
+                    if remaining > 0:
+                        item = self.queue.get(timeout=remaining)
+                    else:
+                        item = self.queue.get_nowait() # Past the deadline, only take rows already queued
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            self.commit(batch)
+        self.conn.close()
+
+    """
+    commit Executes a batch of inserts in one transaction
+
+    If the batch fails, it is rolled back and every row is retried in its own
+    transaction so a single bad row cannot discard the rest of the batch.
+
+    @param self MessageWriter instance
+    @param batch List of (sql, params, future) tuples
+    """
+    def commit(self, batch):
+        rows = [entry for entry in batch if entry[0] is not None]
+        if rows: # A batch of flush barriers alone writes nothing
+            try:
+                cursor = self.conn.cursor()
+                row_ids = []
+                for sql, params, _ in rows:
+                    cursor.execute(sql, params)
+                    row_ids.append(cursor.lastrowid)
+                self.conn.commit()
+                for (_, _, future), row_id in zip(rows, row_ids):
+                    future.set_result(row_id)
+            except Exception:
+                self.conn.rollback()
+                for sql, params, future in rows:
+                    try:
+                        cursor = self.conn.execute(sql, params)
+                        self.conn.commit()
+                        future.set_result(cursor.lastrowid)
+                    except Exception as e:
+                        self.conn.rollback()
+                        future.set_exception(e)
+            self.batches_committed += 1
+            self.rows_committed += len(rows)
+        for sql, _, future in batch:
+            if sql is None:
+                future.set_result(None) # Release flush() callers
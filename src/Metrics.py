@@ -0,0 +1,222 @@
+"""
+Metrics.py collects server metrics and serves them in the Prometheus text format.
+
+The server menu's status panel only shows the current clients and rooms. Metrics
+keeps counters and histograms (command latency, fan-out sizes, bytes, database time
+per query) that a Prometheus scraper can chart over time, including tail latency
+from the histogram buckets. Rates such as accepted connections per second are
+derived from the counters by the scraper, for example rate(chitchat_accepted_connections_total[1m]).
+
+Metrics is optional: the server only creates it, and only pays for the
+instrumentation, when it is started with a metrics port. The endpoint is served by
+the standard library's http.server, so no client library is needed.
+
+@author Osagie Owie
+@email owieo204@potsdam.edu
+"""
+
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0) # Seconds
+SIZE_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000) # Recipients per fan-out
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+"""
+_format_labels Renders a label set as {name="value",...}
+
+@param labels Tuple of (name, value) pairs
+@return String, empty when there are no labels
+"""
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+"""
+_format_value Renders a sample value the way Prometheus expects
+
+@param value Integer or float
+@return String
+"""
+def _format_value(value):
+    if isinstance(value, float) and value == float("inf"):
+        return "+Inf"
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+"""
+Family holds every labelled series of one metric.
+"""
+class Family:
+    def __init__(self, name, kind, help_text, buckets=None, function=None):
+        self.name = name
+        self.kind = kind # "counter", "gauge" or "histogram"
+        self.help = help_text
+        self.buckets = buckets
+        self.function = function # Called at scrape time for gauges and counters kept elsewhere
+        self.series = {} # Label tuple -> value, or [bucket counts, sum, count] for histograms
+        self.lock = threading.Lock()
+
+    """
+    render Appends the family's exposition lines
+
+    @param self Family instance
+    @param lines List of strings to append to
+    """
+    def render(self, lines):
+        lines.append(f"# HELP {self.name} {self.help}")
+        lines.append(f"# TYPE {self.name} {self.kind}")
+        if self.function is not None:
+            lines.append(f"{self.name} {_format_value(self.function())}")
+            return
+        with self.lock:
+            series = {labels: (list(value[0]), value[1], value[2]) if self.kind == "histogram" else value
+                      for labels, value in self.series.items()}
+        for labels, value in sorted(series.items()):
+            if self.kind != "histogram":
+                lines.append(f"{self.name}{_format_labels(labels)} {_format_value(value)}")
+                continue
+            counts, total, count = value
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_format_labels(labels + (('le', _format_value(float(bound))),))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(float(total))}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {count}")
+
+
+class Metrics:
+    """
+    Initializes an empty registry
+
+    @param self Metrics instance
+    """
+    def __init__(self):
+        self.families = {} # Metric name -> Family, in registration order
+        self.http_server = None
+
+    """
+    counter Registers a counter
+
+    @param self Metrics instance
+    @param name String metric name, ending in _total
+    @param help_text String description
+    @param function Function returning the current total when it is kept elsewhere, or None
+    """
+    def counter(self, name, help_text, function=None):
+        self.families[name] = Family(name, "counter", help_text, function=function)
+
+    """
+    gauge Registers a gauge read at scrape time
+
+    @param self Metrics instance
+    @param name String metric name
+    @param help_text String description
+    @param function Function returning the current value
+    """
+    def gauge(self, name, help_text, function):
+        self.families[name] = Family(name, "gauge", help_text, function=function)
+
+    """
+    histogram Registers a histogram
+
+    @param self Metrics instance
+    @param name String metric name
+    @param help_text String description
+    @param buckets Tuple of increasing upper bounds; +Inf is added automatically
+    """
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self.families[name] = Family(name, "histogram", help_text, buckets=tuple(buckets))
+
+    """
+    inc Adds to a counter
+
+    @param self Metrics instance
+    @param name String name of a registered counter
+    @param amount Number to add
+    @param labels Keyword arguments naming the series
+    """
+    def inc(self, name, amount=1, **labels):
+        family = self.families[name]
+        key = tuple(sorted(labels.items()))
+        with family.lock:
+            family.series[key] = family.series.get(key, 0) + amount
+
+    """
+    observe Records one value in a histogram
+
+    @param self Metrics instance
+    @param name String name of a registered histogram
+    @param value Number observed, for example a duration in seconds
+    @param labels Keyword arguments naming the series
+    """
+    def observe(self, name, value, **labels):
+        family = self.families[name]
+        key = tuple(sorted(labels.items()))
+        index = bisect.bisect_left(family.buckets, value) # Bucket bounds are inclusive
+        with family.lock:
+            series = family.series.get(key)
+            if series is None:
+                series = family.series[key] = [[0] * (len(family.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    """
+    render Produces the text exposition of every metric
+
+    @param self Metrics instance
+    @return String in the Prometheus text format
+    """
+    def render(self):
+        lines = []
+        for family in list(self.families.values()):
+            family.render(lines)
+        return "\n".join(lines) + "\n"
+
+    """
+    serve Starts the HTTP endpoint on a background thread
+
+    @param self Metrics instance
+    @param port Integer TCP port
+    @param host String address to bind, local only by default
+    """
+    def serve(self, port, host="127.0.0.1"):
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?", 1)[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass # Scrapes would flood the server console
+
+        self.http_server = ThreadingHTTPServer((host, port), Handler)
+        self.http_server.daemon_threads = True
+        threading.Thread(target=self.http_server.serve_forever, daemon=True).start()
+
+    """
+    close Stops the HTTP endpoint
+
+    @param self Metrics instance
+    """
+    def close(self):
+        if self.http_server is not None:
+            self.http_server.shutdown()
+            self.http_server.server_close()
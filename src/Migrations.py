@@ -0,0 +1,266 @@
+"""
+Migrations.py upgrades the chat database schema in place.
+
+The schema version is stored in SQLite's user_version header field. Every migration
+has a version number and a list of statements; migrate applies the migrations newer
+than the database's version in order, each in its own transaction together with the
+version bump, so an interrupted upgrade resumes from the last completed step. An
+existing chat_app.db created before versioning starts at version 0 and gets the
+baseline migration, which only creates tables that are missing.
+
+To change the schema, append a migration with the next version number. Never edit a
+migration that has already shipped. A migration's statements may also be a function
+of the connection returning the list, for steps that depend on the SQLite build.
+
+@author Osagie Owie
+@email owieo204@potsdam.edu
+"""
+
+import logging
+import sqlite3
+
+log = logging.getLogger("chitchat.migrations")
+
+
+"""
+fts5_available Checks whether the SQLite library was built with the FTS5 extension
+
+@param conn sqlite3.Connection to the chat database
+@return Boolean True if FTS5 virtual tables can be created
+"""
+def fts5_available(conn):
+    try:
+        conn.execute("CREATE VIRTUAL TABLE temp.fts5_probe USING fts5(text)")
+        conn.execute("DROP TABLE temp.fts5_probe")
+        return True
+    except sqlite3.OperationalError:
+        return False
+
+
+"""
+search_index_statements Builds the full-text search migration
+
+The FTS5 tables are external-content indexes over messages and private_messages:
+they store only the token index and read the text from the base tables. Triggers
+keep them in step with every insert, delete and edit, so MessageWriter's group
+commits index new messages in the same transaction that stores them. Without FTS5
+the migration is recorded but creates nothing, and search stays disabled.
+
+@param conn sqlite3.Connection to the chat database
+@return List of SQL statements
+"""
+def search_index_statements(conn):
+    if not fts5_available(conn):
+        log.warning("SQLite was built without FTS5, message search is disabled")
+        return []
+    statements = []
+    for table in ("messages", "private_messages"):
+        index = f"{table}_fts"
+        statements += [
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {index} USING fts5("
+            f"message, content='{table}', content_rowid='message_id', tokenize='unicode61 remove_diacritics 2')",
+            f"""CREATE TRIGGER IF NOT EXISTS {index}_insert AFTER INSERT ON {table} BEGIN
+                INSERT INTO {index} (rowid, message) VALUES (new.message_id, new.message);
+            END""",
+            f"""CREATE TRIGGER IF NOT EXISTS {index}_delete AFTER DELETE ON {table} BEGIN
+                INSERT INTO {index} ({index}, rowid, message) VALUES ('delete', old.message_id, old.message);
+            END""",
+            f"""CREATE TRIGGER IF NOT EXISTS {index}_update AFTER UPDATE OF message ON {table} BEGIN
+                INSERT INTO {index} ({index}, rowid, message) VALUES ('delete', old.message_id, old.message);
+                INSERT INTO {index} (rowid, message) VALUES (new.message_id, new.message);
+            END""",
+            f"INSERT INTO {index} ({index}) VALUES ('rebuild')", # Index the existing history
+        ]
+    return statements
+
+
+"""
+archive_search_statements Builds the full-text index of archived messages
+
+Archived messages live in compressed segment files, so there is no table for an
+external-content index to read from. archive_fts is contentless instead: it stores
+only the token index, with the text of each message under "message" and its sender
+as a "user<id>" token under "sender". Its rowid encodes the segment and the position
+of the message in it (see MessageArchive.SEGMENT_ROWS). Compaction fills it in the
+transaction that records each segment; segments archived before this version are
+indexed once by the archive, like archive_senders. Without FTS5 only the flag column
+is added.
+
+@param conn sqlite3.Connection to the chat database
+@return List of SQL statements
+"""
+def archive_search_statements(conn):
+    statements = ["ALTER TABLE archive_segments ADD COLUMN text_indexed INTEGER NOT NULL DEFAULT 0"]
+    if fts5_available(conn):
+        statements.append("CREATE VIRTUAL TABLE IF NOT EXISTS archive_fts USING fts5("
+                          "message, sender, content='', tokenize='unicode61 remove_diacritics 2')")
+    return statements
+
+
+"""
+has_search_index Checks whether the full-text search tables exist
+
+@param conn sqlite3.Connection to the chat database
+@return Boolean True if /search can use FTS5
+"""
+def has_search_index(conn):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'messages_fts'").fetchone() is not None
+
+
+MIGRATIONS = [
+    (1, "Baseline schema", [
+        '''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            password_hash TEXT NOT NULL,
+            salt TEXT NOT NULL
+        )''',
+        '''
+        CREATE TABLE IF NOT EXISTS chatrooms (
+            chatroom_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT UNIQUE NOT NULL,
+            admin_id INTEGER,
+            FOREIGN KEY (admin_id) REFERENCES users (user_id)
+        )''',
+        '''
+        CREATE TABLE IF NOT EXISTS chatroom_members (
+            chatroom_id INTEGER,
+            user_id INTEGER,
+            PRIMARY KEY (chatroom_id, user_id),
+            FOREIGN KEY (chatroom_id) REFERENCES chatrooms (chatroom_id),
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )''',
+        '''
+        CREATE TABLE IF NOT EXISTS messages (
+            message_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chatroom_id INTEGER,
+            user_id INTEGER,
+            message TEXT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (chatroom_id) REFERENCES chatrooms (chatroom_id),
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )''',
+        '''
+        CREATE TABLE IF NOT EXISTS private_messages (
+            message_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            sender_id INTEGER,
+            recipient_id INTEGER,
+            message TEXT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            read INTEGER DEFAULT 0,
+            FOREIGN KEY (sender_id) REFERENCES users (user_id),
+            FOREIGN KEY (recipient_id) REFERENCES users (user_id)
+        )''',
+    ]),
+    (2, "Indexes for the server's hot queries", [
+        # Chatroom history in time order
+        "CREATE INDEX IF NOT EXISTS idx_messages_chatroom_time ON messages (chatroom_id, timestamp)",
+        # Purging a removed user's chatroom messages
+        "CREATE INDEX IF NOT EXISTS idx_messages_user ON messages (user_id)",
+        # Unread counts are answered from the index alone
+        "CREATE INDEX IF NOT EXISTS idx_private_recipient_read ON private_messages (recipient_id, read)",
+        # Inbox listing, newest first
+        "CREATE INDEX IF NOT EXISTS idx_private_recipient_time ON private_messages (recipient_id, timestamp)",
+        # Purging a removed user's sent private messages
+        "CREATE INDEX IF NOT EXISTS idx_private_sender ON private_messages (sender_id)",
+        # Purging a removed user's memberships (the primary key starts with chatroom_id)
+        "CREATE INDEX IF NOT EXISTS idx_chatroom_members_user ON chatroom_members (user_id)",
+        "ANALYZE", # Give the query planner statistics for the new indexes
+    ]),
+    (3, "Keyset pagination index for the inbox", [
+        # Inbox pages walk message_id downwards from a cursor
+        "CREATE INDEX IF NOT EXISTS idx_private_recipient_id ON private_messages (recipient_id, message_id)",
+        # The inbox no longer orders by timestamp
+        "DROP INDEX IF EXISTS idx_private_recipient_time",
+        "ANALYZE",
+    ]),
+    (4, "Keyset pagination index for chatroom history", [
+        # /history pages and the join replay walk message_id downwards within a room
+        "CREATE INDEX IF NOT EXISTS idx_messages_chatroom_id ON messages (chatroom_id, message_id)",
+        # Room history no longer orders by timestamp
+        "DROP INDEX IF EXISTS idx_messages_chatroom_time",
+        "ANALYZE",
+    ]),
+    (5, "Full-text search over chatroom and private messages", search_index_statements),
+    (6, "Retention periods and the message archive index", [
+        # Days a room's messages stay live; NULL uses the server default, 0 keeps them forever
+        "ALTER TABLE chatrooms ADD COLUMN retention_days INTEGER",
+        '''
+        CREATE TABLE IF NOT EXISTS archive_segments (
+            segment_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            chatroom_id INTEGER,
+            user_a INTEGER,
+            user_b INTEGER,
+            first_message_id INTEGER NOT NULL,
+            last_message_id INTEGER NOT NULL,
+            message_count INTEGER NOT NULL,
+            path TEXT NOT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )''',
+        # History walks a room's segments downwards from a cursor
+        "CREATE INDEX IF NOT EXISTS idx_archive_room ON archive_segments (chatroom_id, last_message_id)",
+        # Inbox and search read both participants' conversations
+        "CREATE INDEX IF NOT EXISTS idx_archive_user_a ON archive_segments (user_a, last_message_id)",
+        "CREATE INDEX IF NOT EXISTS idx_archive_user_b ON archive_segments (user_b, last_message_id)",
+    ]),
+    (7, "Senders of archived chatroom segments", [
+        # Removing a user rewrites only the chatroom segments holding their messages
+        '''
+        CREATE TABLE IF NOT EXISTS archive_senders (
+            user_id INTEGER NOT NULL,
+            segment_id INTEGER NOT NULL,
+            PRIMARY KEY (user_id, segment_id)
+        ) WITHOUT ROWID''',
+        # Segments written before this version are indexed the first time a user is removed
+        "ALTER TABLE archive_segments ADD COLUMN senders_indexed INTEGER NOT NULL DEFAULT 0",
+    ]),
+    (8, "Full-text search over archived messages", archive_search_statements),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+"""
+schema_version Reads the schema version recorded in the database
+
+@param conn sqlite3.Connection to the chat database
+@return Integer schema version, 0 for a database that was never migrated
+"""
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+"""
+migrate Applies every migration newer than the database's schema version
+
+@param conn sqlite3.Connection to the chat database
+@return Integer schema version after the upgrade
+@raise RuntimeError if the database was written by a newer version of the server
+"""
+def migrate(conn):
+    version = schema_version(conn)
+    if version > LATEST_VERSION:
+        raise RuntimeError(f"Database schema version {version} is newer than this server "
+                           f"supports ({LATEST_VERSION})")
+
+    for target, description, statements in MIGRATIONS:
+        if target <= version:
+            continue
+        try:
+            conn.execute("BEGIN IMMEDIATE") # Also keeps a second server from migrating concurrently
+            if schema_version(conn) >= target: # Another process applied it while we waited
+                conn.rollback()
+                version = schema_version(conn)
+                continue
+            for statement in (statements(conn) if callable(statements) else statements):
+                conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {int(target)}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        log.info("Migrated database schema", extra={"version": target, "description": description})
+        version = target
+    return version
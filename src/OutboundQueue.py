@@ -0,0 +1,267 @@
+"""
+OutboundQueue.py gives every server session a bounded outbound queue.
+
+Sending straight to a client socket from the sender's thread lets one client with a
+full TCP window stall a whole chatroom. Instead, each session queues encoded frames
+and a writer owned by that session drains them, so a slow consumer only delays
+itself. The queue is bounded in bytes; when a consumer falls that far behind the
+configured policy decides what happens:
+
+    drop_oldest - discard the oldest droppable frames until the new frame fits
+    disconnect  - disconnect the slow consumer
+    coalesce    - replace a queued frame that carries the same coalesce key (for example
+                  an older unread-count notification), then drop the oldest droppable
+                  frames if the queue is still full
+
+Only frames queued as droppable, the chatroom messages fanned out to every member,
+are ever dropped. Acks and errors are awaited by the client and other events carry
+state it cannot ask for again, so when they do not fit even after every droppable
+frame is gone, the consumer is disconnected instead. Frames are only ever dropped
+whole, so the framing of the stream stays intact.
+
+@author Osagie Owie
+@email owieo204@potsdam.edu
+"""
+
+import socket
+import threading
+from collections import deque
+import Protocol # Framed connection used by the threaded engine
+
+POLICIES = ("drop_oldest", "disconnect", "coalesce")
+DEFAULT_MAX_BYTES = 1024 * 1024 # 1 MiB of pending frames per session
+
+
+"""
+OutboundStats aggregates queue counters across every session of the server.
+"""
+class OutboundStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.queued_frames = 0
+        self.queued_bytes = 0
+        self.dropped_frames = 0
+        self.dropped_bytes = 0
+        self.coalesced_frames = 0
+        self.disconnects = 0
+
+    def add(self, **counts):
+        with self.lock:
+            for name, value in counts.items():
+                setattr(self, name, getattr(self, name) + value)
+
+
+class OutboundQueue:
+    """
+    Initializes an empty queue
+
+    @param self OutboundQueue instance
+    @param max_bytes Integer maximum bytes of frames waiting to be written
+    @param policy String slow-consumer policy, one of POLICIES
+    @param stats OutboundStats shared by the server, or None
+    @param on_ready Function called after a frame is queued (used by the asyncio engine)
+    """
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, policy="drop_oldest", stats=None, on_ready=None):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown slow consumer policy '{policy}'")
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.stats = stats or OutboundStats()
+        self.on_ready = on_ready
+        self.frames = deque() # Entries are [frame, coalesce_key, droppable]
+        self.keyed = {} # Coalesce key -> queued entry
+        self.pending_bytes = 0
+        self.closed = False
+        self.overflowed = False # Set when the disconnect policy gave up on the consumer
+        self.ready = threading.Condition()
+        self.dropped_frames = 0
+        self.dropped_bytes = 0
+
+    """
+    put Queues an encoded frame for the session's writer
+
+    @param self OutboundQueue instance
+    @param frame Bytes produced by Protocol.encode_frame
+    @param coalesce_key Hashable key; a newer frame with the same key may replace this one
+    @param droppable Boolean the frame may be discarded when the consumer falls behind
+    @return Boolean False when the queue is closed or the consumer must be disconnected
+    """
+    def put(self, frame, coalesce_key=None, droppable=False):
+        with self.ready:
+            if self.closed:
+                return False
+
+            entry = None
+            if coalesce_key is not None and self.policy == "coalesce":
+                entry = self.keyed.get(coalesce_key) # Replaced in place below
+            growth = len(frame) - (len(entry[0]) if entry is not None else 0)
+
+            if self.pending_bytes + growth > self.max_bytes:
+                if self.policy != "disconnect":
+                    self._drop_until_fits(growth)
+                    if self.pending_bytes + growth > self.max_bytes and droppable and entry is None:
+                        self._count_dropped(1, len(frame)) # Nothing else could go, so the new frame does
+                        return True
+                if self.pending_bytes + growth > self.max_bytes:
+                    if self.policy == "disconnect" or any(not queued[2] for queued in self.frames):
+                        self.stats.add(disconnects=1)
+                        self.overflowed = True
+                        self._close()
+                        return False
+                    # Otherwise a single frame is larger than the limit and the consumer is not behind
+
+            if entry is not None:
+                entry[0] = frame
+                self.pending_bytes += growth
+                self.stats.add(coalesced_frames=1)
+                return True
+
+            entry = [frame, coalesce_key, droppable]
+            self.frames.append(entry)
+            if coalesce_key is not None:
+                self.keyed[coalesce_key] = entry
+            self.pending_bytes += len(frame)
+            self.stats.add(queued_frames=1, queued_bytes=len(frame))
+            self.ready.notify()
+
+        if self.on_ready:
+            self.on_ready()
+        return True
+
+    # Must be called with self.ready held. Frames that may not be dropped keep their order
+    # and are put back in front; there are few of them, as clients wait for their acks
+    def _drop_until_fits(self, size):
+        dropped = dropped_bytes = 0
+        kept = []
+        while self.frames and self.pending_bytes + size > self.max_bytes:
+            entry = self.frames.popleft()
+            frame, key, droppable = entry
+            if not droppable:
+                kept.append(entry)
+                continue
+            if key is not None and self.keyed.get(key) is entry:
+                del self.keyed[key]
+            self.pending_bytes -= len(frame)
+            dropped += 1
+            dropped_bytes += len(frame)
+        self.frames.extendleft(reversed(kept))
+        self._count_dropped(dropped, dropped_bytes)
+
+    # Must be called with self.ready held
+    def _count_dropped(self, frames, size):
+        self.dropped_frames += frames
+        self.dropped_bytes += size
+        self.stats.add(dropped_frames=frames, dropped_bytes=size)
+
+    """
+    take Removes every queued frame, blocking until one is available
+
+    @param self OutboundQueue instance
+    @param block Boolean wait for a frame when the queue is empty
+    @return List of frames, an empty list if nothing is queued and block is False,
+            or None once the queue is closed and drained
+    """
+    def take(self, block=True):
+        with self.ready:
+            while block and not self.frames and not self.closed:
+                self.ready.wait()
+            if not self.frames:
+                return None if self.closed else []
+            frames = [entry[0] for entry in self.frames]
+            self.frames.clear()
+            self.keyed.clear()
+            self.pending_bytes = 0
+            return frames
+
+    """
+    close Stops accepting frames; frames already queued are still written
+
+    @param self OutboundQueue instance
+    """
+    def close(self):
+        with self.ready:
+            self._close(discard=False)
+        if self.on_ready:
+            self.on_ready()
+
+    # Must be called with self.ready held
+    def _close(self, discard=True):
+        self.closed = True
+        if discard: # A disconnected slow consumer will never read its backlog
+            self.frames.clear()
+            self.keyed.clear()
+            self.pending_bytes = 0
+        self.ready.notify_all()
+
+
+"""
+QueuedConnection is the threaded engine's server-side connection.
+
+QueuedConnection sends through an OutboundQueue drained by a dedicated writer thread,
+which pipelines every pending frame in one sendall call. Receiving is inherited from
+Protocol.Connection.
+"""
+class QueuedConnection(Protocol.Connection):
+    def __init__(self, sock, outbound):
+        super().__init__(sock)
+        self.outbound = outbound
+        try:
+            self.peer = sock.getpeername() # Cached so the address is available after a disconnect
+        except OSError: # The client hung up before the connection was set up; recv reports it
+            self.peer = ("disconnected", 0)
+        threading.Thread(target=self.write_loop, daemon=True).start()
+
+    """
+    send_frame Queues encoded frame bytes without waiting for the client to read them
+
+    @param self QueuedConnection instance
+    @param frame Bytes produced by Protocol.encode_frame
+    @param coalesce_key Hashable key for the coalesce policy
+    @param droppable Boolean the frame may be discarded when the client falls behind
+    """
+    def send_frame(self, frame, coalesce_key=None, droppable=False):
+        if not self.outbound.put(frame, coalesce_key, droppable) and self.outbound.overflowed:
+            self.abort() # Slow consumer was disconnected by the policy
+
+    def send_message(self, message, coalesce_key=None):
+        self.send_frame(Protocol.encode_frame(message), coalesce_key)
+
+    """
+    write_loop Writes queued frames to the socket until the queue is closed
+
+    @param self QueuedConnection instance
+    """
+    def write_loop(self):
+        while True:
+            frames = self.outbound.take()
+            if frames is None:
+                break
+            try:
+                self.socket.sendall(b"".join(frames))
+            except OSError:
+                break
+        self.abort()
+
+    def getpeername(self):
+        return self.peer
+
+    """
+    close Closes the connection after the queued frames have been written
+
+    @param self QueuedConnection instance
+    """
+    def close(self):
+        self.outbound.close()
+
+    """
+    abort Closes the socket immediately, waking up a handler blocked in recv
+
+    @param self QueuedConnection instance
+    """
+    def abort(self):
+        self.outbound.close()
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.socket.close()
@@ -0,0 +1,100 @@
+"""
+PasswordHasher.py runs bcrypt password hashing on a pool of worker processes.
+
+bcrypt is deliberately slow, so hashing on the client handler threads lets a login
+storm (for example every client reconnecting after a restart) take over every core.
+PasswordHasher moves the hashing to a fixed number of worker processes and admits at
+most max_in_flight hashes at a time; requests beyond that are rejected immediately
+with ServerBusy so clients can retry instead of piling up behind each other.
+
+@author Osagie Owie
+@email owieo204@potsdam.edu
+"""
+
+import os
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import bcrypt # Provides secure password hashing for user authentication
+
+
+class ServerBusy(Exception):
+    """Raised when the maximum number of in-flight password hashes is reached."""
+
+
+"""
+_hashpw Hashes a password in a worker process
+
+@param password Bytes password
+@param salt Bytes bcrypt salt
+@return Bytes bcrypt hash
+"""
+def _hashpw(password, salt):
+    return bcrypt.hashpw(password, salt)
+
+
+class PasswordHasher:
+    """
+    Initializes the hashing pool
+
+    @param self PasswordHasher instance
+    @param workers Integer number of worker processes, defaults to one less than the CPU count
+    @param max_in_flight Integer maximum hashes running or queued at once, defaults to 4 per worker
+    """
+    def __init__(self, workers=None, max_in_flight=None):
+        self.workers = workers or max(1, (os.cpu_count() or 2) - 1) # Leave a core for networking
+        self.max_in_flight = max_in_flight or self.workers * 4
+        self.slots = threading.BoundedSemaphore(self.max_in_flight)
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        # spawn works on every platform and does not copy the server's threads into the workers
+        self.pool = ProcessPoolExecutor(max_workers=self.workers,
+                                        mp_context=multiprocessing.get_context("spawn"))
+
+    """
+    hashpw Hashes a password on the worker pool and waits for the result
+
+    @param self PasswordHasher instance
+    @param password Bytes password
+    @param salt Bytes bcrypt salt (or a stored hash's salt)
+    @return Bytes bcrypt hash
+    @raise ServerBusy when max_in_flight hashes are already admitted
+    """
+    def hashpw(self, password, salt):
+        if not self.slots.acquire(blocking=False):
+            with self.lock:
+                self.rejected += 1
+            raise ServerBusy("Server busy, please retry.")
+
+        with self.lock:
+            self.in_flight += 1
+        try:
+            return self.pool.submit(_hashpw, password, salt).result()
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+                self.completed += 1
+            self.slots.release()
+
+    """
+    queue_depth Returns the number of admitted hashes waiting for a free worker
+
+    @param self PasswordHasher instance
+    @return Integer queue depth
+    """
+    def queue_depth(self):
+        return max(0, self.in_flight - self.workers)
+
+    """
+    shutdown Stops the worker processes, cancelling queued hashes
+
+    Only the hashes already running are waited for. Returning before the workers have
+    exited leaves them behind when the server itself runs in a child process, because
+    its exit joins its own children before the pool could stop them.
+
+    @param self PasswordHasher instance
+    """
+    def shutdown(self):
+        self.pool.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,160 @@
+"""
+Profiler.py samples the stacks of every server thread to show where time goes.
+
+cProfile only sees the thread that enabled it and slows every call down while it
+runs. Profiler instead wakes up every few milliseconds, reads the current frame of
+every thread with sys._current_frames() and counts the stacks it sees, so handler
+threads, the MessageWriter and the executor threads of the asyncio engine are all
+covered. Nothing runs while no profile is being taken.
+
+Sampling measures wall-clock time: a thread blocked in recv or waiting for a lock is
+counted at the Python function that is waiting. The result is written as collapsed
+stacks ("thread;outer;inner count" per line), the input format of flamegraph.pl and
+speedscope, and summarized as the functions with the most samples.
+
+@author Osagie Owie
+@email owieo204@potsdam.edu
+"""
+
+import os
+import re
+import sys
+import time
+import threading
+from collections import Counter
+
+# Frames every thread starts with; left out so stacks begin at the thread's target
+THREAD_BOOTSTRAP = {threading.Thread._bootstrap.__code__, threading.Thread._bootstrap_inner.__code__,
+                    threading.Thread.run.__code__}
+
+
+class Profiler:
+    """
+    Initializes an idle profiler
+
+    @param self Profiler instance
+    @param interval Float seconds between samples
+    """
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.labels = {} # Code object -> "function (file:line)", so each is formatted once
+        self.ends_at = None
+        self.last_summary = None
+        self.last_error = None # Why the last profile could not be saved
+
+    """
+    running Checks whether a profile is being taken
+
+    @param self Profiler instance
+    @return Boolean True while sampling
+    """
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    """
+    start Samples every thread for a fixed window on a background thread
+
+    @param self Profiler instance
+    @param duration Float seconds to sample
+    @param directory String directory the collapsed stack file is written to
+    @param top Integer number of functions in the summary
+    @return Boolean False if a profile is already being taken
+    """
+    def start(self, duration, directory, top=15):
+        if self.running():
+            return False
+        self.stop_event.clear()
+        self.ends_at = time.monotonic() + duration
+        self.last_summary = self.last_error = None
+        self.thread = threading.Thread(target=self.run, args=(duration, directory, top), name="Profiler", daemon=True)
+        self.thread.start()
+        return True
+
+    """
+    stop Ends the current profile early; its results are still written
+
+    @param self Profiler instance
+    """
+    def stop(self):
+        self.stop_event.set()
+
+    """
+    wait Blocks until the current profile is finished
+
+    @param self Profiler instance
+    @return Dictionary summary of the profile, or None if none was taken or it could not be saved
+    """
+    def wait(self):
+        if self.thread is not None:
+            self.thread.join()
+        return self.last_summary
+
+    """
+    run Takes samples until the window ends, then writes and summarizes them
+
+    @param self Profiler instance
+    @param duration Float seconds to sample
+    @param directory String directory the collapsed stack file is written to
+    @param top Integer number of functions in the summary
+    """
+    def run(self, duration, directory, top):
+        stacks = Counter()
+        samples = 0
+        own = threading.get_ident()
+        started = time.monotonic()
+        while not self.stop_event.is_set() and time.monotonic() - started < duration:
+            names = {thread.ident: re.sub(r"-\d+", "", thread.name) for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    if frame.f_code not in THREAD_BOOTSTRAP:
+                        stack.append(self.label(frame.f_code))
+                    frame = frame.f_back
+                stack.append(names.get(ident, "thread"))
+                stacks[tuple(reversed(stack))] += 1 # Outermost first, as collapsed stacks expect
+            samples += 1
+            self.stop_event.wait(self.interval)
+        elapsed = time.monotonic() - started
+
+        path = os.path.join(directory, time.strftime("profile-%Y%m%d-%H%M%S.folded"))
+        try:
+            os.makedirs(directory, exist_ok=True)
+            with open(path, "w") as profile_file:
+                for stack, count in stacks.most_common():
+                    profile_file.write(f"{';'.join(stack)} {count}\n")
+        except OSError as e: # For example a read-only directory
+            self.last_error = f"Could not write {path}: {e.strerror or e}"
+            return
+        self.last_summary = self.summarize(stacks, samples, elapsed, path, top)
+
+    def label(self, code):
+        label = self.labels.get(code)
+        if label is None:
+            label = self.labels[code] = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+        return label
+
+    """
+    summarize Ranks functions by the samples that were in them
+
+    @param self Profiler instance
+    @param stacks Counter of stack tuples, thread name first
+    @param samples Integer number of sampling rounds
+    @param elapsed Float seconds sampled
+    @param path String path of the collapsed stack file
+    @param top Integer number of functions to keep
+    @return Dictionary with "samples", "seconds", "path", "stacks" (thread stacks
+            sampled), "self" (innermost function) and "total" (anywhere on the stack),
+            both lists of (function, thread stacks) pairs, most first
+    """
+    def summarize(self, stacks, samples, elapsed, path, top):
+        own, total = Counter(), Counter()
+        for stack, count in stacks.items():
+            own[stack[-1]] += count
+            for function in set(stack[1:]): # Recursion counts once per stack
+                total[function] += count
+        return {"samples": samples, "seconds": elapsed, "path": path, "stacks": sum(stacks.values()),
+                "self": own.most_common(top), "total": total.most_common(top)}
@@ -0,0 +1,206 @@
+"""
+Protocol.py implements the framed wire protocol shared by the chat server and clients.
+
+Every message on the wire is sent as a frame: a 4 byte big-endian length header followed
+by that many bytes of UTF-8 payload. Framing keeps message boundaries intact when TCP
+coalesces several sends into a single read or splits one long message across reads,
+and lets a sender pipeline many frames in a single system call.
+
+Clients send commands as plain text ("/login alice secret"). The server answers with
+typed events: compact JSON objects whose "type" field is one of EVENT_TYPES, so
+receivers dispatch on the type instead of scanning the text.
+
+    ack          - a command succeeded: command, message and command specific fields
+    error        - a command failed: command and message
+    chat         - a chatroom message: room, sender and message
+    private      - a private message: sender and message
+    notification - server initiated news: kind ("unread" or "shutdown") and message
+
+@author Osagie Owie
+@email owieo204@potsdam.edu
+"""
+
+import json # Encodes typed events
+import struct # Packs and unpacks the frame length header
+import threading # Guards connections shared between sending and receiving threads
+from collections import deque
+
+HEADER = struct.Struct("!I") # 4 byte unsigned big-endian payload length
+MAX_FRAME_SIZE = 1024 * 1024 # Largest payload accepted from a peer (1 MiB)
+RECV_SIZE = 65536 # Bytes requested from the socket per recv call
+EVENT_TYPES = ("ack", "error", "chat", "private", "notification")
+
+_event_encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":")) # No whitespace on the wire
+
+
+class ProtocolError(Exception):
+    """Raised when a peer sends a frame that violates the wire protocol."""
+
+
+"""
+encode_frame Wraps a single message in a length-prefixed frame
+
+@param message String or bytes payload to frame
+@return Bytes containing the header followed by the payload
+"""
+def encode_frame(message):
+    if isinstance(message, str):
+        message = message.encode('utf-8')
+    if len(message) > MAX_FRAME_SIZE:
+        raise ProtocolError(f"Frame of {len(message)} bytes exceeds the {MAX_FRAME_SIZE} byte limit")
+    return HEADER.pack(len(message)) + message
+
+
+"""
+encode_frames Frames several messages into one buffer so they can be sent with one call
+
+@param messages Iterable of string or bytes payloads
+@return Bytes containing every frame back to back
+"""
+def encode_frames(messages):
+    return b"".join(encode_frame(message) for message in messages)
+
+
+"""
+encode_event Encodes a typed event as a ready to send frame
+
+Broadcasts encode the event once and send the same bytes to every recipient.
+
+@param event_type String, one of EVENT_TYPES
+@param fields Keyword arguments with the event's JSON serializable fields
+@return Bytes frame
+"""
+def encode_event(event_type, **fields):
+    return encode_frame(_event_encoder.encode({"type": event_type, **fields}))
+
+
+"""
+decode_event Decodes the payload of a frame into an event
+
+@param payload String or bytes payload of one frame
+@return Dictionary with at least a "type" key
+@raise ProtocolError if the payload is not a typed event
+"""
+def decode_event(payload):
+    try:
+        event = json.loads(payload)
+    except ValueError as e:
+        raise ProtocolError(f"Malformed event: {e}") from None
+    if not isinstance(event, dict) or event.get("type") not in EVENT_TYPES:
+        raise ProtocolError(f"Unknown event: {payload[:80]!r}")
+    return event
+
+
+"""
+FrameReader reassembles frames from a stream of received bytes.
+
+FrameReader keeps a per-connection receive buffer. Bytes are fed in as they arrive and
+every complete frame is returned, while a partial frame stays buffered until the rest
+of it is received.
+"""
+class FrameReader:
+    def __init__(self):
+        self.buffer = bytearray()
+
+    """
+    feed Adds received bytes to the buffer and extracts every complete frame
+
+    @param self FrameReader instance
+    @param data Bytes received from the peer
+    @return List of payloads (bytes) for the frames completed by this data
+    """
+    def feed(self, data):
+        self.buffer += data
+        frames = []
+        offset = 0
+        while len(self.buffer) - offset >= HEADER.size:
+            (length,) = HEADER.unpack_from(self.buffer, offset)
+            if length > MAX_FRAME_SIZE:
+                raise ProtocolError(f"Peer announced a frame of {length} bytes")
+            end = offset + HEADER.size + length
+            if len(self.buffer) < end:
+                break # Wait for the rest of the frame
+            frames.append(bytes(self.buffer[offset + HEADER.size:end]))
+            offset = end
+        if offset:
+            del self.buffer[:offset] # Drop consumed frames in one step
+        return frames
+
+
+"""
+Connection wraps a blocking TCP socket with the framed protocol.
+
+Connection is used by the client, the stress tester and the threaded server engine.
+Sends are serialized with a lock so frames written by different threads never
+interleave, and received frames are buffered so that several frames read by one
+recv call are handed out one at a time.
+"""
+class Connection:
+    def __init__(self, sock):
+        self.socket = sock
+        self.reader = FrameReader()
+        self.pending = deque() # Complete frames not yet returned by recv_message
+        self.send_lock = threading.Lock()
+        self.recv_lock = threading.Lock()
+
+    """
+    send_message Sends a single message as one frame
+
+    @param self Connection instance
+    @param message String or bytes payload
+    """
+    def send_message(self, message):
+        self.send_frame(encode_frame(message))
+
+    """
+    send_messages Pipelines several messages with a single send call
+
+    @param self Connection instance
+    @param messages Iterable of string or bytes payloads
+    """
+    def send_messages(self, messages):
+        self.send_frame(encode_frames(messages))
+
+    """
+    send_frame Sends already encoded frame bytes
+
+    send_frame lets a caller encode a message once and send the same bytes to many
+    connections.
+
+    @param self Connection instance
+    @param frame Bytes produced by encode_frame or encode_frames
+    """
+    def send_frame(self, frame):
+        with self.send_lock:
+            self.socket.sendall(frame)
+
+    """
+    recv_message Blocks until the next complete message arrives
+
+    @param self Connection instance
+    @return Decoded message string, or None when the peer closed the connection
+    """
+    def recv_message(self):
+        with self.recv_lock:
+            while not self.pending:
+                data = self.socket.recv(RECV_SIZE)
+                if not data:
+                    return None
+                self.pending.extend(self.reader.feed(data))
+            return self.pending.popleft().decode('utf-8')
+
+    """
+    recv_event Blocks until the next event arrives
+
+    @param self Connection instance
+    @return Event dictionary, or None when the peer closed the connection
+    """
+    def recv_event(self):
+        message = self.recv_message()
+        return None if message is None else decode_event(message)
+
+    def getpeername(self):
+        return self.socket.getpeername()
+
+    def close(self):
+        self.socket.close()
@@ -0,0 +1,137 @@
+"""
+RoomHistory.py keeps the most recent messages of each active chatroom in memory.
+
+A user joining a chatroom gets the room's recent messages in the join response, so
+they enter a conversation instead of an empty screen. RoomHistory holds a fixed-size
+ring buffer per room. A room's buffer is warmed from the messages table the first
+time someone joins it, and every later message is appended in memory, so joins
+after the first do not read the database. Only the least recently used
+max_rooms buffers are kept.
+
+Recording a message and warming its room take the same lock, which orders the
+persistence of each new message against the warm-up query: a message is either
+already committed when its room is warmed or appended to the warmed buffer
+afterwards, never lost in between. The rooms are spread over a fixed set of striped
+locks, so a warm-up, which flushes the MessageWriter and may read the archive, only
+delays messages to rooms sharing its stripe. The index of buffers has its own lock,
+which is never held while loading.
+
+@author Osagie Owie
+@email owieo204@potsdam.edu
+"""
+
+import threading # Orders message appends against buffer warm-ups
+from collections import OrderedDict, deque
+
+STRIPES = 64 # Locks the rooms are spread over
+
+
+class RoomHistory:
+    """
+    Initializes an empty history
+
+    @param self RoomHistory instance
+    @param loader Function taking a chatroom name and a count and returning up to that many
+                  of the room's latest messages, oldest first, with every earlier message committed
+    @param capacity Integer number of messages kept per room
+    @param max_rooms Integer number of rooms kept in memory
+    """
+    def __init__(self, loader, capacity=50, max_rooms=1000):
+        self.loader = loader
+        self.capacity = capacity
+        self.max_rooms = max_rooms
+        self.rooms = OrderedDict() # Chatroom name -> deque of message dictionaries
+        self.lock = threading.Lock() # Guards rooms and generation only
+        self.stripes = [threading.Lock() for _ in range(STRIPES)] # Order each room's appends against its warm-up
+        self.generation = 0 # Incremented by clear, so a warm-up that raced it is discarded
+        self.warmups = 0
+
+    """
+    stripe Returns the lock ordering a room's appends and warm-up
+
+    @param self RoomHistory instance
+    @param room String chatroom name
+    @return threading.Lock shared by every room with the same hash modulo STRIPES
+    """
+    def stripe(self, room):
+        return self.stripes[hash(room) % STRIPES]
+
+    """
+    record Persists a new message and appends it to its room's buffer if the room is warm
+
+    @param self RoomHistory instance
+    @param room String chatroom name
+    @param entry Dictionary with the message's sender, message and timestamp
+    @param persist Function that queues the message for the database; it must not block
+    @return Whatever persist returned
+    """
+    def record(self, room, entry, persist):
+        with self.stripe(room):
+            result = persist()
+            with self.lock: # Buffers are read under the index lock alone
+                buffer = self.rooms.get(room)
+                if buffer is not None:
+                    buffer.append(entry)
+            return result
+
+    """
+    merge Appends a message another process already persisted, unless the buffer has it
+
+    The message may already be in the buffer when the room was warmed from the database
+    after the message was committed.
+
+    @param self RoomHistory instance
+    @param room String chatroom name
+    @param entry Dictionary with the message's message_id, sender, message and timestamp
+    """
+    def merge(self, room, entry):
+        with self.stripe(room):
+            with self.lock:
+                buffer = self.rooms.get(room)
+                if buffer is not None and all(known["message_id"] != entry["message_id"] for known in buffer):
+                    buffer.append(entry)
+
+    """
+    recent Returns a room's latest messages, warming the buffer on first use
+
+    The loader runs under the room's stripe but not the index lock. Another thread may
+    have warmed the room while this one waited for the stripe, and clear may have run
+    while loading, so the loaded messages are only kept if the buffer is still missing
+    and nothing was cleared.
+
+    @param self RoomHistory instance
+    @param room String chatroom name
+    @return List of message dictionaries, oldest first
+    """
+    def recent(self, room):
+        with self.lock:
+            buffer = self.rooms.get(room)
+            if buffer is not None:
+                self.rooms.move_to_end(room)
+                return list(buffer)
+
+        with self.stripe(room):
+            with self.lock:
+                buffer = self.rooms.get(room) # Warmed while waiting for the stripe
+                generation = self.generation
+            if buffer is not None:
+                return list(buffer)
+
+            messages = self.loader(room, self.capacity)
+            with self.lock:
+                self.warmups += 1
+                if generation == self.generation: # Not cleared while loading
+                    self.rooms[room] = deque(messages, maxlen=self.capacity)
+                    if len(self.rooms) > self.max_rooms:
+                        self.rooms.popitem(last=False) # Forget the least recently joined room
+            return messages[-self.capacity:]
+
+    """
+    clear Forgets every buffer, for example after messages were deleted from the database
+
+    @param self RoomHistory instance
+    """
+    def clear(self):
+        with self.lock:
+            self.rooms.clear()
+            self.generation += 1
@@ -0,0 +1,189 @@
+"""
+ServerLogger.py writes the server's log without slowing down the threads that log.
+
+Handler threads, the event loop and the background workers used to print() their
+events, which writes to the terminal while holding its lock and garbles the server
+console. ServerLogger attaches a QueueHandler to the "chitchat" logger instead: a
+logging call only puts the record on a bounded queue, and a single QueueListener
+thread formats the records and writes them to a size-rotated log file. When the
+queue is full the record is dropped and counted rather than making the caller wait.
+
+Records are written one JSON object per line, with the time, level, thread and
+message and any extra fields the caller passed, such as the command, user and latency
+of a handled command. Modules other than server.py log through child loggers
+("chitchat.cluster", ...), which end up in the same file.
+
+@author Osagie Owie
+@email owieo204@potsdam.edu
+"""
+
+import os
+import json
+import queue
+import logging
+import logging.handlers
+from datetime import datetime
+
+LOGGER_NAME = "chitchat"
+QUEUE_RECORDS = 10000 # Records waiting for the listener before new ones are dropped
+MAX_BYTES = 10 * 1024 * 1024 # Size of the log file before it is rotated
+BACKUP_COUNT = 5 # Rotated files kept, server.log.1 being the newest
+SLOW_COMMAND_SECONDS = 1.0 # Commands slower than this are logged as warnings; a bcrypt login takes a few tenths
+
+# Attributes every LogRecord has; anything else was passed by the caller as an extra field
+_STANDARD_ATTRIBUTES = set(logging.LogRecord("", 0, "", 0, "", None, None).__dict__) | {"message", "asctime"}
+
+
+"""
+StructuredFormatter renders a record as one line of JSON.
+"""
+class StructuredFormatter(logging.Formatter):
+    def format(self, record):
+        fields = {"time": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+                  "level": record.levelname, "logger": record.name, "thread": record.threadName,
+                  "message": record.getMessage()}
+        for key, value in record.__dict__.items():
+            if key not in _STANDARD_ATTRIBUTES:
+                fields[key] = value
+        if record.exc_info:
+            fields["exception"] = self.formatException(record.exc_info)
+        return json.dumps(fields, ensure_ascii=False, default=str)
+
+
+"""
+_DroppingQueueHandler hands records to the listener without ever blocking the caller.
+"""
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    def __init__(self, records):
+        super().__init__(records)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    # The listener formats the record; the caller only fixes its message, so arguments
+    # that change after the call are logged as they were
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+"""
+_Listener writes the queued records on its own thread.
+"""
+class _Listener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel) # Waits for room, so a full queue still stops the listener
+
+
+class ServerLogger:
+    """
+    Initializes the log file and starts the listener thread
+
+    @param self ServerLogger instance
+    @param path String path of the log file
+    @param level String or integer minimum level, for example "INFO" or "DEBUG"
+    @param echo Boolean also write the records to standard error, for servers without a console
+    @param max_bytes Integer size of the log file before it is rotated
+    @param backup_count Integer number of rotated files kept
+    """
+    def __init__(self, path, level="INFO", echo=False, max_bytes=MAX_BYTES, backup_count=BACKUP_COUNT):
+        self.path = path
+        self.logger = logging.getLogger(LOGGER_NAME)
+        self.logger.setLevel(level)
+        self.logger.propagate = False # Not handled again by the root logger
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        file_handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count,
+                                                            encoding="utf-8")
+        file_handler.setFormatter(StructuredFormatter())
+        handlers = [file_handler]
+        if echo:
+            stream_handler = logging.StreamHandler()
+            stream_handler.setFormatter(StructuredFormatter())
+            handlers.append(stream_handler)
+
+        self.handler = _DroppingQueueHandler(queue.Queue(QUEUE_RECORDS))
+        self.listener = _Listener(self.handler.queue, *handlers)
+        self.listener.start()
+        self.logger.addHandler(self.handler)
+
+    @property
+    def dropped(self):
+        return self.handler.dropped
+
+    def queued(self):
+        return self.handler.queue.qsize()
+
+    """
+    command Logs one handled client command
+
+    Every command is logged at DEBUG level, and commands slower than
+    SLOW_COMMAND_SECONDS also at the default INFO level, as warnings.
+
+    @param self ServerLogger instance
+    @param command String command name, for example "/login"
+    @param user String username the client is logged in as, or None
+    @param seconds Float time the command took
+    """
+    def command(self, command, user, seconds):
+        level = logging.WARNING if seconds >= SLOW_COMMAND_SECONDS else logging.DEBUG
+        if self.logger.isEnabledFor(level):
+            self.logger.log(level, "Slow command" if level == logging.WARNING else "Command",
+                            extra={"command": command, "user": user, "latency_ms": round(seconds * 1000, 3)})
+
+    """
+    close Writes the records still queued and closes the log file
+
+    @param self ServerLogger instance
+    """
+    def close(self):
+        self.logger.removeHandler(self.handler)
+        self.listener.stop()
+        for handler in self.listener.handlers:
+            handler.close()
+
+
+"""
+detach_inherited Removes the handlers a forked process inherited from its parent
+
+A process forked while the parent's ServerLogger was open still has its queue handler
+on the "chitchat" logger, but not the listener thread that empties the queue: records
+would fill it and then be dropped. A forked worker calls this before opening its own
+ServerLogger.
+"""
+def detach_inherited():
+    logger = logging.getLogger(LOGGER_NAME)
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+
+
+"""
+tail Returns the last lines of a file without reading all of it
+
+The file is read backwards in blocks from its end until enough lines were seen, so
+the cost depends on the lines asked for, not on the size of the log.
+
+@param path String path of the file
+@param count Integer number of lines
+@param block_size Integer bytes read at a time
+@return List of at most count strings, oldest first, without line endings
+@raise FileNotFoundError if the file does not exist
+"""
+def tail(path, count=20, block_size=8192):
+    with open(path, "rb") as log_file:
+        log_file.seek(0, os.SEEK_END)
+        position = log_file.tell()
+        data = b""
+        while position > 0 and data.count(b"\n") <= count: # One more newline than lines: the last one ends the file
+            step = min(block_size, position)
+            position -= step
+            log_file.seek(position)
+            data = log_file.read(step) + data
+    lines = data.decode("utf-8", errors="replace").splitlines()
+    return lines[-count:] if count > 0 else []
@@ -0,0 +1,192 @@
+"""
+SessionRegistry.py indexes the connected client sessions of the chat server.
+
+SessionRegistry maps every chatroom to the sessions currently subscribed to it, so a
+broadcast only touches the room's actual recipients instead of scanning every client
+and querying the database for the member list. The index is updated on join, exit
+and disconnect. It also maps every logged in username to all of that user's sessions,
+which makes private delivery and online checks constant time and lets a user logged in
+from several clients receive messages on each of them.
+
+Member maps and session sets are copy-on-write: writers build a new collection under a
+lock and swap it in, so broadcasting threads can iterate them without taking the lock.
+Every change also bumps a version number, so the server console only redraws its
+client and room lists when they actually changed.
+
+@author Osagie Owie
+@email owieo204@potsdam.edu
+"""
+
+import threading # Serializes index updates made by client handler threads
+
+
+class SessionRegistry:
+    """
+    Initializes an empty registry
+
+    @param self SessionRegistry instance
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.rooms = {} # Chatroom name -> {session: username}, replaced on every change
+        self.session_rooms = {} # Session -> set of chatroom names it has joined
+        self.users = {} # Username -> frozenset of sessions, replaced on every change
+        self.session_users = {} # Session -> username it is logged in as
+        self.version = 0 # Incremented on every change
+
+    """
+    add_user Records that a session is logged in as a user
+
+    A session that logs in again under another name is moved to the new user.
+
+    @param self SessionRegistry instance
+    @param session Connection of the authenticated client
+    @param username String username the session logged in as
+    """
+    def add_user(self, session, username):
+        with self.lock:
+            self._remove_user(session)
+            self.users[username] = self.users.get(username, frozenset()) | {session}
+            self.session_users[session] = username
+            self.version += 1
+
+    """
+    user_sessions Returns every session a user is logged in from
+
+    @param self SessionRegistry instance
+    @param username String username to look up
+    @return Frozenset of sessions, empty when the user is offline
+    """
+    def user_sessions(self, username):
+        return self.users.get(username, frozenset())
+
+    """
+    is_online Checks whether a user has at least one connected session
+
+    @param self SessionRegistry instance
+    @param username String username to look up
+    @return Boolean True if the user is online
+    """
+    def is_online(self, username):
+        return username in self.users
+
+    # Must be called with self.lock held
+    def _remove_user(self, session):
+        username = self.session_users.pop(session, None)
+        if username is None:
+            return
+        remaining = self.users.get(username, frozenset()) - {session}
+        if remaining:
+            self.users[username] = remaining
+        else:
+            self.users.pop(username, None)
+        self.version += 1
+
+    """
+    join_room Subscribes a session to a chatroom
+
+    @param self SessionRegistry instance
+    @param session Connection of the joining client
+    @param username String username of the joining client
+    @param room String chatroom name
+    """
+    def join_room(self, session, username, room):
+        with self.lock:
+            members = dict(self.rooms.get(room, {}))
+            members[session] = username
+            self.rooms[room] = members
+            self.session_rooms.setdefault(session, set()).add(room)
+            self.version += 1
+
+    """
+    leave_room Unsubscribes a session from a chatroom
+
+    @param self SessionRegistry instance
+    @param session Connection of the leaving client
+    @param room String chatroom name
+    @return Boolean True if the session had joined the room
+    """
+    def leave_room(self, session, room):
+        with self.lock:
+            return self._leave(session, room)
+
+    """
+    remove_session Unsubscribes a disconnected session from every chatroom it joined
+    and from its user's session set
+
+    @param self SessionRegistry instance
+    @param session Connection of the disconnected client
+    @return List of chatroom names the session was removed from
+    """
+    def remove_session(self, session):
+        with self.lock:
+            rooms = list(self.session_rooms.get(session, ()))
+            for room in rooms:
+                self._leave(session, room)
+            self._remove_user(session)
+            return rooms
+
+    # Must be called with self.lock held
+    def _leave(self, session, room):
+        members = self.rooms.get(room)
+        if not members or session not in members:
+            return False
+        members = dict(members)
+        del members[session]
+        if members:
+            self.rooms[room] = members
+        else:
+            del self.rooms[room] # Forget rooms without connected members
+
+        joined = self.session_rooms.get(session)
+        if joined is not None:
+            joined.discard(room)
+            if not joined:
+                del self.session_rooms[session]
+        self.version += 1
+        return True
+
+    """
+    room_members Returns the sessions subscribed to a chatroom
+
+    The returned dictionary is never modified afterwards and is safe to iterate
+    without holding the lock.
+
+    @param self SessionRegistry instance
+    @param room String chatroom name
+    @return Dictionary of session -> username
+    """
+    def room_members(self, room):
+        return self.rooms.get(room, {})
+
+    """
+    room_users Returns the usernames connected to a chatroom
+
+    @param self SessionRegistry instance
+    @param room String chatroom name
+    @return Set of usernames
+    """
+    def room_users(self, room):
+        return set(self.room_members(room).values())
+
+    """
+    active_rooms Returns a snapshot of every chatroom with connected members
+
+    @param self SessionRegistry instance
+    @return Dictionary of chatroom name -> set of usernames
+    """
+    def active_rooms(self):
+        return {room: set(members.values()) for room, members in list(self.rooms.items())}
+
+    """
+    clear Removes every session from the registry
+
+    @param self SessionRegistry instance
+    """
+    def clear(self):
+        with self.lock:
+            self.rooms = {}
+            self.session_rooms = {}
+            self.users = {}
+            self.session_users = {}
+            self.version += 1
@@ -0,0 +1,120 @@
+"""
+UnreadCounters.py keeps the unread private message count of every online user in memory.
+
+Counting unread rows in the database for each check puts a join on the hot path of
+every private message. UnreadCounters loads a user's count once when they log in,
+then adjusts it as messages are delivered or marked as read, so the server can push
+the new count to the user's sessions without querying the database. Users are
+forgotten when their last session disconnects.
+
+A count change and the database write that causes it happen under the same lock as
+the initial load, striped by username, so a write is either already reflected in the
+loaded count or applied to it afterwards. A write that fails after it was counted is
+taken back with revert, unless the count was loaded again since and never included it.
+
+@author Osagie Owie
+@email owieo204@potsdam.edu
+"""
+
+import threading # Orders count changes against the initial load
+
+
+class UnreadCounters:
+    """
+    Initializes an empty set of counters
+
+    @param self UnreadCounters instance
+    @param loader Function taking a username and returning its unread count from the
+                  database, including every message already handed to the database
+    @param stripes Integer number of locks usernames are spread over
+    """
+    def __init__(self, loader, stripes=64):
+        self.loader = loader
+        self.counts = {} # Username -> unread private messages
+        self.generations = {} # Username -> times its count was loaded, so revert can tell a reload happened
+        self.locks = [threading.Lock() for _ in range(stripes)]
+        self.loads = 0
+
+    def _lock(self, username):
+        return self.locks[hash(username) % len(self.locks)]
+
+    """
+    load Loads a user's count from the database unless it is already tracked
+
+    @param self UnreadCounters instance
+    @param username String username that logged in
+    @return Integer unread count
+    """
+    def load(self, username):
+        with self._lock(username):
+            if username not in self.counts:
+                self.counts[username] = self.loader(username)
+                self.generations[username] = self.generations.get(username, 0) + 1
+                self.loads += 1
+            return self.counts[username]
+
+    """
+    record Runs a database write and adjusts the user's count by its effect
+
+    @param self UnreadCounters instance
+    @param username String username whose messages are affected
+    @param persist Function performing the write; returns the change in unread messages
+                   (for example 1 for a new message, -3 after marking three as read)
+    @return Integer new count, or None if the user is not tracked
+    """
+    def record(self, username, persist):
+        with self._lock(username):
+            delta = persist()
+            if username not in self.counts:
+                return None
+            self.counts[username] = max(0, self.counts[username] + delta)
+            return self.counts[username]
+
+    """
+    generation Returns how often a user's count was loaded
+
+    Called from the persist function given to record, which already holds the user's
+    lock, to remember which load a write was counted against.
+
+    @param self UnreadCounters instance
+    @param username String username
+    @return Integer generation to pass to revert
+    """
+    def generation(self, username):
+        return self.generations.get(username, 0)
+
+    """
+    revert Takes back a change recorded for a write that then failed
+
+    @param self UnreadCounters instance
+    @param username String username whose count was changed
+    @param delta Integer change that was recorded
+    @param generation Integer generation returned while the change was recorded
+    @return Integer new count, or None if the count was forgotten or loaded again since
+    """
+    def revert(self, username, delta, generation):
+        with self._lock(username):
+            if username not in self.counts or self.generations.get(username, 0) != generation:
+                return None # A reload counted the rows the database actually has
+            self.counts[username] = max(0, self.counts[username] - delta)
+            return self.counts[username]
+
+    """
+    get Returns a tracked user's count
+
+    @param self UnreadCounters instance
+    @param username String username
+    @return Integer unread count, or None if the user is not tracked
+    """
+    def get(self, username):
+        return self.counts.get(username)
+
+    """
+    forget Stops tracking a user, for example after their last session disconnected
+
+    @param self UnreadCounters instance
+    @param username String username
+    """
+    def forget(self, username):
+        with self._lock(username):
+            self.counts.pop(username, None)
@@ -0,0 +1,204 @@
+"""
+WorkerBus.py relays chat events between the worker processes of one server.
+
+In worker mode several server processes accept connections on the same port
+(SO_REUSEPORT), so the members of a chatroom, or the two sides of a private
+conversation, may be connected to different workers. Each worker publishes the
+events its sessions produce on the bus and delivers the events published by the
+other workers to its own sessions.
+
+The bus is a hub on a Unix domain socket owned by the parent process. Every worker
+connects to it once; the hub forwards each frame a worker sends to every other
+worker. Frames use the length-prefixed framing of Protocol.py and carry one JSON
+object with a "type" and an "origin", the publishing worker's process id. When a
+worker's connection drops, the hub tells the others with a "worker_down" event.
+
+The hub writes to each worker through its own OutboundQueue and writer thread, so a
+worker that stops reading delays only its own frames. When one falls WORKER_QUEUE_BYTES
+behind, its chatroom messages are dropped; if other events still do not fit, the
+worker is disconnected from the bus.
+
+@author Osagie Owie
+@email owieo204@potsdam.edu
+"""
+
+import os
+import json
+import logging
+import time
+import socket
+import threading
+import Protocol # Length-prefixed framing, shared with the chat protocol
+import OutboundQueue # Per-worker send queues of the hub
+
+log = logging.getLogger("chitchat.bus")
+
+WORKER_QUEUE_BYTES = 16 * 1024 * 1024 # Frames queued for one worker before its chatroom messages are dropped
+# publish() writes the type first, so the hub recognizes chatroom messages without decoding them
+DROPPABLE_PREFIX = '{"type":"room",'
+
+
+"""
+BusHub forwards frames between the connected workers. It runs in the parent process.
+"""
+class BusHub:
+    """
+    Initializes the hub and binds its Unix domain socket
+
+    @param self BusHub instance
+    @param path String file system path of the socket
+    """
+    def __init__(self, path):
+        self.path = path
+        if os.path.exists(path):
+            os.unlink(path) # Left behind by a server that did not shut down cleanly
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.bind(path)
+        self.socket.listen()
+        self.workers = {} # QueuedConnection -> origin process id, once it said hello
+        self.lock = threading.Lock()
+        self.frames_relayed = 0
+
+    """
+    start Accepts worker connections on a background thread
+
+    @param self BusHub instance
+    """
+    def start(self):
+        threading.Thread(target=self.accept_loop, daemon=True).start()
+
+    def accept_loop(self):
+        while True:
+            try:
+                sock, _ = self.socket.accept()
+            except OSError:
+                break # Hub closed
+            worker = OutboundQueue.QueuedConnection(sock, OutboundQueue.OutboundQueue(WORKER_QUEUE_BYTES))
+            threading.Thread(target=self.relay_loop, args=(worker,), daemon=True).start()
+
+    """
+    relay_loop Forwards every frame one worker sends to all other workers
+
+    @param self BusHub instance
+    @param worker QueuedConnection of the worker
+    """
+    def relay_loop(self, worker):
+        origin = None
+        try:
+            while True:
+                message = worker.recv_message()
+                if message is None:
+                    break
+                if origin is None:
+                    origin = json.loads(message).get("origin")
+                    with self.lock:
+                        self.workers[worker] = origin
+                self.broadcast(Protocol.encode_frame(message), worker, message.startswith(DROPPABLE_PREFIX))
+        except (OSError, ValueError):
+            pass
+        finally:
+            with self.lock:
+                self.workers.pop(worker, None)
+            worker.abort()
+            if origin is not None: # Other workers forget who was online there
+                self.broadcast(Protocol.encode_frame(json.dumps({"type": "worker_down", "origin": origin})))
+
+    """
+    broadcast Queues a frame for every connected worker except the one it came from
+
+    @param self BusHub instance
+    @param frame Bytes produced by Protocol.encode_frame
+    @param sender QueuedConnection the frame came from, or None
+    @param droppable Boolean a worker's queue may discard the frame when the worker falls behind
+    """
+    def broadcast(self, frame, sender=None, droppable=False):
+        with self.lock:
+            targets = [worker for worker in self.workers if worker is not sender]
+            self.frames_relayed += 1
+        for worker in targets:
+            try:
+                worker.send_frame(frame, droppable=droppable)
+            except OSError:
+                pass # Its relay_loop notices the closed connection
+
+    """
+    close Stops accepting workers and removes the socket file
+
+    @param self BusHub instance
+    """
+    def close(self):
+        self.socket.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+"""
+WorkerBus is a worker's connection to the hub.
+"""
+class WorkerBus:
+    """
+    Connects to the hub, retrying while the parent is still starting it
+
+    @param self WorkerBus instance
+    @param path String file system path of the hub's socket
+    @param handler Function called with every event dictionary published by another worker
+    @param timeout Float seconds to keep retrying the connection
+    @raise OSError if the hub cannot be reached
+    """
+    def __init__(self, path, handler, timeout=10.0):
+        self.origin = os.getpid()
+        self.handler = handler
+        deadline = time.monotonic() + timeout
+        while True:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(path)
+                break
+            except OSError:
+                sock.close()
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.05)
+        self.connection = Protocol.Connection(sock)
+        self.published = 0
+        self.received = 0
+        self.publish("hello") # Lets the hub name this worker in worker_down events
+        threading.Thread(target=self.receive_loop, daemon=True).start()
+
+    """
+    publish Sends an event to every other worker
+
+    @param self WorkerBus instance
+    @param event_type String event type
+    @param fields Keyword arguments with the event's JSON-serializable fields
+    """
+    def publish(self, event_type, **fields):
+        try:
+            self.connection.send_message(json.dumps({"type": event_type, "origin": self.origin, **fields},
+                                                    separators=(",", ":"), ensure_ascii=False))
+            self.published += 1
+        except OSError:
+            pass # The hub is gone, for example while the server shuts down; receive_loop reports it
+
+    """
+    receive_loop Hands the events of other workers to the handler until the hub goes away
+
+    @param self WorkerBus instance
+    """
+    def receive_loop(self):
+        while True:
+            try:
+                message = self.connection.recv_message()
+            except OSError:
+                break
+            if message is None:
+                break
+            self.received += 1
+            try:
+                self.handler(json.loads(message))
+            except Exception:
+                log.exception("Error handling worker bus event")
+        log.info("Worker bus closed")
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,298 @@
+"""
+benchmark.py - Micro-benchmarks of the ChitChat server's hot paths
+
+stress_test.py measures the whole system over sockets. This script instead calls the
+server methods that every command ends up in directly, against a fresh temporary
+database, so their cost can be tracked from one change to the next:
+
+    broadcast_chatroom_message  one message to a room, cycling over --rooms rooms of --members members
+    authenticate_user           a login, including bcrypt on the hashing pool
+    register_user               a registration, including bcrypt on the hashing pool
+    send_private_message        a private message to an online user
+    get_private_messages        the first page of an inbox of --inbox messages
+    get_private_messages_deep   a page from the middle of that inbox
+    generate_layout             a full redraw of the server console's status panel
+    generate_layout_unchanged   a console refresh when nothing changed
+
+Sessions are stand-ins that only count the frames they are sent, so the fan-out
+timings include encoding and the session index but not socket writes. The
+database, users and messages are recreated on every run with a fixed seed.
+
+The results are printed as JSON. --save-baseline stores them, and --baseline compares a
+run against a stored file and exits with status 1 if the median time of any benchmark
+grew by more than --tolerance.
+
+Usage: python benchmark.py [OPTIONS]
+Options:
+  --rooms NUM              Chatrooms for the broadcast benchmark (default: 10)
+  --members NUM            Members per chatroom (default: 100)
+  --inbox NUM              Private messages in the benchmarked inbox (default: 20000)
+  --iterations NUM         Timed calls per benchmark (default: 500)
+  --auth-iterations NUM    Timed calls of the bcrypt benchmarks (default: 5)
+  --only NAME [NAME ...]   Run only these benchmarks
+  --durability MODE        MessageWriter durability, batched or sync (default: batched)
+  --output FILE            Also write the results to FILE
+  --save-baseline FILE     Store the results as the baseline
+  --baseline FILE          Compare the results with a stored baseline
+  --tolerance FRACTION     Allowed median slowdown before a regression is flagged (default: 0.25)
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import itertools
+import platform
+import argparse
+import tempfile
+import statistics
+import contextlib
+import multiprocessing
+from datetime import datetime
+import bcrypt
+import server
+import MessageWriter
+
+BENCHMARKS = ("broadcast_chatroom_message", "authenticate_user", "register_user", "send_private_message",
+              "get_private_messages", "get_private_messages_deep", "generate_layout", "generate_layout_unchanged")
+PASSWORD = "benchmark-password"
+SEED = 480
+
+
+"""
+BenchmarkSession stands for a connected client and only counts what it is sent.
+"""
+class BenchmarkSession:
+    def __init__(self, port):
+        self.peer = ("127.0.0.1", port)
+        self.frames = 0
+
+    def send_frame(self, frame, coalesce_key=None, droppable=False):
+        self.frames += 1
+
+    def send_message(self, message, coalesce_key=None):
+        self.frames += 1
+
+    def getpeername(self):
+        return self.peer
+
+    def close(self):
+        pass
+
+
+"""
+measure Times repeated calls of a function
+
+@param function Function called with the iteration number
+@param iterations Integer number of timed calls
+@param warmup Integer untimed calls made first, so caches and connections are warm
+@return Dictionary with the number of calls and their mean, median, 95th percentile and
+        fastest time in milliseconds, and the calls per second at the mean
+"""
+def measure(function, iterations, warmup=None):
+    for index in range(min(iterations, 10) if warmup is None else warmup):
+        function(index)
+    samples = []
+    for index in range(iterations):
+        started = time.perf_counter()
+        function(index)
+        samples.append(time.perf_counter() - started)
+    samples.sort()
+    mean = statistics.fmean(samples)
+    return {"iterations": iterations, "mean_ms": round(mean * 1000, 4),
+            "median_ms": round(statistics.median(samples) * 1000, 4),
+            "p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000, 4),
+            "min_ms": round(samples[0] * 1000, 4), "ops_per_sec": round(1 / mean, 1) if mean else None}
+
+
+"""
+seed_users Inserts users directly, sharing one password hash so no bcrypt runs
+
+@param chat_server Server to add the users to
+@param usernames List of username strings
+"""
+def seed_users(chat_server, usernames):
+    salt = bcrypt.gensalt()
+    password_hash = bcrypt.hashpw(PASSWORD.encode('utf-8'), salt).decode('utf-8')
+    with chat_server.db.connection() as conn:
+        conn.executemany("INSERT INTO users (username, password_hash, salt) VALUES (?, ?, ?)",
+                         [(username, password_hash, salt.decode('utf-8')) for username in usernames])
+        conn.commit()
+
+
+"""
+seed_inbox Inserts private messages for one user directly
+
+@param chat_server Server owning the database
+@param recipient String username receiving the messages
+@param senders List of usernames the messages are spread over
+@param count Integer number of messages
+@return Integer message_id of the message in the middle of the inbox
+"""
+def seed_inbox(chat_server, recipient, senders, count):
+    recipient_id = chat_server.user_ids.get(recipient)
+    sender_ids = [chat_server.user_ids.get(sender) for sender in senders]
+    rows = [(random.choice(sender_ids), recipient_id, f"inbox message {index} " + "x" * random.randint(10, 200),
+             random.randint(0, 1)) for index in range(count)]
+    with chat_server.db.connection() as conn:
+        conn.executemany("INSERT INTO private_messages (sender_id, recipient_id, message, read) VALUES (?, ?, ?, ?)",
+                         rows)
+        conn.commit()
+        return conn.execute("SELECT message_id FROM private_messages WHERE recipient_id = ? "
+                            "ORDER BY message_id LIMIT 1 OFFSET ?", (recipient_id, count // 2)).fetchone()[0]
+
+
+"""
+run_benchmarks Builds a server on a temporary database and times the selected benchmarks
+
+@param args argparse.Namespace of the command line options
+@return Dictionary of benchmark name -> timings returned by measure
+"""
+def run_benchmarks(args):
+    random.seed(SEED)
+    selected = set(args.only or BENCHMARKS)
+    results = {}
+
+    with tempfile.TemporaryDirectory(prefix="chitchat-benchmark-") as directory:
+        with contextlib.redirect_stdout(sys.stderr): # Startup messages stay out of the JSON output
+            chat_server = server.Server('127.0.0.1', 0, db_path=os.path.join(directory, "benchmark.db"),
+                                        durability=args.durability, auth_workers=1, compact_interval=0,
+                                        headless=True, log_path=os.path.join(directory, "server.log"),
+                                        log_level="ERROR")
+        port = chat_server.socket.getsockname()[1]
+        try:
+            members = [f"member{index}" for index in range(args.members)]
+            seed_users(chat_server, members + ["owner", "inbox_owner"])
+
+            # Every member is logged in and has joined every room
+            sessions = {}
+            for username in members:
+                session = sessions[username] = BenchmarkSession(port)
+                chat_server.client_info[session] = username
+                chat_server.client_peers[session] = (session.peer, datetime.now())
+                chat_server.sessions.add_user(session, username)
+            rooms = [f"room{index}" for index in range(args.rooms)]
+            for room in rooms:
+                chat_server.create_chatroom(room, "owner")
+                for username, session in sessions.items():
+                    chat_server.sessions.join_room(session, username, room)
+
+            if "broadcast_chatroom_message" in selected:
+                results["broadcast_chatroom_message"] = measure(
+                    lambda index: chat_server.broadcast_chatroom_message(
+                        rooms[index % len(rooms)], members[index % len(members)], f"benchmark message {index}"),
+                    args.iterations)
+                chat_server.message_writer.flush()
+
+            if "send_private_message" in selected:
+                results["send_private_message"] = measure(
+                    lambda index: chat_server.send_private_message(
+                        members[index % len(members)], members[(index + 1) % len(members)], f"private {index}"),
+                    args.iterations)
+                chat_server.message_writer.flush()
+
+            if selected & {"get_private_messages", "get_private_messages_deep"}:
+                middle = seed_inbox(chat_server, "inbox_owner", members[:20], args.inbox)
+                if "get_private_messages" in selected:
+                    results["get_private_messages"] = measure(
+                        lambda index: chat_server.get_private_messages("inbox_owner"), args.iterations)
+                if "get_private_messages_deep" in selected:
+                    results["get_private_messages_deep"] = measure(
+                        lambda index: chat_server.get_private_messages("inbox_owner", before_id=middle),
+                        args.iterations)
+
+            if selected & {"generate_layout", "generate_layout_unchanged"}:
+                status = server.ServerStatus(chat_server)
+                def redraw(index):
+                    status.rendered = None # Forget the last state so every panel is rebuilt
+                    status.generate_layout()
+                if "generate_layout" in selected:
+                    results["generate_layout"] = measure(redraw, args.iterations)
+                if "generate_layout_unchanged" in selected:
+                    results["generate_layout_unchanged"] = measure(lambda index: status.generate_layout(),
+                                                                   args.iterations)
+
+            if "register_user" in selected:
+                registered = itertools.count() # measure numbers the warmup and timed calls separately
+                results["register_user"] = measure(
+                    lambda index: chat_server.register_user(f"registered{next(registered)}", PASSWORD),
+                    args.auth_iterations, warmup=1)
+
+            if "authenticate_user" in selected:
+                results["authenticate_user"] = measure(
+                    lambda index: chat_server.authenticate_user("owner", PASSWORD), args.auth_iterations, warmup=1)
+        finally:
+            with contextlib.redirect_stdout(sys.stderr):
+                try:
+                    chat_server.shutdown_server()
+                except SystemExit:
+                    pass # shutdown_server ends the process when called from the menu
+    return {name: results[name] for name in BENCHMARKS if name in results}
+
+
+"""
+compare Flags the benchmarks whose median time grew past the tolerance
+
+@param results Dictionary of benchmark name -> timings of this run
+@param baseline Dictionary of benchmark name -> timings of the baseline run
+@param tolerance Float allowed relative slowdown, 0.25 for 25%
+@return Dictionary of benchmark name -> baseline and current median, relative change and
+        whether it is a regression, for the benchmarks present in both
+"""
+def compare(results, baseline, tolerance):
+    comparison = {}
+    for name, timings in results.items():
+        if name not in baseline or not baseline[name].get("median_ms"):
+            continue
+        change = timings["median_ms"] / baseline[name]["median_ms"] - 1
+        comparison[name] = {"baseline_median_ms": baseline[name]["median_ms"], "median_ms": timings["median_ms"],
+                            "change": round(change, 4), "regression": change > tolerance}
+    return comparison
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support() # The password hashing pool starts worker processes
+    parser = argparse.ArgumentParser(description="Benchmark the ChitChat server's hot paths")
+    parser.add_argument("--rooms", type=int, default=10, help="Chatrooms for the broadcast benchmark")
+    parser.add_argument("--members", type=int, default=100, help="Members per chatroom")
+    parser.add_argument("--inbox", type=int, default=20000, help="Private messages in the benchmarked inbox")
+    parser.add_argument("--iterations", type=int, default=500, help="Timed calls per benchmark")
+    parser.add_argument("--auth-iterations", type=int, default=5, help="Timed calls of the bcrypt benchmarks")
+    parser.add_argument("--only", nargs="+", choices=BENCHMARKS, help="Run only these benchmarks")
+    parser.add_argument("--durability", choices=MessageWriter.DURABILITY_MODES, default="batched",
+                        help="MessageWriter durability mode")
+    parser.add_argument("--output", help="Also write the results to this file")
+    parser.add_argument("--save-baseline", help="Store the results as the baseline in this file")
+    parser.add_argument("--baseline", help="Compare the results with the baseline stored in this file")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="Allowed relative slowdown of a median before it is a regression")
+    args = parser.parse_args()
+    if min(args.rooms, args.members, args.inbox, args.iterations, args.auth_iterations) < 1:
+        parser.error("--rooms, --members, --inbox, --iterations and --auth-iterations must be at least 1")
+
+    report = {"python": platform.python_version(), "platform": platform.platform(),
+              "created": datetime.now().isoformat(timespec="seconds"),
+              "parameters": {"rooms": args.rooms, "members": args.members, "inbox": args.inbox,
+                             "iterations": args.iterations, "auth_iterations": args.auth_iterations,
+                             "durability": args.durability},
+              "results": run_benchmarks(args)}
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline.get("parameters") != report["parameters"]:
+            print("Warning: the baseline was recorded with other parameters", file=sys.stderr)
+        report["comparison"] = compare(report["results"], baseline.get("results", {}), args.tolerance)
+        regressions = [name for name, change in report["comparison"].items() if change["regression"]]
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, "w") as results_file:
+                results_file.write(output + "\n")
+    if regressions:
+        print(f"Regressions beyond {args.tolerance:.0%}: {', '.join(regressions)}", file=sys.stderr)
+        sys.exit(1)
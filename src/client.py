@@ -79,8 +79,13 @@ from rich.console import Console
 from datetime import datetime # Handles date and time operations for message timestamps
 import time # 
 import NotificationHandler
+import Protocol # Length-prefixed message framing shared with the server
 from rich.table import Table
 
+INBOX_PAGE_SIZE = 20 # Private messages requested per inbox page
+HISTORY_PAGE_SIZE = 20 # Older chatroom messages requested per /more
+SEARCH_RESULTS = 20 # Best matches shown per search
+
 
 class Client:
     """
@@ -97,7 +102,9 @@ class Client:
     def __init__(self, HOST, PORT):
         self.socket = socket.socket() 
         self.socket.connect((HOST, PORT)) 
+        self.socket = Protocol.Connection(self.socket) # Send and receive length-prefixed frames
         self.shutdown_flag = False
+        self.unread_count = None # Pushed by the server whenever it changes
         self.clear_terminal() 
         self.notifications = NotificationHandler.NotificationHandler()  # Initialize notification handler
         self.authenticate() 
@@ -159,14 +166,14 @@ class Client:
                 print(Panel.fit("[bold green]Login[/bold green]", border_style="green"))
                 username = input("Username: ")
                 password = getpass.getpass("Password: ")
-                self.socket.send(f"/login {username} {password}".encode())
+                response = self.request(f"/login {username} {password}")
                 
             elif choice == '2':
                 self.clear_terminal()
                 print(Panel.fit("[bold cyan]Register New Account[/bold cyan]", border_style="cyan"))
                 username = input("Choose username: ")
                 password = getpass.getpass("Choose Password: ")
-                self.socket.send(f"/register {username} {password}".encode())
+                response = self.request(f"/register {username} {password}")
             
             elif choice == '3':
                 print(Panel.fit("[bold red]Exiting...[/bold red]", border_style="red"))
@@ -176,13 +183,12 @@ class Client:
                 print(Panel.fit("[bold red]Invalid choice[/bold red]", border_style="red"))
                 continue
             
-            response = self.socket.recv(1024).decode()
-            if "success" in response.lower():
+            if response["type"] == "ack":
                 self.name = username
                 print(Panel.fit("[bold green]Authentication successful![/bold green]", border_style="green"))
                 return
             else:
-                print(Panel.fit(f"[bold red]{response}\nPlease try again[/bold red]", border_style="red"))
+                print(Panel.fit(f"[bold red]{response['message']}\nPlease try again[/bold red]", border_style="red"))
 
     """
     client_main_menu method provides the main user interface for the chat application.
@@ -223,12 +229,14 @@ class Client:
             layout["header"]["middle"].update(Panel(Align.center("[bold]Main Menu[/bold]"), style="cyan"))
             layout["header"]["right"].update(Panel(Align.center("[link=https://cs-devel.potsdam.edu/S24-480-owieo204/tcp-chat]Chitchat[/link]"), style="green"))
 
-            option_content = """
+            unread = f" ({self.unread_count} unread)" if self.unread_count else ""
+            option_content = f"""
 1.[cyan] Create new Chatroom[/cyan]\n
 2.[cyan] Join existing Chatroom[/cyan]\n
-3.[cyan] Private Messages[/cyan]\n
-4.[cyan] Help[/cyan]\n
-5.[cyan] Exit[/cyan]\n
+3.[cyan] Private Messages{unread}[/cyan]\n
+4.[cyan] Search Messages[/cyan]\n
+5.[cyan] Help[/cyan]\n
+6.[cyan] Exit[/cyan]\n
        """
             layout["body"]["left"].update(Panel(option_content, title="[bold]Options[/bold]", style="green"))
         
@@ -240,12 +248,14 @@ class Client:
         
 [cyan]Chatroom Commands:[/cyan]
 [cyan]-[/cyan] [green]/view[/green] - Show users in current chatroom
+[cyan]-[/cyan] [green]/more[/green] - Load older chatroom messages
 [cyan]-[/cyan] [green]/exit[/green] - Leave current chatroom
 
 [cyan]General Commands:[/cyan]
 [cyan]-[/cyan] Create chatroom - Make a new chat space
 [cyan]-[/cyan] Join chatroom - Enter existing chat
 [cyan]-[/cyan] Private Messages - Send direct messages
+[cyan]-[/cyan] Search Messages - Find chatroom and private messages
 
         """
 
@@ -261,19 +271,17 @@ class Client:
                 chatroom_name = input("[green]Enter chatroom name:[/green] ")
                 if chatroom_name == "/exit":
                     continue
-                self.socket.send(f"/create_chatroom {chatroom_name}".encode())
-                response = self.socket.recv(1024).decode()
-                print(response)
+                response = self.request(f"/create_chatroom {chatroom_name}")
+                print(response["message"])
 
             elif choice == '2':
                 self.clear_terminal()
                 print(Panel.fit("[bold cyan]Join Existing Chatroom[/bold cyan]", border_style="cyan"))
                 # First, get and display available chatrooms
-                self.socket.send("/chatroom_view".encode())
-                response = self.socket.recv(1024).decode()
-                available_rooms = response.split(', ')
+                response = self.request("/chatroom_view")
+                available_rooms = response.get("chatrooms", [])
                 
-                if not response or response.isspace():
+                if not available_rooms:
                     print(Panel.fit("[yellow]No chatrooms available. Create one first![/yellow]", border_style="yellow"))
                     input("\nPress Enter to return to main menu...")
                     continue
@@ -291,11 +299,11 @@ class Client:
                     chatroom_index = int(chatroom_choice) - 1
                     if 0 <= chatroom_index < len(available_rooms):
                         chatroom_name = available_rooms[chatroom_index]
-                        self.socket.send(f"/join_chatroom {chatroom_name}".encode())
-                        response = self.socket.recv(1024).decode()
-                        print(response)
-                        if "Joined" in response:
-                            self.chatroom_screen(chatroom_name)
+                        response = self.request(f"/join_chatroom {chatroom_name}")
+                        print(response["message"])
+                        if response["type"] == "ack":
+                            self.chatroom_screen(chatroom_name, response.get("history", []),
+                                                 response.get("history_cursor"))
                     else:
                         print(Panel.fit("[red]Invalid chatroom number[/red]", border_style="red"))
                         input("\nPress Enter to continue...")
@@ -307,10 +315,13 @@ class Client:
                 self.private_chat_screen()
 
             elif choice == '4':
+                self.search_screen()
+
+            elif choice == '5':
                 self.help_screen()
             
-            elif choice == '5':
-                self.socket.send("/exit".encode())
+            elif choice == '6':
+                self.socket.send_message("/exit")
                 print("Exiting...")
                 self.socket.close()
                 os._exit(0)
@@ -341,16 +352,23 @@ class Client:
 
     @param self: Client instance 
     @param chatroom_name: String name of the chatroom to reference
+    @param history: List of the chatroom's recent messages sent with the join response, oldest first
+    @param history_cursor: Integer message_id below which /more loads older messages, None if there are none
     """
-    def chatroom_screen(self, chatroom_name):
+    def chatroom_screen(self, chatroom_name, history=(), history_cursor=None):
         self.clear_terminal()
         print(Panel.fit(f"[green]Chatroom: {chatroom_name}[/green]  |  [cyan]User: {self.name}[/cyan]", style="bold"))
         #print(f"Welcome to the chatroom {chatroom_name}! You ({self.name}), can start chatting now.")
     
 
         print("Type your messages below or type '/exit' to leave the chatroom.")
-        print("Type '/view' to view users in chatroom.\n")
-        Thread(target=self.receive_message, daemon=True).start() # Start thread to receive messages from the server
+        print("Type '/view' to view users in chatroom.")
+        print("Type '/more' to load older messages.\n")
+
+        self.history_cursor = history_cursor # Older pages are only requested on /more
+        self.show_history(history) # Recent messages sent before we joined
+        receiver = Thread(target=self.receive_message, daemon=True) # Start thread to receive messages from the server
+        receiver.start()
         
         while True:
             message = input("") # Chatroom message input
@@ -358,19 +376,35 @@ class Client:
             print(Panel(f"[cyan]{self.name}[/cyan]: {message}", style="cyan", width=60)) 
 
             if message.lower() == "/view": 
-                self.socket.send(f"/view_chatroom_users {chatroom_name}".encode()) # Send request to view chatroom users
-                response = self.socket.recv(1024).decode()
-                print(response)
-                print("\nContinue chatting below or type '/exit' to leave the chatroom.")
+                self.socket.send_message(f"/view_chatroom_users {chatroom_name}") # The receive thread prints the user list
                 continue  # Continue the chat loop after showing users
 
+            if message.lower() == "/more":
+                if self.history_cursor is None:
+                    print("No older messages.")
+                else: # The receive thread prints the page and moves the cursor
+                    self.socket.send_message(f"/history {chatroom_name} {self.history_cursor} {HISTORY_PAGE_SIZE}")
+                continue
+
             if message.lower() == "/exit": # Exit chatroom
-                self.socket.send(f"/exit_chatroom {chatroom_name}".encode()) # Send exit chatroom request to the server
+                self.socket.send_message(f"/exit_chatroom {chatroom_name}") # Send exit chatroom request to the server
                 print("Exiting chatroom...")
+                receiver.join(timeout=5) # The receive thread stops once the server confirms the exit
                 self.clear_terminal()
                 break
-            self.socket.send(f"/chatroom_message {chatroom_name} {message}".encode()) # Send message to chatroom
+            self.socket.send_message(f"/chatroom_message {chatroom_name} {message}") # Send message to chatroom
     
+    """
+    show_history Prints chatroom messages that were sent before the user joined
+
+    @param self: Client instance
+    @param messages: List of message dictionaries, oldest first
+    """
+    def show_history(self, messages):
+        for entry in messages:
+            print(Panel(f"[dim]{entry['timestamp']}[/dim] [bold blue]{entry['sender']}[/bold blue]: {entry['message']}",
+                        style="dim", width=60))
+
     """
     help_screen displays the help screen for the chat application.
 
@@ -396,9 +430,11 @@ class Client:
         - [green]Create Chatroom[/green]: Start your own chat space
         - [green]Join Chatroom[/green]: Enter existing chatrooms
         - [green]Private Messages[/green]: Send direct messages to users
+        - [green]Search Messages[/green]: Search every chatroom and your private messages
 
         [cyan]Chatroom Commands:[/cyan]
         - [green]/view[/green] - Show all users in current chatroom
+        - [green]/more[/green] - Load older messages
         - [green]/exit[/green] - Leave current chatroom
 
         [cyan]Private Messaging:[/cyan]
@@ -414,11 +450,66 @@ class Client:
             self.clear_terminal()
             self.client_main_menu()
     
+    """
+    request Sends a command to the server and waits for its ack or error event
+
+    Events that arrive in between, such as a private message pushed by the server,
+    are handed to handle_event so they are not mistaken for the response.
+
+    @param self: Client instance
+    @param command: String command to send, for example "/login alice secret"
+    @return: Dictionary ack or error event answering the command
+    """
+    def request(self, command):
+        self.socket.send_message(command)
+        name = command.split(" ", 1)[0]
+        while True:
+            event = self.socket.recv_event()
+            if event is None: # Server closed the connection
+                self.shutdown_flag = True
+                return {"type": "error", "command": name, "message": "Connection closed by server."}
+            if event["type"] in ("ack", "error") and event.get("command") == name:
+                return event
+            self.handle_event(event)
+
+    """
+    handle_event Reacts to an event the server pushed without being asked
+
+    handle_event raises desktop notifications for chat messages, private messages and
+    unread counts, and closes the client when the server shuts down or removes its account.
+
+    @param self: Client instance
+    @param event: Dictionary event decoded by Protocol.decode_event
+    """
+    def handle_event(self, event):
+        if event["type"] == "notification":
+            if event.get("kind") == "unread":
+                if self.unread_count is None and event["unread"]: # Desktop notification only for the count pushed at login
+                    self.notifications.notify_unread_messages(event["unread"])
+                self.unread_count = event["unread"]
+            elif event.get("kind") in ("shutdown", "account_removed"):
+                print(Panel.fit(f"[bold red]{event['message']}[/bold red]", border_style="red"))
+                self.shutdown_flag = True
+                try:
+                    self.socket.send_message("/exit")
+                except:
+                    pass
+                finally:
+                    self.socket.close()
+
+        elif event["type"] == "private":
+            self.notifications.notify_private_message(event["sender"], event["message"])
+
+        elif event["type"] == "chat":
+            if event["sender"] != self.name:  # Don't notify for own messages
+                self.notifications.notify_new_message(event["sender"], event["message"])
+
     """
     receive_message continuously listens for messages from the server
      
-    receive_message continuously listens for messages from the server and displays them to the user. 
-    The method runs in a loop and breaks when the server sends an exit message.
+    receive_message continuously listens for events from the server while the user is in
+    a chatroom and displays them to the user. The method runs in a loop and breaks when
+    the server confirms that the user left the chatroom.
 
     @param self: Client instance
     """
@@ -426,52 +517,44 @@ class Client:
         
         while not self.shutdown_flag:
             try:
-                server_message = self.socket.recv(1024).decode()
+                event = self.socket.recv_event()
+
+                if event is None: # Server closed the connection
+                    print("Connection closed by server.")
+                    break
                 
-                # Handle server exit message
-                if server_message == "exit":
+                # Handle the server's confirmation that we left the chatroom
+                if event["type"] == "ack" and event.get("command") == "/exit_chatroom":
                     print("You have been returned to the main menu.")
                     break
-                    
-                # Handle notification commands from server
-                if server_message.startswith("/notification"):
-                    _, notification_msg = server_message.split(" ", 1)
-                    self.notifications.notify_unread_messages(
-                        int(''.join(filter(str.isdigit, notification_msg)))
-                    )
+
+                # A page of older messages requested with /more
+                if event["type"] == "ack" and event.get("command") == "/history":
+                    print(Panel.fit("[dim]Earlier messages[/dim]", border_style="dim"))
+                    self.show_history(event["messages"])
+                    self.history_cursor = event["next_cursor"] if event["has_more"] else None
                     continue
-                    
-                # Handle private messages
-                if server_message.startswith("[Private from"):
-                    sender = server_message[12:].split("]")[0].strip()
-                    message = server_message.split("]: ")[1]
-                    self.notifications.notify_private_message(sender, message)
-
-                if server_message.startswith("Server is shutting down..."):
-                    print(Panel.fit("[bold red]Server is shutting down...[/bold red]", border_style="red"))
-                    self.shutdown_flag = True
-                    try:
-                        self.socket.send("/exit".encode())
-                    except:
-                        pass
-                    finally:
-                        self.socket.close()
-                    break 
-                
-                
-                # Handle regular chatroom messages
-                elif ":" in server_message:
-                    try:
-                        sender = server_message.split(":")[0].strip().replace("[bold blue]", "").replace("[/bold blue]", "")
-                        message = ":".join(server_message.split(":")[1:]).strip()
-                        if sender != self.name:  # Don't notify for own messages
-                            self.notifications.notify_new_message(sender, message)
-                    except IndexError:
-                        pass  # Malformed message, skip notification
+
+                # Answers to commands sent from the chatroom screen, such as /view
+                if event["type"] in ("ack", "error"):
+                    print(event["message"])
+                    print("\nContinue chatting below or type '/exit' to leave the chatroom.")
+                    continue
+
+                self.handle_event(event)
+                if self.shutdown_flag: # Server is shutting down
+                    break
+
+                if event["type"] == "chat":
+                    text = f"[bold blue]{event['sender']}[/bold blue]: {event['message']}"
+                elif event["type"] == "private":
+                    text = f"[Private from {event['sender']}]: {event['message']}"
+                else:
+                    continue # Notifications are shown by the notification handler
                 
                 # Display the message
                 current_time = datetime.now().strftime("%H:%M")
-                print(Panel(f"[cyan]{current_time}[/cyan] {server_message}", 
+                print(Panel(f"[cyan]{current_time}[/cyan] {text}", 
                         style="green", width=60))
                         
             except Exception as e:
@@ -479,6 +562,50 @@ class Client:
                 self.socket.close()
                 break
 
+    """
+    search_screen - Searches chatroom and private messages
+
+    search_screen asks for search words and an optional chatroom or sender to narrow
+    the search to, then shows the best matching messages first.
+
+    @param self: Client instance
+    """
+    def search_screen(self):
+        self.clear_terminal()
+        print(Panel.fit("[bold cyan]Search Messages[/bold cyan]", border_style="cyan"))
+
+        query = input("\nSearch for (end a word with * to match prefixes): ").strip()
+        if not query or query == "/exit":
+            self.clear_terminal()
+            return
+        print("Search in: [cyan]1[/cyan] everything, [cyan]2[/cyan] one chatroom, "
+              "[cyan]3[/cyan] messages from one user, [cyan]4[/cyan] private messages")
+        choice = input(">> ").strip()
+        if choice == "2":
+            scope = "room:" + input("Chatroom name: ").strip()
+        elif choice == "3":
+            scope = "user:" + input("Username: ").strip()
+        elif choice == "4":
+            scope = "private"
+        else:
+            scope = "all"
+
+        response = self.request(f"/search {scope} {SEARCH_RESULTS} {query}")
+        if response["type"] != "ack":
+            print(Panel(f"[red]{response['message']}[/red]", border_style="red"))
+        elif not response["results"]:
+            print(Panel("No messages found.", style="yellow"))
+        else:
+            print(response["message"])
+            for result in response["results"]:
+                where = (f"#{result['room']}" if result["kind"] == "chat"
+                         else f"Private to {result['recipient']}")
+                print(Panel(f"[bold blue]{result['sender']}[/bold blue]: {result['message']}",
+                            title=f"{where} · {result['timestamp']}", border_style="cyan"))
+
+        input("\nPress Enter to return to main menu...")
+        self.clear_terminal()
+
     """
     private_chat_screen - Shows private messaging menu interface
     
@@ -537,12 +664,33 @@ class Client:
                 print(Panel.fit("[bold red]Invalid choice[/bold red]", border_style="red"))
                 time.sleep(1)
 
+    """
+    inbox_pages - Lazily fetches the user's inbox one page at a time
+    
+    inbox_pages is a generator that requests the next page from the server only when
+    the caller asks for it, following the server's next_cursor until no pages are left.
+    
+    @param self: Client instance
+    @param page_size: Integer number of messages per page
+    @return: Generator of page dictionaries with "messages" (newest first) and "has_more"
+    """
+    def inbox_pages(self, page_size=INBOX_PAGE_SIZE):
+        cursor = 0
+        while True:
+            page = self.request(f"/get_messages {cursor} {page_size}")
+            if page["type"] == "error":
+                raise ConnectionError(page["message"])
+            yield page
+            if not page["has_more"]:
+                return
+            cursor = page["next_cursor"]
+
     """
     view_inbox - Displays user's private message inbox
     
-    view_inbox retrieves and displays all private messages for the current user
-    with sender info, timestamp, and read status. Allows marking unread messages
-    as read and navigating message history.
+    view_inbox displays the current user's private messages page by page with sender
+    info, timestamp, and read status. Older pages are only downloaded when the user
+    asks for them. Allows marking unread messages as read.
     
     @param self: Client instance
     """
@@ -550,38 +698,47 @@ class Client:
         self.clear_terminal()
         print(Panel.fit("[bold cyan]Inbox[/bold cyan]", border_style="green"))
         
-        self.socket.send("/get_messages".encode())
-        response = self.socket.recv(1024).decode()
-        
         try:
-            messages = eval(response)  # Convert string representation back to list
-            if not messages:
-                print(Panel("No messages in inbox.", style="yellow"))
-                input("\nPress Enter to return to private chat menu...")
-                return
+            pages = self.inbox_pages()
+            shown = 0
+            newest_id = None
+            for page in pages:
+                messages = page["messages"]
+                if newest_id is None and messages:
+                    newest_id = messages[0]["message_id"] # Pages are newest first
+                selected = []
+                # Display messages in a panel   
+                for msg in messages:
+                    status_color = "red" if msg["status"] == "Unread" else "green"
+                    
+                    message_panel = Panel(
+                        f"[bold blue]From:[/bold blue] {msg['sender']}\n"
+                        f"[bold blue]Time:[/bold blue] {msg['timestamp']}\n"
+                        f"[bold blue]Status:[/bold blue] [{status_color}]{msg['status']}[/{status_color}]\n"
+                        f"[bold blue]Message:[/bold blue] {msg['message']}",
+                        title=f"Message ID:{msg['message_id']}",
+                        border_style="cyan"
+                    )
+                    print(message_panel)
+                    
+                    # Mark as read option, sent for the whole page at once
+                    if msg["status"] == 'Unread':
+                        if input("\nMark as read? (y/n): ").lower() == 'y':
+                            selected.append(msg["message_id"])
+                    print() 
+                shown += len(messages)
+                if selected:
+                    self.mark_read(f"/mark_read {' '.join(map(str, selected))}")
+
+                # The generator only asks the server for the next page if the user wants it
+                if page["has_more"] and input("Load older messages? (y/n): ").lower() != 'y':
+                    pages.close()
+                    break
 
-            # Display messages in a panel   
-            for msg in messages:
-                sender, content, timestamp, msg_id, status = msg
-                status_color = "red" if status == "Unread" else "green"
-                
-                message_panel = Panel(
-                    f"[bold blue]From:[/bold blue] {sender}\n"
-                    f"[bold blue]Time:[/bold blue] {timestamp}\n"
-                    f"[bold blue]Status:[/bold blue] [{status_color}]{status}[/{status_color}]\n"
-                    f"[bold blue]Message:[/bold blue] {content}",
-                    title=f"Message ID:{msg_id}",
-                    border_style="cyan"
-                )
-                print(message_panel)
-                
-                # Mark as read option
-                if status == 'Unread':
-                    if input("\nMark as read? (y/n): ").lower() == 'y':
-                        self.socket.send(f"/mark_read {msg_id}".encode())
-                        self.socket.recv(1024)  # Get confirmation
-                        print("[green]Message marked as read![/green]")
-                print() 
+            if not shown:
+                print(Panel("No messages in inbox.", style="yellow"))
+            elif self.unread_count and input(f"Mark all {self.unread_count} unread messages as read? (y/n): ").lower() == 'y':
+                self.mark_read(f"/mark_read_upto {newest_id}")
                 
         except Exception as e:
             print(Panel(f"[red]Error displaying messages: {str(e)}[/red]", style="red"))
@@ -589,6 +746,20 @@ class Client:
         input("\nPress Enter to return to private chat menu...")
         self.clear_terminal()
 
+    """
+    mark_read Marks inbox messages as read with one request
+
+    @param self: Client instance
+    @param command: String /mark_read or /mark_read_upto command with its message IDs
+    """
+    def mark_read(self, command):
+        response = self.request(command)  # Wait for confirmation
+        if response["type"] == "ack":
+            self.unread_count = response["unread"]
+            print(f"[green]{response['message']}[/green]")
+        else:
+            print(f"[red]{response['message']}[/red]")
+
     """
     send_private_message - Handles sending new private messages
     
@@ -618,14 +789,13 @@ class Client:
             return
         
         # Send message to server
-        self.socket.send(f"/send_private {recipient} {message}".encode())
-        response = self.socket.recv(1024).decode()
+        response = self.request(f"/send_private {recipient} {message}")
         
         # Display response in a panel
-        if "success" in response.lower():
-            print(Panel(f"[green]{response}[/green]", border_style="green"))
+        if response["type"] == "ack":
+            print(Panel(f"[green]{response['message']}[/green]", border_style="green"))
         else:
-            print(Panel(f"[red]{response}[/red]", border_style="red"))
+            print(Panel(f"[red]{response['message']}[/red]", border_style="red"))
         
         input("\n[dim]Press Enter to return to private chat menu...[/dim]")
         self.clear_terminal()
@@ -82,16 +82,58 @@ import sys # Provides access to some variables used or maintained by the interpr
 import select 
 from rich.live import Live
 from rich.table import Table
+from rich.markup import escape # Log lines may contain square brackets
 from datetime import datetime
 from threading import Event
 import time
+import threading
+import asyncio # Runs the single event loop used by the asyncio server engine
+import argparse
+import json # Structured responses such as inbox pages
+import heapq # Picks the largest chatrooms for the status panel without sorting them all
+import itertools
+import Protocol # Length-prefixed message framing shared with the client
+import DatabasePool # Pool of persistent SQLite connections
+import MessageWriter # Batches chat message inserts into group commits
+import SessionRegistry # Live index of the sessions subscribed to each chatroom
+import IdentityCache # LRU cache for username and chatroom name id lookups
+import PasswordHasher # Runs bcrypt on a bounded pool of worker processes
+import OutboundQueue # Bounded per-session send queues with a slow-consumer policy
+import Migrations # Versioned schema upgrades
+import RoomHistory # Recent messages of each chatroom, replayed on join
+import UnreadCounters # In-memory unread private message counts of online users
+import MessageArchive # Compressed segments holding messages past their retention period
+import WorkerBus # Relays chat events between the processes of worker mode
+import ClusterNode # Shards chatrooms across server nodes
+import Metrics # Optional Prometheus metrics endpoint
+import Profiler # Samples every thread's stack on demand
+import ServerLogger # Queue-based structured log file
+import logging
+import signal
+import tempfile
+import multiprocessing
+
+log = logging.getLogger(ServerLogger.LOGGER_NAME)
 
 
 class Server:
 
+    INBOX_PAGE_SIZE = 20 # Private messages per /get_messages page unless the client asks for another size
+    INBOX_MAX_PAGE_SIZE = 100 # Upper bound on a page so one request cannot pull the whole inbox
+    HISTORY_PAGE_SIZE = 20 # Chatroom messages per /history page unless the client asks for another size
+    HISTORY_MAX_PAGE_SIZE = 100
+    SEARCH_RESULTS = 20 # /search results unless the client asks for another number
+    SEARCH_MAX_RESULTS = 100
+    MARK_READ_CHUNK = 500 # Message ids per UPDATE, below SQLite's bound parameter limit
+    PROFILE_SECONDS = 10 # Default sampling window of the server menu's profiler
+    COMMANDS = ("/register", "/login", "/create_chatroom", "/join_chatroom", "/history", "/search", # Metric labels
+                "/set_retention", "/chatroom_message", "/view_chatroom_users", "/chatroom_view", "/exit_chatroom",
+                "/send_private", "/get_messages", "/mark_read", "/mark_read_upto", "/check_messages")
+    ROOM_COMMANDS = ("/join_chatroom", "/chatroom_message", "/exit_chatroom", # Run on the node owning the room
+                     "/view_chatroom_users")
+
     clients = [] # Maintains a list of active client socket connections for managing client communication 
     chatrooms = {} # Dictionarty to map chatroom names to their metadata 
-    active_chatrooms = {}  # New dictionary to track active members in chatrooms
 
 
     """
@@ -104,19 +146,81 @@ class Server:
 
     @param HOST: String representing the server's IP address or hostname
     @param PORT: Integer representing the port number to listen on
+    @param db_path: String path of the SQLite database file
+    @param durability: String MessageWriter durability mode, "batched" or "sync"
+    @param auth_workers: Integer number of password hashing processes
+    @param max_auth_in_flight: Integer maximum concurrent logins/registrations before clients are told to retry
+    @param slow_consumer_policy: String OutboundQueue policy, "drop_oldest", "disconnect" or "coalesce"
+    @param outbound_limit: Integer maximum bytes queued for one client before the policy applies
+    @param history_size: Integer number of recent messages per chatroom replayed to joining users
+    @param retention_days: Integer days chatroom messages stay in the database unless the room sets its own, None for forever
+    @param private_retention_days: Integer days read private messages stay in the database, None for forever
+    @param archive_dir: String directory of the archive segments, defaults to the database path plus ".archive"
+    @param compact_interval: Integer seconds between archive compactions, 0 to never compact
+    @param reuse_port: Boolean let other worker processes bind the same port (SO_REUSEPORT)
+    @param headless: Boolean run without the interactive server menu, as worker processes do
+    @param bus_path: String Unix socket path of the worker bus hub, None outside worker mode
+    @param node_id: String id of this server in the cluster configuration, None outside cluster mode
+    @param cluster_nodes: List of node dictionaries from ClusterNode.load_config
+    @param metrics_port: Integer port of the local Prometheus metrics endpoint, None to collect no metrics
+    @param log_path: String path of the rotated server log file
+    @param log_level: String minimum level written to the log, "DEBUG" also logs every command
     """
-    def __init__(self, HOST, PORT):
+    def __init__(self, HOST, PORT, db_path='chat_app.db', durability='batched',
+                 auth_workers=None, max_auth_in_flight=None, slow_consumer_policy='drop_oldest',
+                 outbound_limit=OutboundQueue.DEFAULT_MAX_BYTES, history_size=50, retention_days=None,
+                 private_retention_days=None, archive_dir=None, compact_interval=3600, reuse_port=False,
+                 headless=False, bus_path=None, node_id=None, cluster_nodes=None, metrics_port=None,
+                 log_path='server.log', log_level='INFO'):
+        if slow_consumer_policy not in OutboundQueue.POLICIES:
+            raise ValueError(f"Unknown slow consumer policy '{slow_consumer_policy}'")
+        self.server_log = ServerLogger.ServerLogger(log_path, log_level, echo=headless) # Headless servers have no console
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM) # Create a TCP socket
         self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)  # Allow reuse of the address
+        if reuse_port: # The kernel spreads incoming connections over every worker bound to the port
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         self.socket.bind((HOST, PORT))
         self.socket.listen(100) # Listen for up to 10 connections
+        self.metrics = Metrics.Metrics() if metrics_port else None
+        if self.metrics is not None:
+            self.register_metrics() # Before the database opens, so its first queries are timed too
+        self.db = DatabasePool.DatabasePool(db_path, observer=self.observe_query if self.metrics else None) # Long-lived WAL connections shared by all handlers
         self.initialize_database()
+        self.message_writer = MessageWriter.MessageWriter(self.db, durability) # Group-commits chat messages
+        self.message_writer.start()
+        self.password_hasher = PasswordHasher.PasswordHasher(auth_workers, max_auth_in_flight)
         self.clients = []
         self.client_info = {}  # Store client info
+        self.client_peers = {} # Connection -> (address, connected at), recorded once on accept for the console
+        self.sessions = SessionRegistry.SessionRegistry() # Chatroom -> connected sessions index used for fan-out
+        self.user_ids = IdentityCache.IdentityCache(self.load_user_id) # username -> user_id
+        self.chatroom_ids = IdentityCache.IdentityCache(self.load_chatroom_id) # chatroom name -> chatroom_id
+        self.slow_consumer_policy = slow_consumer_policy
+        self.outbound_limit = outbound_limit
+        self.outbound_stats = OutboundQueue.OutboundStats() # Totals across every session's send queue
+        self.room_history = RoomHistory.RoomHistory(self.load_room_history, history_size) # Replayed on join
+        self.unread = UnreadCounters.UnreadCounters(self.load_unread_count) # Pushed to users as it changes
+        self.retention_days = retention_days
+        self.private_retention_days = private_retention_days
+        self.compact_interval = compact_interval
+        self.archive = MessageArchive.MessageArchive(
+            self.db, archive_dir or os.path.abspath(db_path) + ".archive") # chat_app.db.archive, kept apart per database
+        self.profiler = Profiler.Profiler() # Idle until started from the server menu
+        self.profile_dir = os.path.join(os.path.dirname(os.path.abspath(db_path)), "profiles")
         self.running = True # Server running status flag
+        self.remote_online = {} # Username -> process ids of the other workers, or ids of the other nodes, it is logged in to
+        self.bus = WorkerBus.WorkerBus(bus_path, self.handle_bus_event) if bus_path else None
+        self.cluster = ClusterNode.ClusterNode(node_id, cluster_nodes, self.handle_cluster_message) if node_id else None
+        if self.cluster is not None:
+            self.publish("hello") # Nodes already running tell this one who is logged in there
+        if self.metrics is not None:
+            self.metrics.serve(metrics_port)
+        if compact_interval:
+            Thread(target=self.compaction_loop, daemon=True).start() # Moves expired messages into the archive
 
         # Start the menu thread
-        Thread(target=self.server_menu, daemon=True).start()
+        if not headless:
+            Thread(target=self.server_menu, daemon=True).start()
 
     """
     initialize_database Sets up the SQLite database schema for the chat application
@@ -148,67 +252,14 @@ class Server:
         - Includes message content and timestamp
         - Tracks message history with sender and chatroom context
 
+    The schema is versioned; see Migrations.py for the tables, indexes and upgrade steps.
+
     @param self: The server instance 
     """
     def initialize_database(self):
-        conn = sqlite3.connect('chat_app.db')  # Connect to the database
-        cursor = conn.cursor() 
-
-        # Create users table
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            user_id INTEGER PRIMARY KEY AUTOINCREMENT, 
-            username TEXT UNIQUE NOT NULL,
-            password_hash TEXT NOT NULL,
-            salt TEXT NOT NULL            
-        )''')
-
-        # Create chatrooms table
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS chatrooms (
-            chatroom_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT UNIQUE NOT NULL,
-            admin_id INTEGER,
-            FOREIGN KEY (admin_id) REFERENCES users (user_id)
-        )''')
-
-        # Create chatroom_members table
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS chatroom_members (
-            chatroom_id INTEGER,
-            user_id INTEGER,
-            PRIMARY KEY (chatroom_id, user_id),
-            FOREIGN KEY (chatroom_id) REFERENCES chatrooms (chatroom_id),
-            FOREIGN KEY (user_id) REFERENCES users (user_id)
-        )''')
-
-        # Creating messages table
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS messages (
-            message_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            chatroom_id INTEGER,
-            user_id INTEGER,
-            message TEXT,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (chatroom_id) REFERENCES chatrooms (chatroom_id),
-            FOREIGN KEY (user_id) REFERENCES users (user_id)
-        )''')
-
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS private_messages (
-            message_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            sender_id INTEGER,
-            recipient_id INTEGER,
-            message TEXT,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-            read INTEGER DEFAULT 0,
-            FOREIGN KEY (sender_id) REFERENCES users (user_id),
-            FOREIGN KEY (recipient_id) REFERENCES users (user_id)
-        )''')
-
-
-        conn.commit()
-        conn.close()
+        with self.db.connection() as conn: # Borrow a pooled connection
+            self.schema_version = Migrations.migrate(conn) # Creates or upgrades the schema in place
+            self.search_enabled = Migrations.has_search_index(conn) # False when SQLite lacks FTS5
 
     """
     listen Accepts and manages incoming client connections 
@@ -225,15 +276,69 @@ class Server:
         while self.running: # Continuously accepting new connections
             try:
                 client_socket, address = self.socket.accept() # Wait for and accept new client connection
-                print("Connection from:", address)
+                log.info("Connection accepted", extra={"peer": f"{address[0]}:{address[1]}"})
+                if self.metrics is not None:
+                    self.metrics.inc("chitchat_accepted_connections_total")
 
+                client_socket = OutboundQueue.QueuedConnection(client_socket, self.new_outbound_queue()) # Framed, queued sends
                 Server.clients.append(client_socket) # Add new client socket to the list of connected clients
+                self.client_peers[client_socket] = (address, datetime.now())
 
                 Thread(target=self.handle_client, args=(client_socket,)).start() # Start new thread to handle this client's messages independently
 
             except Exception as e:
                 if self.running:  # Only log errors if server is still running
-                    print(f"Error accepting connection: {e}")
+                    log.error("Error accepting connection", extra={"error": str(e)})
+
+    """
+    new_outbound_queue Creates the send queue for a newly connected client
+
+    @param self The server instance
+    @return OutboundQueue configured with the server's limit and slow-consumer policy
+    """
+    def new_outbound_queue(self):
+        return OutboundQueue.OutboundQueue(self.outbound_limit, self.slow_consumer_policy, self.outbound_stats)
+
+    """
+    register_metrics Declares the metrics served on the metrics endpoint
+
+    Values the server already counts elsewhere are read when the endpoint is scraped,
+    so only command latency, fan-out sizes, received bytes and query times add work
+    on the hot paths.
+
+    @param self The server instance
+    """
+    def register_metrics(self):
+        metrics = self.metrics
+        metrics.gauge("chitchat_connections", "Connected clients", lambda: len(Server.clients))
+        metrics.gauge("chitchat_online_users", "Users with at least one session", lambda: len(self.sessions.users))
+        metrics.counter("chitchat_accepted_connections_total", "Client connections accepted")
+        metrics.histogram("chitchat_command_duration_seconds", "Time to handle a client command, by command")
+        metrics.histogram("chitchat_fanout_recipients", "Sessions subscribed to a chatroom per chatroom message",
+                          Metrics.SIZE_BUCKETS)
+        metrics.counter("chitchat_received_bytes_total", "Bytes of client commands received")
+        metrics.counter("chitchat_sent_bytes_total", "Bytes queued for clients",
+                        lambda: self.outbound_stats.queued_bytes)
+        metrics.counter("chitchat_dropped_frames_total", "Frames dropped by the slow consumer policy",
+                        lambda: self.outbound_stats.dropped_frames)
+        metrics.histogram("chitchat_db_query_duration_seconds", "Time executing and fetching SQL statements, by statement")
+        metrics.counter("chitchat_db_batches_total", "Group commits of chat messages",
+                        lambda: self.message_writer.batches_committed)
+        metrics.counter("chitchat_db_rows_total", "Chat messages committed by group commits",
+                        lambda: self.message_writer.rows_committed)
+        metrics.gauge("chitchat_auth_in_flight", "Password hashes running or queued",
+                      lambda: self.password_hasher.in_flight)
+
+    """
+    observe_query Records the duration of one SQL statement
+
+    @param self The server instance
+    @param sql String SQL statement
+    @param seconds Float time spent executing or fetching it
+    """
+    def observe_query(self, sql, seconds):
+        self.metrics.observe("chitchat_db_query_duration_seconds", seconds, query=DatabasePool.query_label(sql))
+
     #MARK: HandleClient                
     """
     handle_client Processes all incoming messages and commands from a connected client
@@ -252,7 +357,7 @@ class Server:
         - /exit_chatroom: Leave current chatroom
 
     @param self The server instance
-    @param client_socket Socket object representing the connected client's connection
+    @param client_socket Protocol.Connection wrapping the connected client's socket
     """
     def handle_client(self, client_socket):
         
@@ -260,111 +365,273 @@ class Server:
 
         while True:
             try:
-                message = client_socket.recv(1024).decode() # Receive and decode client message  
+                message = client_socket.recv_message() # Receive the next framed client message
 
-                if not message:
+                if message is None: # Client closed the connection
                     break
 
-                if message.startswith("/register"): # Handle registration command
-                    _, username, password = message.split(" ", 2) 
-                    response = self.register_user(username, password)
-                    client_socket.send(response.encode())
-                    if "successful" in response: 
-                        client_name = username
-                        self.client_info[client_socket] = username  
-
-                elif message.startswith("/login"): # Handle login command
-                    _, username, password = message.split(" ", 2)
-                    response = self.authenticate_user(username, password)
-                    client_socket.send(response.encode())
-                    if "successful" in response:
-                        client_name = username 
-                        self.client_info[client_socket] = username
-
-                #elif message.startswith("/exit"): # Handle exit command
-                    #os._exit(0)
-                    #break
-                    
-                elif not client_name: # Block all other commands until client is authenticated
-                    client_socket.send("Please login or register first.".encode())
-                    continue
-
-                elif message.startswith("/create_chatroom"): # Chatroom creation command
-                    chatroom_name = message.split(" ", 1)[1]
-                    response = self.create_chatroom(chatroom_name, client_name)
-                    client_socket.send(response.encode())
-
-                elif message.startswith("/join_chatroom"): # Chatroom joining command
-                    chatroom_name = message.split(" ", 1)[1]
-                    response = self.add_user_to_chatroom(chatroom_name, client_name)
-                    print(response)
-                    client_socket.send(response.encode())
-                
-
-                elif message.startswith("/chatroom_message"): # Chatroom message command
-                    _, chatroom_name, chat_message = message.split(" ", 2)
-                    self.broadcast_chatroom_message(chatroom_name, client_name, chat_message)
-
-                elif message.startswith("/view_chatroom_users"): # Chatroom user list command
-                    chatroom_name = message.split(" ", 1)[1]
-                    response = self.view_chatroom_users(chatroom_name)
-                    client_socket.send(response.encode())
-
-                elif message.startswith("/chatroom_view"): # Chatroom list command
-                    conn = sqlite3.connect('chat_app.db')
-                    cursor = conn.cursor()
-                    cursor.execute("SELECT name FROM chatrooms")
-                    chatrooms = [row[0] for row in cursor.fetchall()]
-                    conn.close()
-                    client_socket.send(', '.join(chatrooms).encode())
-
-                elif message.startswith("/exit_chatroom"):
-                    chatroom_name = message.split(" ", 1)[1]
-                    # Remove user from active chatroom members
-                    if chatroom_name in self.active_chatrooms and client_name in self.active_chatrooms[chatroom_name]:
-                        self.active_chatrooms[chatroom_name].remove(client_name)
-                        # If chatroom is empty, remove it from active_chatrooms
-                        if not self.active_chatrooms[chatroom_name]:
-                            del self.active_chatrooms[chatroom_name]
-                    client_socket.send("exit".encode())
-                
-                elif message.startswith("/send_private"):
-                    try:
-                        _, recipient, private_message = message.split(" ", 2)
-                        response = self.send_private_message(client_name, recipient, private_message)
-                        client_socket.send(response.encode())
-                    except Exception as e:
-                        error_msg = f"Error processing private message: {str(e)}"
-                        print(error_msg)  # Server-side logging
-                        client_socket.send(error_msg.encode())
-
-                elif message.startswith("/get_messages"):
-                    messages = self.get_private_messages(client_name)
-                    client_socket.send(str(messages).encode())
-
-                elif message.startswith("/mark_read"):
-                    _, message_id = message.split(" ", 1)
-                    self.mark_message_as_read(int(message_id))
-                    client_socket.send("Message marked as read.".encode())
-                
-                elif message.startswith("/check_messages"):
-                    self.check_unread_messages(client_socket)
+                client_name = self.run_command(client_socket, message, client_name)
 
             except Exception as e:
-                print(f"Error handling client: {e}")
-                # Remove user from all active chatrooms when they disconnect
-                for chatroom in list(self.active_chatrooms.keys()):
-                    if client_name in self.active_chatrooms[chatroom]:
-                        self.active_chatrooms[chatroom].remove(client_name)
-                        if not self.active_chatrooms[chatroom]:
-                            del self.active_chatrooms[chatroom]
-                
-                if client_socket in Server.clients:
-                    Server.clients.remove(client_socket)
-                if client_socket in self.client_info:
-                    del self.client_info[client_socket]
-                client_socket.close()
+                log.warning("Error handling client", extra={"user": client_name, "error": str(e)})
                 break
+
+        self.drop_client(client_socket, client_name)
+
+    """
+    run_command Executes a client command, logging its latency and recording it when metrics are enabled
+
+    @param self The server instance
+    @param client_socket Connection of the client that sent the message
+    @param message Decoded command string received from the client
+    @param client_name Username the connection is authenticated as, or None
+    @return Username the connection is authenticated as after the command
+    """
+    def run_command(self, client_socket, message, client_name):
+        started = time.perf_counter()
+        try:
+            client_name = self.handle_command(client_socket, message, client_name)
+            return client_name
+        finally:
+            elapsed = time.perf_counter() - started
+            command = message.split(" ", 1)[0]
+            command = command if command in self.COMMANDS else "other" # Bounded label values
+            self.server_log.command(command, client_name, elapsed)
+            if self.metrics is not None:
+                self.metrics.observe("chitchat_command_duration_seconds", elapsed, command=command)
+                self.metrics.inc("chitchat_received_bytes_total", Protocol.HEADER.size + len(message.encode('utf-8')))
+
+    """
+    handle_command Executes a single command received from a connected client
+
+    handle_command holds the command set shared by every server engine. It parses one
+    message, runs the matching server operation and sends the response back through
+    client_socket. Any connection exposing send_message, send_frame, getpeername and
+    close can be passed as the client_socket, which lets the threaded and asyncio
+    engines reuse the same logic.
+
+    @param self The server instance
+    @param client_socket Protocol.Connection or AsyncConnection of the client that sent the message
+    @param message Decoded command string received from the client
+    @param client_name Username the connection is authenticated as, or None
+    @return Username the connection is authenticated as after the command
+    """
+    def handle_command(self, client_socket, message, client_name):
+        command = message.split(" ", 1)[0]
+
+        if command in ("/register", "/login"): # Handle registration and login commands
+            _, username, password = message.split(" ", 2)
+            try:
+                if command == "/register":
+                    ok, response = self.register_user(username, password)
+                else:
+                    ok, response = self.authenticate_user(username, password)
+            except PasswordHasher.ServerBusy as e:
+                self.respond(client_socket, command, False, str(e), busy=True) # Client may retry later
+                return client_name
+            if ok:
+                client_name = username
+                self.client_info[client_socket] = username
+                self.sessions.add_user(client_socket, username) # Index the session before the client can act on the response
+                if len(self.sessions.user_sessions(username)) == 1:
+                    self.publish("presence", username=username, online=True)
+            self.respond(client_socket, command, ok, response, username=username)
+            if ok: # Loaded once per login, afterwards kept up to date in memory
+                self.push_unread(username, self.unread.load(username), [client_socket])
+
+        #elif message.startswith("/exit"): # Handle exit command
+            #os._exit(0)
+            #break
+            
+        elif not client_name: # Block all other commands until client is authenticated
+            self.respond(client_socket, command, False, "Please login or register first.")
+            return client_name
+
+        elif self.cluster is not None and command in self.ROOM_COMMANDS and \
+                self.forward_room_command(client_socket, client_name, command, message):
+            return client_name # Handled by the node owning the room
+
+        elif command == "/create_chatroom": # Chatroom creation command
+            chatroom_name = message.split(" ", 1)[1]
+            ok, response = self.create_chatroom(chatroom_name, client_name)
+            self.respond(client_socket, command, ok, response, room=chatroom_name)
+
+        elif command == "/join_chatroom": # Chatroom joining command
+            chatroom_name = message.split(" ", 1)[1]
+            ok, response = self.add_user_to_chatroom(chatroom_name, client_name, client_socket)
+            history = self.room_history.recent(chatroom_name) if ok else [] # Recent context, in the same frame as the ack
+            if history and history[0]["message_id"] is None:
+                self.message_writer.flush() # The oldest replayed message is still queued; its commit assigns the id
+            history_cursor = self.history_cursor(chatroom_name, history) # /history continues below the replay
+            self.respond(client_socket, command, ok, response, room=chatroom_name, history=history,
+                         history_cursor=history_cursor)
+
+        elif command == "/history": # Older chatroom messages: /history <room> <before_id> [limit]
+            try:
+                _, chatroom_name, before_id, *limit = message.split(" ")
+                before_id, limit = int(before_id), int(limit[0]) if limit else self.HISTORY_PAGE_SIZE
+            except ValueError:
+                self.respond(client_socket, command, False, "Usage: /history <room> <before_id> [limit]")
+                return client_name
+            page = self.get_room_history(chatroom_name, before_id, limit)
+            if page is None:
+                self.respond(client_socket, command, False, f"Chatroom '{chatroom_name}' does not exist.", room=chatroom_name)
+            else:
+                self.respond(client_socket, command, True, f"{len(page['messages'])} messages", room=chatroom_name, **page)
+        
+
+        elif command == "/search": # /search <scope> <limit> <query>; scope is all, private, room:<name> or user:<name>
+            try:
+                _, scope, limit, query = message.split(" ", 3)
+                ok, response, results = self.search_messages(client_name, query, scope, int(limit))
+            except ValueError:
+                self.respond(client_socket, command, False, "Usage: /search <all|private|room:<name>|user:<name>> <limit> <query>")
+                return client_name
+            self.respond(client_socket, command, ok, response, scope=scope, query=query, results=results)
+
+        elif command == "/set_retention": # /set_retention <room> <days|default>, 0 days keeps messages forever
+            try:
+                _, chatroom_name, days = message.rsplit(" ", 2)
+                days = None if days == "default" else int(days)
+                if days is not None and days < 0:
+                    raise ValueError
+            except ValueError:
+                self.respond(client_socket, command, False, "Usage: /set_retention <room> <days|default>")
+                return client_name
+            ok, response = self.set_room_retention(chatroom_name, client_name, days)
+            self.respond(client_socket, command, ok, response, room=chatroom_name, days=days)
+
+        elif command == "/chatroom_message": # Chatroom message command
+            _, chatroom_name, chat_message = message.split(" ", 2)
+            self.broadcast_chatroom_message(chatroom_name, client_name, chat_message)
+
+        elif command == "/view_chatroom_users": # Chatroom user list command
+            chatroom_name = message.split(" ", 1)[1]
+            users = self.view_chatroom_users(chatroom_name)
+            response = f"Active users: {', '.join(users)}" if users else f"No active users in chatroom '{chatroom_name}'."
+            self.respond(client_socket, command, True, response, room=chatroom_name, users=users)
+
+        elif command == "/chatroom_view": # Chatroom list command
+            with self.db.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT name FROM chatrooms")
+                chatrooms = [row[0] for row in cursor.fetchall()]
+            self.respond(client_socket, command, True, ', '.join(chatrooms), chatrooms=chatrooms)
+
+        elif command == "/exit_chatroom":
+            chatroom_name = message.split(" ", 1)[1]
+            self.sessions.leave_room(client_socket, chatroom_name) # Stop fan-out to this session
+            self.respond(client_socket, command, True, f"Left chatroom '{chatroom_name}'.", room=chatroom_name)
+        
+        elif command == "/send_private":
+            try:
+                _, recipient, private_message = message.split(" ", 2)
+                ok, response = self.send_private_message(client_name, recipient, private_message)
+                self.respond(client_socket, command, ok, response, recipient=recipient)
+            except Exception as e:
+                error_msg = f"Error processing private message: {str(e)}"
+                log.exception("Error processing private message", extra={"user": client_name})
+                self.respond(client_socket, command, False, error_msg)
+
+        elif command == "/get_messages":
+            # /get_messages [before_id] [limit]; before_id is the next_cursor of the previous page
+            try:
+                parts = message.split()
+                before_id = int(parts[1]) if len(parts) > 1 else 0
+                limit = int(parts[2]) if len(parts) > 2 else self.INBOX_PAGE_SIZE
+            except ValueError:
+                before_id, limit = 0, self.INBOX_PAGE_SIZE
+            page = self.get_private_messages(client_name, before_id, limit)
+            self.respond(client_socket, command, True, f"{len(page['messages'])} messages", **page)
+
+        elif command in ("/mark_read", "/mark_read_upto"):
+            # /mark_read <message_id> [message_id ...] or /mark_read_upto <message_id>
+            try:
+                message_ids = [int(part) for part in message.split()[1:]]
+                if not message_ids or (command == "/mark_read_upto" and len(message_ids) != 1):
+                    raise ValueError
+            except ValueError:
+                self.respond(client_socket, command, False,
+                             "Usage: /mark_read <message_id> [message_id ...] or /mark_read_upto <message_id>")
+                return client_name
+            if command == "/mark_read":
+                marked, unread = self.mark_messages_as_read(client_name, message_ids=message_ids)
+            else:
+                marked, unread = self.mark_messages_as_read(client_name, upto_id=message_ids[0])
+            self.respond(client_socket, command, True, f"Marked {marked} message{'' if marked == 1 else 's'} as read.",
+                         marked=marked, unread=unread)
+        
+        elif command == "/check_messages":
+            self.check_unread_messages(client_socket)
+
+        return client_name
+
+    """
+    forward_room_command Sends a room command to the cluster node owning the room
+
+    @param self The server instance
+    @param client_socket Connection of the client that sent the command
+    @param client_name Username the connection is authenticated as
+    @param command String room command, one of ROOM_COMMANDS
+    @param message String command exactly as the client sent it
+    @return Boolean True if another node handles the command, False if this node owns the room
+    """
+    def forward_room_command(self, client_socket, client_name, command, message):
+        if command == "/chatroom_message":
+            chatroom_name = message.split(" ", 2)[1]
+        else:
+            chatroom_name = message.split(" ", 1)[1]
+        node_id = self.cluster.route(client_socket, chatroom_name)
+        if node_id is None:
+            return False
+        try:
+            self.cluster.forward(node_id, client_socket, client_name, message) # Its frames come back as "deliver" messages
+        except OSError as e:
+            log.warning("Error forwarding to node", extra={"node": node_id, "error": str(e)})
+            self.respond(client_socket, command, False,
+                         f"Chatroom '{chatroom_name}' is served by node '{node_id}', which cannot be reached.",
+                         room=chatroom_name)
+        return True
+
+    """
+    respond Sends the ack or error event answering a client command
+
+    @param self The server instance
+    @param client_socket Connection of the client that sent the command
+    @param command String command being answered, for example "/login"
+    @param ok Boolean True for an ack event, False for an error event
+    @param message String human readable result
+    @param fields Additional command specific event fields
+    """
+    def respond(self, client_socket, command, ok, message, **fields):
+        client_socket.send_frame(Protocol.encode_event("ack" if ok else "error", command=command,
+                                                       message=message, **fields))
+
+    """
+    drop_client Removes a disconnected client from all server tracking structures
+
+    drop_client removes the session from every chatroom it joined, forgets the client
+    socket and closes it. It is called once when a client disconnects or its connection fails.
+
+    @param self The server instance
+    @param client_socket Protocol.Connection or AsyncConnection of the disconnected client
+    @param client_name Username of the disconnected client, or None
+    """
+    def drop_client(self, client_socket, client_name):
+        log.info("Client disconnected", extra={"user": client_name})
+        self.sessions.remove_session(client_socket) # Remove the session from every chatroom it joined
+        if client_name and not self.sessions.is_online(client_name):
+            self.unread.forget(client_name) # Reloaded from the database on the next login
+            self.publish("presence", username=client_name, online=False)
+        if self.cluster is not None:
+            self.cluster.session_closed(client_socket) # Owners of its remote rooms drop it
+        
+        if client_socket in Server.clients:
+            Server.clients.remove(client_socket)
+        if client_socket in self.client_info:
+            del self.client_info[client_socket]
+        self.client_peers.pop(client_socket, None)
+        client_socket.close()
     
     """
     create_chatroom Creates a new chatroom in the database
@@ -374,20 +641,63 @@ class Server:
 
     @param chatroom_name String name for the new chatroom
     @param admin_name String username of the chatroom administrator
-    @return String message indicating success or existing chatroom error
+    @return Tuple of (Boolean success, String message indicating success or existing chatroom error)
     """
     def create_chatroom(self, chatroom_name, admin_name):
-        conn = sqlite3.connect('chat_app.db')
+        conn = self.db.acquire()
         cursor = conn.cursor()
         try:
-            cursor.execute("INSERT INTO chatrooms (name, admin_id) VALUES (?, (SELECT user_id FROM users WHERE username = ?))",
-                           (chatroom_name, admin_name)) # Insert new chatroom into the database
+            cursor.execute("INSERT INTO chatrooms (name, admin_id) VALUES (?, ?)",
+                           (chatroom_name, self.user_ids.get(admin_name))) # Insert new chatroom into the database
             conn.commit()
-            return f"Chatroom '{chatroom_name}' created successfully."
+            self.chatroom_ids.put(chatroom_name, cursor.lastrowid) # The new room is resolvable without a query
+            return True, f"Chatroom '{chatroom_name}' created successfully."
         except sqlite3.IntegrityError:
-            return f"Chatroom '{chatroom_name}' already exists."
-        finally: # Always close the connection
-            conn.close()
+            return False, f"Chatroom '{chatroom_name}' already exists."
+        finally: # Always return the connection to the pool
+            self.db.release(conn)
+
+    """
+    set_room_retention Sets how long a chatroom's messages stay in the database
+
+    Messages older than the retention period are moved into the message archive by
+    the next compaction. Only the chatroom's admin may change it.
+
+    @param chatroom_name name of the chatroom
+    @param username username of the user asking for the change
+    @param days Integer days, 0 to keep messages forever, or None to use the server default
+    @return Tuple of (Boolean success, String message)
+    """
+    def set_room_retention(self, chatroom_name, username, days):
+        chatroom_id = self.chatroom_ids.get(chatroom_name)
+        if chatroom_id is None:
+            return False, f"Chatroom '{chatroom_name}' does not exist."
+        with self.db.connection() as conn:
+            admin_id = conn.execute("SELECT admin_id FROM chatrooms WHERE chatroom_id = ?", (chatroom_id,)).fetchone()[0]
+            if admin_id != self.user_ids.get(username):
+                return False, f"Only the admin of '{chatroom_name}' can change its retention."
+            conn.execute("UPDATE chatrooms SET retention_days = ? WHERE chatroom_id = ?", (days, chatroom_id))
+            conn.commit()
+        if days is None:
+            return True, f"Chatroom '{chatroom_name}' now uses the server's retention period."
+        if days == 0:
+            return True, f"Messages in '{chatroom_name}' are now kept in the database forever."
+        return True, f"Messages in '{chatroom_name}' are now archived after {days} day{'' if days == 1 else 's'}."
+
+    """
+    compaction_loop Runs an archive compaction every compact_interval seconds
+
+    @param self Server instance
+    """
+    def compaction_loop(self):
+        while self.running:
+            try:
+                moved = self.archive.compact(self.retention_days, self.private_retention_days)
+                if moved:
+                    log.info("Archived messages", extra={"messages": moved})
+            except Exception as e:
+                log.exception("Error compacting the message archive")
+            time.sleep(self.compact_interval)
 
     """
     add_user_to_chatroom Adds a specified user to an existing chatroom
@@ -398,124 +708,344 @@ class Server:
 
     @param chatroom_name name of the target chatroom
     @param user_name username of the user to add
-    @return message indicating success or non-existent chatroom error
+    @param client_socket connection of the joining client, subscribed to the room's messages
+    @return Tuple of (Boolean success, message indicating success or non-existent chatroom error)
     """
-    def add_user_to_chatroom(self, chatroom_name, user_name):
-        conn = sqlite3.connect('chat_app.db')
-        cursor = conn.cursor()
-        cursor.execute("SELECT chatroom_id FROM chatrooms WHERE name = ?", (chatroom_name,))
-        chatroom_id = cursor.fetchone() # Get the chatroom ID
+    def add_user_to_chatroom(self, chatroom_name, user_name, client_socket=None):
+        chatroom_id = self.chatroom_ids.get(chatroom_name) # Get the chatroom ID
 
-        if not chatroom_id: # Check if chatroom exists
-            return f"Chatroom '{chatroom_name}' does not exist."
+        if chatroom_id is None: # Check if chatroom exists
+            return False, f"Chatroom '{chatroom_name}' does not exist."
 
-        cursor.execute("INSERT OR IGNORE INTO chatroom_members (chatroom_id, user_id) VALUES (?, (SELECT user_id FROM users WHERE username = ?))",
-                       (chatroom_id[0], user_name)) # Add user to chatroom
-        conn.commit()
-        conn.close()
+        conn = self.db.acquire()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("INSERT OR IGNORE INTO chatroom_members (chatroom_id, user_id) VALUES (?, ?)",
+                           (chatroom_id, self.user_ids.get(user_name))) # Add user to chatroom
+            conn.commit()
+        finally:
+            self.db.release(conn)
 
-        # Add user to active chatroom members
-        if chatroom_name not in self.active_chatrooms:
-            self.active_chatrooms[chatroom_name] = set()
-        self.active_chatrooms[chatroom_name].add(user_name)
+        if client_socket is not None: # Subscribe the session to the room's messages
+            self.sessions.join_room(client_socket, user_name, chatroom_name)
 
-        return f"Joined chatroom '{chatroom_name}'."
+        return True, f"Joined chatroom '{chatroom_name}'."
 
     """
     view_chatroom_users Retrieves a list of all users in the specified chatroom
 
-    view_chatroom_users queries the database to get all usernames of members in a given
+    view_chatroom_users returns the usernames of the members connected to a given
     chatroom. 
     
     @param chatroom_name String name of the chatroom to query
-    @return String containing list of usernames 
+    @return Sorted list of usernames 
     """
     def view_chatroom_users(self, chatroom_name):
-        # Check if the chatroom exists in active_chatrooms
-        if chatroom_name not in self.active_chatrooms:
-            return f"No active users in chatroom '{chatroom_name}'."
-        
         # Get the list of active users in the chatroom
-        active_users = list(self.active_chatrooms[chatroom_name])
-        
-        if not active_users:
-            return f"No active users in chatroom '{chatroom_name}'."
-        
-        return "Active users: " + ', '.join(active_users)
+        return sorted(self.sessions.room_users(chatroom_name))
 
     """
     broadcast_chatroom_message Broadcasts a message to all members in a chatroom
 
     broadcast_chatroom_message handles the entire process of storing and distributing a chat
     message to all members of a chatroom. It saves the message to the database and broadcasts
-    it to all connected clients who are members of the specified chatroom.
+    it to the connected sessions that joined the specified chatroom.
 
     Message Flow:
         Database Operations:
-        - Verifies chatroom existence using chatroom name
-        - Confirms sender exists in users table
-        - Stores message in messages table with sender and chatroom info
-        - Retrieves list of all chatroom members
+        - Resolves the chatroom id and sender id through the identity caches, which
+          also verifies that both exist
+        - Queues the message for the messages table on the MessageWriter, which
+          commits it with the next batch (or before returning in sync durability)
+        - Appends the message to the chatroom's RoomHistory buffer
 
         Message Broadcasting:
-        - Formats message with sender and chatroom context
-        - Iterates through all connected clients
-        - Sends message to each client who is:
-            1. Currently connected
-            2. A member of the chatroom
-            3. Not the original sender
+        - Encodes the chat event once
+        - Looks up the sessions subscribed to the chatroom in the SessionRegistry
+        - Sends message to each subscribed session that is not the original sender
 
     @param chatroom_name name of the target chatroom
     @param sender_name username of the message sender
     @param message content of the message to broadcast
     """
     def broadcast_chatroom_message(self, chatroom_name, sender_name, message):
-        conn = sqlite3.connect('chat_app.db')
-        cursor = conn.cursor()
-        try:
-            cursor.execute("SELECT chatroom_id FROM chatrooms WHERE name = ?", (chatroom_name,))
-            chatroom_id = cursor.fetchone() # Get the chatroom ID
-            if not chatroom_id:
-                return
-            
-            cursor.execute("SELECT user_id FROM users WHERE username = ?", (sender_name,))
-            user_id = cursor.fetchone() # Get the user ID
-            if not user_id:
-                return
-            
-            cursor.execute("INSERT INTO messages (chatroom_id, user_id, message) VALUES (?, ?, ?)",
-                         (chatroom_id[0], user_id[0], message)) # Store the message in the database
-            conn.commit()
-            
-            cursor.execute("""
-                SELECT username 
-                FROM users 
-                JOIN chatroom_members ON users.user_id = chatroom_members.user_id 
-                WHERE chatroom_id = ?
-            """, (chatroom_id[0],)) # Get all members of the chatroom
-            members = [row[0] for row in cursor.fetchall()] 
-            
-            formatted_message = f"[bold blue]{sender_name}[/bold blue]: {message}"
-            
-            for client_socket in Server.clients: # Broadcast message to all connected clients
-                if client_socket in self.client_info:
-                    username = self.client_info[client_socket]
-                    if username in members and username != sender_name:
-                        try:
-                            client_socket.send(formatted_message.encode())
-                        except:
-                            Server.clients.remove(client_socket)
-                            if client_socket in self.client_info:
-                                del self.client_info[client_socket]
-        finally:
-            conn.close()
+        chatroom_id = self.chatroom_ids.get(chatroom_name) # Get the chatroom ID
+        if chatroom_id is None:
+            return
+        
+        user_id = self.user_ids.get(sender_name) # Get the user ID
+        if user_id is None:
+            return
+
+        entry = {"message_id": None, "sender": sender_name, "message": message,
+                 "timestamp": time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())} # Same format as CURRENT_TIMESTAMP
+        future = self.room_history.record(chatroom_name, entry, lambda: self.message_writer.submit(
+            "INSERT INTO messages (chatroom_id, user_id, message) VALUES (?, ?, ?)",
+            (chatroom_id, user_id, message))) # Queue the message for the next group commit
+        future.add_done_callback(lambda f: f.exception() or entry.update(message_id=f.result())) # Known once committed
+        if self.bus is not None: # Other workers get the message once it is committed, with its message_id
+            future.add_done_callback(lambda f: f.exception() or self.bus.publish("room", room=chatroom_name, entry=entry))
+        self.message_writer.wait(future) # Outside the history lock, sync durability waits here
+        
+        frame = Protocol.encode_event("chat", room=chatroom_name, sender=sender_name,
+                                      message=message) # Encode once for every recipient
+        
+        # Fan out to the sessions subscribed to this chatroom only
+        members = self.sessions.room_members(chatroom_name)
+        if self.metrics is not None:
+            self.metrics.observe("chitchat_fanout_recipients", len(members))
+        for client_socket, username in members.items():
+            if username != sender_name:
+                try:
+                    client_socket.send_frame(frame, droppable=True) # A slow member may miss chat, never acks
+                except:
+                    self.drop_client(client_socket, username)
+
+    """
+    history_cursor Returns the /history cursor that continues below a join replay
+
+    A replayed message whose insert failed never got a message_id, so the cursor is
+    the oldest replayed message that was stored. If none was, /history starts below
+    every message stored so far.
+
+    @param chatroom_name String chatroom name
+    @param history List of replayed message dictionaries, oldest first
+    @return Integer message_id cursor, 0 when nothing was replayed
+    """
+    def history_cursor(self, chatroom_name, history):
+        if not history:
+            return 0
+        stored = next((entry["message_id"] for entry in history if entry["message_id"] is not None), None)
+        if stored is not None:
+            return stored
+        with self.db.connection() as conn:
+            return conn.execute("SELECT COALESCE(MAX(message_id), 0) + 1 FROM messages WHERE chatroom_id = ?",
+                                (self.chatroom_ids.get(chatroom_name),)).fetchone()[0]
+
+    """
+    get_room_history Retrieves one page of a chatroom's older messages
+
+    get_room_history is keyset-paginated on message_id like the inbox: each page holds
+    the messages just below the cursor, so scrolling back through a long history is a
+    sequence of index range scans on messages (chatroom_id, message_id).
+
+    @param chatroom_name String chatroom name
+    @param before_id Integer cursor, only messages with a smaller message_id are returned (0 for the newest)
+    @param limit Integer maximum number of messages, capped at HISTORY_MAX_PAGE_SIZE
+    @return Dictionary with "messages" (oldest first), "next_cursor" and "has_more",
+            or None if the chatroom does not exist
+    """
+    def get_room_history(self, chatroom_name, before_id=0, limit=None):
+        chatroom_id = self.chatroom_ids.get(chatroom_name)
+        if chatroom_id is None:
+            return None
+        limit = max(1, min(limit or self.HISTORY_PAGE_SIZE, self.HISTORY_MAX_PAGE_SIZE))
+        messages = self.read_room_messages(chatroom_id, before_id, limit + 1) # One extra row tells us if more pages exist
+        has_more = len(messages) > limit
+        messages = messages[-limit:]
+        return {"messages": messages, "has_more": has_more,
+                "next_cursor": messages[0]["message_id"] if has_more else None}
+
+    """
+    search_messages Searches chatroom messages and the user's private messages
+
+    search_messages matches the query against the FTS5 indexes of messages and
+    private_messages and returns the best matches by bm25 rank. Every word of the
+    query must occur in a message; a word ending in * matches as a prefix. Private
+    messages are only searched among those the user sent or received. Archived
+    messages are matched through archive_fts and ranked together with the live ones.
+    Messages still queued on the MessageWriter are not searched yet.
+
+    @param username String username of the searching user
+    @param query String words to search for
+    @param scope String "all", "private", "room:<name>" for one chatroom or "user:<name>" for one sender
+    @param limit Integer maximum number of results, capped at SEARCH_MAX_RESULTS
+    @return Tuple (Boolean success, String message, List of result dictionaries, best match first)
+    @raise ValueError if the scope is unknown
+    """
+    def search_messages(self, username, query, scope="all", limit=None):
+        if not self.search_enabled:
+            return False, "Search is not available: this server's SQLite has no FTS5 support.", []
+        match = self.fts_query(query)
+        if match is None:
+            return False, "Search query is empty.", []
+        limit = max(1, min(limit or self.SEARCH_RESULTS, self.SEARCH_MAX_RESULTS))
+        user_id = self.user_ids.get(username)
+
+        chat_filter, chat_params, private_filter, private_params = "", (), "", ()
+        scope_room = scope_sender = None
+        if scope == "all":
+            pass
+        elif scope == "private":
+            chat_filter = None
+        elif scope.startswith("room:"):
+            chatroom_id = self.chatroom_ids.get(scope[5:])
+            if chatroom_id is None:
+                return False, f"Chatroom '{scope[5:]}' does not exist.", []
+            chat_filter, chat_params, private_filter = "AND m.chatroom_id = ?", (chatroom_id,), None
+            scope_room = chatroom_id
+        elif scope.startswith("user:"):
+            sender_id = self.user_ids.get(scope[5:])
+            if sender_id is None:
+                return False, f"User '{scope[5:]}' does not exist.", []
+            chat_filter, chat_params = "AND m.user_id = ?", (sender_id,)
+            private_filter, private_params = "AND p.sender_id = ?", (sender_id,)
+            scope_sender = sender_id
+        else:
+            raise ValueError(f"Unknown search scope '{scope}'")
+
+        results = []
+        with self.db.connection() as conn:
+            if chat_filter is not None:
+                rows = conn.execute(f"""
+                    SELECT m.message_id, c.name, u.username, m.message, m.timestamp, messages_fts.rank
+                    FROM messages_fts
+                    JOIN messages m ON m.message_id = messages_fts.rowid
+                    JOIN users u ON u.user_id = m.user_id
+                    JOIN chatrooms c ON c.chatroom_id = m.chatroom_id
+                    WHERE messages_fts MATCH ? {chat_filter}
+                    ORDER BY messages_fts.rank
+                    LIMIT ?
+                """, (match, *chat_params, limit)).fetchall()
+                results += [{"kind": "chat", "message_id": message_id, "room": room, "sender": sender,
+                             "message": message, "timestamp": timestamp, "rank": rank}
+                            for message_id, room, sender, message, timestamp, rank in rows]
+            if private_filter is not None:
+                rows = conn.execute(f"""
+                    SELECT p.message_id, s.username, r.username, p.message, p.timestamp, private_messages_fts.rank
+                    FROM private_messages_fts
+                    JOIN private_messages p ON p.message_id = private_messages_fts.rowid
+                    JOIN users s ON s.user_id = p.sender_id
+                    JOIN users r ON r.user_id = p.recipient_id
+                    WHERE private_messages_fts MATCH ? AND (p.sender_id = ? OR p.recipient_id = ?) {private_filter}
+                    ORDER BY private_messages_fts.rank
+                    LIMIT ?
+                """, (match, user_id, user_id, *private_params, limit)).fetchall()
+                results += [{"kind": "private", "message_id": message_id, "sender": sender, "recipient": recipient,
+                             "message": message, "timestamp": timestamp, "rank": rank}
+                            for message_id, sender, recipient, message, timestamp, rank in rows]
+
+        chatroom_names = None
+        for record in self.archive.search(match, user_id, scope_room, scope_sender, rooms=chat_filter is not None,
+                                          private=private_filter is not None, limit=limit):
+            result = {"kind": record["kind"], "message_id": record["message_id"], "sender": record["sender"],
+                      "message": record["message"], "timestamp": record["timestamp"], "rank": record["rank"]}
+            if record["kind"] == "chat":
+                if chatroom_names is None:
+                    with self.db.connection() as conn:
+                        chatroom_names = dict(conn.execute("SELECT chatroom_id, name FROM chatrooms").fetchall())
+                result["room"] = chatroom_names.get(record["chatroom_id"])
+            else:
+                result["recipient"] = record["recipient"]
+            results.append(result)
+
+        results = sorted(results, key=lambda result: result["rank"])[:limit] # bm25: lower is a better match
+        return True, f"{len(results)} result{'' if len(results) == 1 else 's'} for '{query}'", results
+
+    """
+    fts_query Turns user input into an FTS5 query that matches every word
+
+    Each word is quoted so FTS5 operators and punctuation in the input are searched
+    for literally instead of raising a syntax error.
+
+    @param text String words typed by the user
+    @return String FTS5 MATCH expression, or None if there are no words
+    """
+    def fts_query(self, text):
+        terms = []
+        for word in text.split():
+            prefix = word.endswith("*")
+            word = word.rstrip("*")
+            if word:
+                terms.append('"' + word.replace('"', '""') + '"' + ("*" if prefix else ""))
+        return " ".join(terms) or None
+
+    """
+    load_room_history Reads a chatroom's latest messages, used to warm the room_history buffers
+
+    Messages still queued on the MessageWriter are committed first so that none
+    are missing from the result.
+
+    @param chatroom_name String chatroom name
+    @param count Integer maximum number of messages
+    @return List of message dictionaries, oldest first
+    """
+    def load_room_history(self, chatroom_name, count):
+        chatroom_id = self.chatroom_ids.get(chatroom_name)
+        if chatroom_id is None:
+            return []
+        self.message_writer.flush()
+        return self.read_room_messages(chatroom_id, 0, count)
+
+    """
+    read_room_messages Reads the newest messages of a chatroom below a message_id, live or archived
+
+    Archived messages are older than every live message of their room, so the archive
+    is only read when the live table runs out.
+
+    @param chatroom_id Integer chatroom id
+    @param before_id Integer exclusive upper bound on message_id, 0 for no bound
+    @param count Integer maximum number of messages
+    @return List of message dictionaries, oldest first
+    """
+    def read_room_messages(self, chatroom_id, before_id, count):
+        messages = self.query_room_messages(chatroom_id, before_id, count)
+        if len(messages) < count:
+            archived = self.archive.room_messages(chatroom_id, messages[0]["message_id"] if messages else before_id,
+                                                  count - len(messages))
+            messages = [{"message_id": record["message_id"], "sender": record["sender"], "message": record["message"],
+                         "timestamp": record["timestamp"]} for record in archived] + messages
+        return messages
+
+    """
+    query_room_messages Reads the newest messages of a chatroom below a message_id
+
+    @param chatroom_id Integer chatroom id
+    @param before_id Integer exclusive upper bound on message_id, 0 for no bound
+    @param count Integer maximum number of messages
+    @return List of dictionaries with message_id, sender, message and timestamp, oldest first
+    """
+    def query_room_messages(self, chatroom_id, before_id, count):
+        with self.db.connection() as conn:
+            rows = conn.execute("""
+                SELECT m.message_id, u.username, m.message, m.timestamp
+                FROM messages m
+                JOIN users u ON m.user_id = u.user_id
+                WHERE m.chatroom_id = ? AND m.message_id < ?
+                ORDER BY m.message_id DESC
+                LIMIT ?
+            """, (chatroom_id, before_id if before_id > 0 else sys.maxsize, count)).fetchall()
+        return [{"message_id": message_id, "sender": sender, "message": message, "timestamp": timestamp}
+                for message_id, sender, message, timestamp in reversed(rows)]
+
+    """
+    load_user_id Looks up a user's id in the database, used by the user_ids cache
+
+    @param username String username to resolve
+    @return Integer user_id, or None if the user does not exist
+    """
+    def load_user_id(self, username):
+        with self.db.connection() as conn:
+            row = conn.execute("SELECT user_id FROM users WHERE username = ?", (username,)).fetchone()
+        return row[0] if row else None
+
+    """
+    load_chatroom_id Looks up a chatroom's id in the database, used by the chatroom_ids cache
+
+    @param chatroom_name String chatroom name to resolve
+    @return Integer chatroom_id, or None if the chatroom does not exist
+    """
+    def load_chatroom_id(self, chatroom_name):
+        with self.db.connection() as conn:
+            row = conn.execute("SELECT chatroom_id FROM chatrooms WHERE name = ?", (chatroom_name,)).fetchone()
+        return row[0] if row else None
 
     """
     register_user Securely registers a new user in the database system
     
     register_user handles new user registration by validating password length,
-    generating a unique salt, hashing the password with bcrypt, and storing the
-    user credentials in the database. The method ensures password security through
+    generating a unique salt, hashing the password with bcrypt on the PasswordHasher
+    worker pool, and storing the user credentials in the database. The method ensures password security through
     salting and hashing while maintaining username uniqueness.
       
     @param username: String containing desired username for registration
@@ -524,36 +1054,37 @@ class Server:
     @param password: String containing user's chosen password
                     - Must be at least 8 characters long
                     - Will be hashed before storage
-    @return: String message indicating registration statuses
+    @return: Tuple of (Boolean success, String message indicating registration status)
+    @raise PasswordHasher.ServerBusy when too many password hashes are already in flight
     """
     def register_user(self, username, password):
         if len(password) < 8:
-            return "Password must be at least 8 characters long."
+            return False, "Password must be at least 8 characters long."
+
+        if self.user_ids.get(username) is not None: # Skip the expensive hash for taken usernames
+            return False, "Username already exists."
+
+        salt = bcrypt.gensalt() # Generate a unique salt
+        password_hash = self.password_hasher.hashpw(password.encode('utf-8'), salt) # Hash the password on the worker pool
             
-        conn = sqlite3.connect('chat_app.db')
+        conn = self.db.acquire()
         cursor = conn.cursor()
         try:
-            
-            salt = bcrypt.gensalt() # Generate a unique salt
-            
-            
-            password_hash = bcrypt.hashpw(password.encode('utf-8'), salt) # Hash the password with the salt
-            
-            
             cursor.execute("""
                 INSERT INTO users (username, password_hash, salt) 
                 VALUES (?, ?, ?)
             """, (username, password_hash.decode('utf-8'), salt.decode('utf-8'))) # Insert new user into the database
             
             conn.commit()
-            return "Registration successful!" 
+            self.user_ids.put(username, cursor.lastrowid) # Cache the new user's id
+            return True, "Registration successful!" 
             
         except Exception as e:
             if "UNIQUE constraint failed" in str(e): # Check for unique username constraint violation
-                return "Username already exists."
-            return f"Registration failed: {str(e)}"
+                return False, "Username already exists."
+            return False, f"Registration failed: {str(e)}"
         finally:
-            conn.close()
+            self.db.release(conn)
 
     """
     server_menu Displays and handles the server main menu
@@ -571,14 +1102,16 @@ class Server:
         
         with Live(
             server_status.generate_layout(),
-            refresh_per_second=2,  # Update twice per second
             screen=True,  # Use alternate screen
-            auto_refresh=True  # Enable automatic refresh
+            auto_refresh=False  # Redrawn below, only when the status changed
         ) as live:
             while self.running:
                 try:
                     # Update the display
-                    live.update(server_status.generate_layout())
+                    rendered = server_status.rendered
+                    server_status.generate_layout()
+                    if server_status.rendered != rendered:
+                        live.refresh()
                     
                     # Check for user input (non-blocking)
                     
@@ -603,9 +1136,23 @@ class Server:
                             #if self.confirm_shutdown():
                                 self.shutdown_server()
                                 break
+
+                        elif choice == '4':
+                            live.stop()
+                            self.profile_menu()
+                            live.start()
+
+                        elif choice == '5':
+                            live.stop()
+                            self.view_server_logs()
+                            live.start()
+
+                        elif choice in ('n', 'p'):
+                            server_status.change_page(1 if choice == 'n' else -1)
                             
                         # Update immediately after handling command
-                        live.update(server_status.generate_layout())
+                        server_status.generate_layout()
+                        live.refresh()
                     
                 except Exception as e:
                     print(f"\nError in menu: {e}")
@@ -628,8 +1175,9 @@ class Server:
     1. Sets the running flag to False to stop main server loop
     2. Notifies all connected clients of shutdown
     3. Closes all client socket connections
-    4. Closes the main server socket
-    5. Terminates the server process
+    4. Commits chat messages still queued on the MessageWriter
+    5. Closes the main server socket
+    6. Terminates the server process
 
     @param self: Server instance
     """
@@ -639,46 +1187,69 @@ class Server:
             return
         
         self.running = False
-        print("[bold red]Initiating server shutdown...[/bold red]")
+        log.info("Server shutting down", extra={"clients": len(Server.clients)})
         
         # Notify all clients of shutdown
         for client_socket in Server.clients[:]:  # Create a copy of the list to iterate
             try:
-                print(f"Notifying client {self.client_info.get(client_socket, 'unknown')}")
-                client_socket.send("Server is shutting down...".encode())
+                log.debug("Notifying client", extra={"user": self.client_info.get(client_socket)})
+                client_socket.send_frame(Protocol.encode_event("notification", kind="shutdown",
+                                                               message="Server is shutting down..."))
                 client_socket.close()
             except Exception as e:
-                print(f"Error notifying client: {e}")
+                log.warning("Error notifying client", extra={"error": str(e)})
         
+        # Commit messages still waiting for their batch
+        try:
+            self.message_writer.stop()
+        except Exception as e:
+            log.exception("Error flushing message writer")
+
+        self.password_hasher.shutdown()
+        if self.cluster is not None:
+            self.cluster.close()
+        if self.metrics is not None:
+            self.metrics.close()
+
         # Clear client tracking structures
         Server.clients.clear()
         self.client_info.clear()
-        self.active_chatrooms.clear()
+        self.client_peers.clear()
+        self.sessions.clear()
         
-        # Close the server socket
+        self.close_listener() # Close the server socket
+        log.info("Server has shut down")
+        self.server_log.close() # Writes the records still queued
+        sys.exit(0)
+
+    """
+    close_listener Closes the listening socket so that no new clients are accepted
+
+    @param self: Server instance
+    """
+    def close_listener(self):
         try:
             self.socket.close()
-            print("[bold red]Server socket closed.[/bold red]")
+            log.info("Server socket closed")
         except Exception as e:
-            print(f"Error closing server socket: {e}")
-        
-        print("[bold red]Server has shut down.[/bold red]")
-        sys.exit(0)
+            log.warning("Error closing server socket", extra={"error": str(e)})
 
     """
     authenticate_user Verifies user login credentials against stored database values
     
     authenticate_user Verifies user login credentials against stored database values by retrieving stored credentials, 
     extracting stored password hash and salt, hashing the provided password with the stored salt, and 
-    comparing the hashed passwords for authentication.
+    comparing the hashed passwords for authentication. Hashing runs on the
+    PasswordHasher worker pool and is refused under overload.
     
     @param username: String containing the username to authenticate
     @param password: String containing the password to verify
-    @return: String message of authentication result
+    @return: Tuple of (Boolean success, String message of authentication result)
+    @raise PasswordHasher.ServerBusy when too many password hashes are already in flight
     """
     def authenticate_user(self, username, password):
        
-        conn = sqlite3.connect('chat_app.db')
+        conn = self.db.acquire()
         cursor = conn.cursor()
         try:
             
@@ -689,26 +1260,27 @@ class Server:
             """, (username,)) # Retrieve stored password hash and salt
             
             result = cursor.fetchone()
-            if not result:
-                return "Invalid username or password!"
-                
-            stored_hash, stored_salt = result # Extract stored hash and salt
-            
+        finally:
+            self.db.release(conn) # Do not hold a pooled connection while hashing
+
+        if not result:
+            return False, "Invalid username or password!"
             
-            password_hash = bcrypt.hashpw(
+        stored_hash, stored_salt = result # Extract stored hash and salt
+        
+        try:
+            password_hash = self.password_hasher.hashpw(
                 password.encode('utf-8'), 
-                stored_salt.encode('utf-8') # Close server socket
-            )
-            
-            
-            if password_hash.decode('utf-8') == stored_hash: # Compare hashed passwords
-                return "Login successful!"
-            return "Invalid username or password."
-            
+                stored_salt.encode('utf-8')
+            ) # Hash on the worker pool
+        except PasswordHasher.ServerBusy:
+            raise
         except Exception as e:
-            return f"Authentication failed: {str(e)}"
-        finally:
-            conn.close()
+            return False, f"Authentication failed: {str(e)}"
+        
+        if password_hash.decode('utf-8') == stored_hash: # Compare hashed passwords
+            return True, "Login successful!"
+        return False, "Invalid username or password."
 
     """
     view_active_connections - Displays list of currently connected clients
@@ -732,26 +1304,74 @@ class Server:
         table.add_column("Connected Since", style="magenta")
         
         # Add this section to populate the table
-        for client_socket, username in self.client_info.items():
-            try:
-                addr = client_socket.getpeername()
-                table.add_row(
-                    username,
-                    addr[0],
-                    str(addr[1]),
-                    datetime.now().strftime("%H:%M:%S")
-                )
-            except:
-                continue
+        for client_socket, username in list(self.client_info.items()):
+            peer = self.client_peers.get(client_socket)
+            if peer is None:
+                continue # Disconnected while the table was built
+            addr, connected_at = peer
+            table.add_row(
+                username,
+                addr[0],
+                str(addr[1]),
+                connected_at.strftime("%H:%M:%S")
+            )
 
         console.print(table)
         input("\nPress Enter to return to main menu...")
 
+    """
+    profile_menu - Profiles the running server and displays its hottest functions
+
+    profile_menu asks for a sampling window, samples the stacks of every server thread
+    for that long and shows the functions with the most samples. The collapsed stacks
+    are saved under profiles/ next to the database for a flame graph.
+
+    @param self: Server instance
+    """
+    def profile_menu(self):
+        self.clear_terminal()
+        console = Console()
+        console.print(Panel.fit("[bold cyan]Hot Path Profiler[/bold cyan]", border_style="cyan"))
+
+        answer = input(f"Seconds to sample [{self.PROFILE_SECONDS}]: ").strip()
+        try:
+            seconds = float(answer) if answer else self.PROFILE_SECONDS
+            if seconds <= 0:
+                raise ValueError
+        except ValueError:
+            print(Panel("[red]Invalid number of seconds[/red]", border_style="red"))
+            time.sleep(1)
+            return
+
+        if not self.profiler.start(seconds, self.profile_dir):
+            print("[yellow]A profile is already being taken, showing its results when it ends[/yellow]")
+        with console.status(f"Sampling every thread for {seconds:g} seconds..."):
+            summary = self.profiler.wait()
+        if summary is None:
+            error = self.profiler.last_error or "No profile was taken"
+            log.warning("Profile failed", extra={"error": error})
+            console.print(Panel(f"[red]{escape(error)}[/red]", border_style="red"))
+            input("\nPress Enter to return to main menu...")
+            return
+
+        for column, title in (("self", "Innermost Function (Self)"), ("total", "Anywhere on the Stack (Total)")):
+            table = Table(title=title, show_header=True, header_style="bold cyan")
+            table.add_column("Function", style="cyan")
+            table.add_column("Samples", style="yellow", justify="right")
+            table.add_column("Share", style="green", justify="right")
+            for function, count in summary[column]:
+                table.add_row(function, str(count), f"{count / max(1, summary['stacks']):.1%}")
+            console.print(table)
+        console.print(f"{summary['samples']} samples of every thread over {summary['seconds']:.1f}s, waiting threads "
+                      f"included; collapsed stacks saved to [magenta]{summary['path']}[/magenta]")
+        input("\nPress Enter to return to main menu...")
+
     """
     view_server_logs - Displays recent server log entries
     
     view_server_logs reads and displays the last 20 entries from the server log
-    file in a formatted panel. Shows error message if log file not found.
+    file in a formatted panel. Shows error message if log file not found. Only the
+    end of the file is read, however large the log has grown.
     
     @param self: Server instance
     """
@@ -761,118 +1381,317 @@ class Server:
         print(Panel.fit("[bold cyan]Recent Server Logs[/bold cyan]", border_style="cyan"))
         
         try:
-            with open('server.log', 'r') as log_file:
-                logs = log_file.readlines()[-20:]  # Show last 20 log entries
-                for log in logs:
-                    console.print(f"[grey70]{log.strip()}[/grey70]")
+            for line in ServerLogger.tail(self.server_log.path, 20):  # Show last 20 log entries
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    console.print(escape(line), style="grey70")
+                    continue
+                fields = " ".join(f"{key}={value}" for key, value in record.items()
+                                  if key not in ("time", "level", "logger", "thread", "message", "exception"))
+                color = {"WARNING": "yellow", "ERROR": "red", "CRITICAL": "red"}.get(record.get("level"), "grey70")
+                console.print(f"[{color}]{record.get('time')} {record.get('level', ''):<7}[/{color}] "
+                              f"{escape(record.get('message', ''))} [dim]{escape(fields)}[/dim]")
         except FileNotFoundError:
             print("[yellow]No log file found[/yellow]")
             
         input("\nPress Enter to return to main menu...")
 
     """
-    get_private_messages - Retrieves private messages for a user
+    get_private_messages - Retrieves one page of a user's private messages
     
-    get_private_messages queries the database for all private messages where the 
-    specified user is the recipient, including sender info, message content,
-    timestamp and read status.
+    get_private_messages returns the private messages received by the specified user,
+    newest first, including sender info, message content, timestamp and read status.
+    Pages are keyset-paginated on message_id: the next page starts below the last
+    message_id of the previous one, so every page is a single index range scan no
+    matter how deep into the inbox the client has scrolled. Archived messages are
+    merged in by message_id.
     
     @param self: Server instance
     @param username: String username to get messages for
-    @return: List of tuples containing message details
+    @param before_id: Integer cursor, only messages with a smaller message_id are returned (0 for the newest)
+    @param limit: Integer maximum number of messages, capped at INBOX_MAX_PAGE_SIZE
+    @return: Dictionary with "messages" (list of dictionaries), "next_cursor" and "has_more"
     """
-    def get_private_messages(self, username):
-        conn = sqlite3.connect('chat_app.db')
-        cursor = conn.cursor()
-        try:
-            cursor.execute("""
-                SELECT 
+    def get_private_messages(self, username, before_id=0, limit=None):
+        limit = max(1, min(limit or self.INBOX_PAGE_SIZE, self.INBOX_MAX_PAGE_SIZE))
+        page = {"messages": [], "next_cursor": None, "has_more": False}
+        user_id = self.user_ids.get(username)
+        if user_id is None:
+            return page
+
+        with self.db.connection() as conn:
+            rows = conn.execute("""
+                SELECT
+                    m.message_id,
                     s.username as sender,
                     m.message,
                     m.timestamp,
-                    m.message_id,
                     CASE WHEN m.read = 0 THEN 'Unread' ELSE 'Read' END as status
                 FROM private_messages m
                 JOIN users s ON m.sender_id = s.user_id
-                JOIN users r ON m.recipient_id = r.user_id
-                WHERE r.username = ?
-                ORDER BY m.timestamp DESC
-            """, (username,))
-            return cursor.fetchall()
-        finally:
-            conn.close()
+                WHERE m.recipient_id = ? AND m.message_id < ?
+                ORDER BY m.message_id DESC
+                LIMIT ?
+            """, (user_id, before_id if before_id > 0 else sys.maxsize, limit + 1)).fetchall() # One extra row tells us if more pages exist
+        # Only read messages are archived, so an older unread one can stay live while newer
+        # ones are archived: the page is the newest of both, not the archive after the live rows
+        archived = self.archive.private_messages(user_id, before_id, limit + 1)
+        rows += [(record["message_id"], record["sender"], record["message"], record["timestamp"], "Read")
+                 for record in archived]
+        rows = sorted(rows, key=lambda row: row[0], reverse=True)[:limit + 1]
+
+        page["has_more"] = len(rows) > limit
+        for message_id, sender, content, timestamp, status in rows[:limit]:
+            page["messages"].append({"message_id": message_id, "sender": sender, "message": content,
+                                     "timestamp": timestamp, "status": status})
+        if page["has_more"]:
+            page["next_cursor"] = page["messages"][-1]["message_id"]
+        return page
 
     """
     send_private_message - Sends a private message between users
     
-    send_private_message stores private message in database and attempts immediate
-    delivery if recipient is online. Handles both storage and delivery of private
-    messages between users.
+    send_private_message queues the private message on the MessageWriter and attempts
+    immediate delivery to every session of the recipient if they are online. Handles both
+    storage and delivery of private messages between users.
     
     @param self: Server instance
     @param sender_name: String username of message sender
     @param recipient_name: String username of message recipient 
     @param message: String content of the message
-    @return: String status of message delivery
+    @return: Tuple of (Boolean success, String status of message delivery)
     """
     def send_private_message(self, sender_name, recipient_name, message):
-        conn = sqlite3.connect('chat_app.db')
-        cursor = conn.cursor()
-        try:
-            # Get sender and recipient IDs
-            cursor.execute("SELECT user_id FROM users WHERE username = ?", (sender_name,))
-            sender_id = cursor.fetchone()
-            cursor.execute("SELECT user_id FROM users WHERE username = ?", (recipient_name,))
-            recipient_id = cursor.fetchone()
+        # Get sender and recipient IDs
+        sender_id = self.user_ids.get(sender_name)
+        recipient_id = self.user_ids.get(recipient_name)
+        
+        if recipient_id is None:
+            return False, "Recipient not found."
             
-            if not recipient_id:
-                return "Recipient not found."
-                
-            # Store message in database
-            cursor.execute("""
+        # Queue message for the next group commit and count it as unread
+        queued, generation = [], []
+        def persist():
+            generation.append(self.unread.generation(recipient_name))
+            queued.append(self.message_writer.submit("""
                 INSERT INTO private_messages 
                 (sender_id, recipient_id, message, timestamp, read) 
                 VALUES (?, ?, ?, CURRENT_TIMESTAMP, 0)
-            """, (sender_id[0], recipient_id[0], message))
-            conn.commit()
-            
-            # Check if recipient is online and send message
-            recipient_socket = None
-            for client_socket, username in self.client_info.items():
-                if username == recipient_name:
-                    recipient_socket = client_socket
-                    break
-                    
-            if recipient_socket:
-                formatted_message = f"[Private from {sender_name}]: {message}"
+            """, (sender_id, recipient_id, message)))
+            return 1
+        unread_count = self.unread.record(recipient_name, persist)
+        def failed(future):
+            # Runs on the writer thread, which a login holding the count's lock may be
+            # waiting for to flush, so the count is taken back on another thread
+            if future.exception() is not None:
+                Thread(target=self.revert_unread, args=(recipient_name, generation[0]), daemon=True).start()
+        queued[0].add_done_callback(failed)
+        self.message_writer.wait(queued[0])
+
+        # Sessions on other workers or cluster nodes are reached over the bus or the node links
+        delivered = bool(self.remote_online.get(recipient_name))
+        if delivered:
+            self.publish("private", self.remote_online.get(recipient_name),
+                         recipient=recipient_name, sender=sender_name, message=message)
+
+        # Deliver to every session the recipient is logged in from
+        recipient_sockets = self.sessions.user_sessions(recipient_name)
+        if recipient_sockets:
+            frame = Protocol.encode_event("private", sender=sender_name, message=message)
+            for recipient_socket in recipient_sockets:
                 try:
-                    recipient_socket.send(formatted_message.encode())
-                    return "Message sent and delivered successfully!"
+                    recipient_socket.send_frame(frame)
+                    delivered = True
                 except:
-                    return "Message stored but couldn't be delivered immediately."
-            
-            return "Message saved and will be delivered when recipient comes online."
-            
-        finally:
-            conn.close()
+                    pass
+            if unread_count is not None:
+                self.push_unread(recipient_name, unread_count)
+            if delivered:
+                return True, "Message sent and delivered successfully!"
+            return True, "Message stored but couldn't be delivered immediately."
+        if delivered:
+            return True, "Message sent and delivered successfully!"
+        return True, "Message saved and will be delivered when recipient comes online."
 
     """
-    mark_message_as_read - Marks a private message as read
+    revert_unread - Takes back the unread message counted for a private message that was not stored
+
+    @param self: Server instance
+    @param username: String username of the message's recipient
+    @param generation: Integer generation of the recipient's count when the message was counted
+    """
+    def revert_unread(self, username, generation):
+        unread_count = self.unread.revert(username, 1, generation)
+        if unread_count is not None:
+            self.push_unread(username, unread_count)
+        if self.remote_online.get(username): # Other workers or nodes counted it from the "private" event
+            self.publish("unread", self.remote_online.get(username), username=username, delta=-1)
+
+    """
+    mark_messages_as_read - Marks private messages as read in one transaction
     
-    mark_message_as_read updates the read status to 1 in the database for the
-    specified message ID.
+    mark_messages_as_read sets the read status to 1 for either the listed message IDs
+    or every message up to and including upto_id. Only unread messages sent to the
+    user are changed. The new unread count is pushed to the user's sessions.
     
     @param self: Server instance
-    @param message_id: Integer ID of message to mark as read
+    @param username: String username of the messages' recipient
+    @param message_ids: Iterable of integer message IDs to mark as read
+    @param upto_id: Integer message ID; every older message is marked as read too
+    @return: Tuple (Integer messages marked as read, Integer new unread count)
     """
-    def mark_message_as_read(self, message_id):
-        conn = sqlite3.connect('chat_app.db')
-        cursor = conn.cursor()
-        try:
-            cursor.execute("UPDATE private_messages SET read = 1 WHERE message_id = ?", (message_id,))
-            conn.commit()
-        finally:
-            conn.close()
+    def mark_messages_as_read(self, username, message_ids=(), upto_id=None):
+        recipient_id = self.user_ids.get(username)
+        message_ids = list(dict.fromkeys(message_ids)) # Without duplicates, keeping the order
+        marked = []
+        def persist():
+            with self.db.connection() as conn:
+                try:
+                    cursor = conn.cursor() # The first UPDATE opens the transaction, commit closes it
+                    if upto_id is not None:
+                        cursor.execute("""
+                            UPDATE private_messages SET read = 1
+                            WHERE recipient_id = ? AND read = 0 AND message_id <= ?
+                        """, (recipient_id, upto_id))
+                        marked.append(cursor.rowcount)
+                    for start in range(0, len(message_ids), self.MARK_READ_CHUNK):
+                        chunk = message_ids[start:start + self.MARK_READ_CHUNK]
+                        cursor.execute(f"""
+                            UPDATE private_messages SET read = 1
+                            WHERE recipient_id = ? AND read = 0 AND message_id IN ({",".join("?" * len(chunk))})
+                        """, (recipient_id, *chunk))
+                        marked.append(cursor.rowcount)
+                    conn.commit()
+                except:
+                    conn.rollback()
+                    raise
+            return -sum(marked)
+        unread_count = self.unread.record(username, persist)
+        if unread_count is None: # Not tracked, for example after the last session disconnected
+            unread_count = self.unread.load(username)
+        if sum(marked): # Nothing to push for someone else's or already read messages
+            self.push_unread(username, unread_count)
+            if self.remote_online.get(username):
+                self.publish("unread", self.remote_online.get(username), username=username, delta=-sum(marked))
+        return sum(marked), unread_count
+
+    """
+    publish Sends an event to the other workers or cluster nodes
+
+    Workers publish on the worker bus, which reaches every other worker. Cluster nodes
+    send the event over their links, to the listed nodes or else to every other node.
+    Outside both modes nothing is sent.
+
+    @param self: Server instance
+    @param event_type: String event type handled by handle_bus_event
+    @param origins: Iterable of node ids to send to, as kept in remote_online, or None for every node
+    @param fields: Keyword arguments with the event's JSON-serializable fields
+    """
+    def publish(self, event_type, origins=None, **fields):
+        if self.bus is not None:
+            self.bus.publish(event_type, **fields)
+        elif self.cluster is not None:
+            self.cluster.publish(event_type, origins, **fields)
+
+    """
+    handle_bus_event Applies an event another worker published on the worker bus
+
+    Events carry what that worker already persisted, so they are only delivered to
+    this worker's sessions and folded into its in-memory state:
+        room        - a committed chatroom message
+        private     - a private message for a user logged in here
+        unread      - a change of a user's unread count
+        presence    - a user logged in to or out of the publishing worker
+        hello       - a worker started; it is told who is logged in here
+        worker_down - a worker exited, so its users are no longer online there
+
+    Cluster nodes relay the same private, unread, presence and hello events over their
+    links, with the sending node's id as the origin; room messages need no relay there
+    because the owning node fans them out.
+
+    @param self: Server instance
+    @param event: Dictionary event decoded from the bus or a node link
+    """
+    def handle_bus_event(self, event):
+        kind = event["type"]
+        if kind == "room":
+            entry = event["entry"]
+            self.room_history.merge(event["room"], entry)
+            frame = Protocol.encode_event("chat", room=event["room"], sender=entry["sender"], message=entry["message"])
+            for client_socket, username in self.sessions.room_members(event["room"]).items():
+                if username != entry["sender"]:
+                    try:
+                        client_socket.send_frame(frame, droppable=True)
+                    except:
+                        pass
+        elif kind == "private":
+            frame = Protocol.encode_event("private", sender=event["sender"], message=event["message"])
+            for client_socket in self.sessions.user_sessions(event["recipient"]):
+                try:
+                    client_socket.send_frame(frame)
+                except:
+                    pass
+            unread_count = self.unread.record(event["recipient"], lambda: 1) # The sender's worker stored it
+            if unread_count is not None:
+                self.push_unread(event["recipient"], unread_count)
+        elif kind == "unread":
+            unread_count = self.unread.record(event["username"], lambda: event["delta"])
+            if unread_count is not None:
+                self.push_unread(event["username"], unread_count)
+        elif kind == "presence":
+            workers = self.remote_online.setdefault(event["username"], set())
+            if event["online"]:
+                workers.add(event["origin"])
+            else:
+                workers.discard(event["origin"])
+        elif kind == "hello":
+            for username in list(self.sessions.users):
+                self.publish("presence", [event["origin"]], username=username, online=True)
+        elif kind == "worker_down":
+            for workers in self.remote_online.values():
+                workers.discard(event["origin"])
+
+    """
+    handle_cluster_message Applies a message another cluster node sent over its link
+
+        command   - a client of that node sent a command for a room this node owns; it
+                    runs here for the client's RemoteSession
+        deliver   - an event for a client of this node, sent by the owner of its room
+        close     - a client of that node disconnected
+        event     - a private, unread, presence or hello event, applied by handle_bus_event
+        node_down - the node's link closed, so its clients left this node's rooms and
+                    its users are no longer online there
+
+    @param self: Server instance
+    @param origin: String id of the sending node
+    @param message: Dictionary message decoded from the link
+    """
+    def handle_cluster_message(self, origin, message):
+        kind = message["type"]
+        if kind == "command":
+            session = self.cluster.remote_session(origin, message["session"])
+            if message["message"].split(" ", 1)[0] in self.ROOM_COMMANDS: # Nothing else is ever forwarded
+                self.handle_command(session, message["message"], message["username"])
+        elif kind == "deliver":
+            client_socket = self.cluster.local_session(message["session"])
+            if client_socket is not None:
+                try:
+                    client_socket.send_frame(Protocol.encode_frame(message["event"]),
+                                             droppable=message.get("droppable", False))
+                except:
+                    pass
+        elif kind == "close":
+            session = self.cluster.drop_remote(origin, message["session"])
+            if session is not None:
+                self.sessions.remove_session(session)
+        elif kind == "event":
+            self.handle_bus_event(message["event"])
+        elif kind == "node_down":
+            for session in self.cluster.drop_node(origin):
+                self.sessions.remove_session(session)
+            for nodes in list(self.remote_online.values()): # Other dispatch threads may add users
+                nodes.discard(origin)
 
     """
     user_management_menu - Displays admin menu for user management
@@ -917,7 +1736,7 @@ class Server:
     @param self: Server instance
     """
     def list_registered_users(self):
-        conn = sqlite3.connect('chat_app.db')
+        conn = self.db.acquire()
         cursor = conn.cursor()
         try:
             # Get all registered users
@@ -932,14 +1751,14 @@ class Server:
             # Check online status for each user
             for user in users:
                 username = user[0]
-                status = "[green]Online[/green]" if any(username == self.client_info[client] for client in self.client_info) else "[red]Offline[/red]"
+                status = "[green]Online[/green]" if self.sessions.is_online(username) else "[red]Offline[/red]"
                 table.add_row(username, status)
             
             console.print(table)
             input("\nPress Enter to continue...")
             
         finally:
-            conn.close()
+            self.db.release(conn)
 
     """
     remove_user_account - Removes a user account from the system
@@ -954,7 +1773,7 @@ class Server:
         
         username = input("\nEnter username to remove: ")
         
-        conn = sqlite3.connect('chat_app.db')
+        conn = self.db.acquire()
         cursor = conn.cursor()
         try:
             # Check if user exists
@@ -986,6 +1805,11 @@ class Server:
             
             # 
             cursor.execute("COMMIT")
+            self.user_ids.invalidate(username) # The cached id no longer exists
+            self.room_history.clear() # Buffers may hold the removed user's messages
+            self.unread.forget(username)
+            self.archive.purge_user(user_id) # Archived messages are removed like the live ones
+            self.close_user_sessions(username, "Your account was removed by the server administrator.")
             
             print(Panel("[green]User account removed successfully[/green]", border_style="green"))
             time.sleep(1)
@@ -995,38 +1819,91 @@ class Server:
             print(Panel(f"[red]Error removing user: {e}[/red]", border_style="red"))
             time.sleep(1)
         finally:
-            conn.close()
+            self.db.release(conn)
+
+    """
+    close_user_sessions - Disconnects every session a user is logged in from
+
+    Each session is told why, then closed once the notice was written; its handler
+    sees the connection end and drops the client as usual.
+
+    @param self: Server instance
+    @param username: String username whose sessions are closed
+    @param message: String reason shown to the user
+    """
+    def close_user_sessions(self, username, message):
+        for client_socket in self.sessions.user_sessions(username): # A snapshot, drop_client replaces it
+            log.info("Closing session of removed user", extra={"user": username})
+            try:
+                client_socket.send_frame(Protocol.encode_event("notification", kind="account_removed", message=message))
+                client_socket.close()
+            except OSError as e:
+                log.warning("Error closing session", extra={"user": username, "error": str(e)})
 
     """
     get_unread_message_count - Retrieves count of unread messages for a user
     
     get_unread_message_count connects to the database and queries the private_messages
-    table to count messages where read=0 for the specified recipient username.
+    table to count messages where read=0 for the specified recipient username. It
+    is only used to load the in-memory UnreadCounters when a user logs in.
     
     @param self: Server instance
     @param username: String username to check unread messages for
     @return: Integer count of unread messages
     """
     def get_unread_message_count(self, username):
-        conn = sqlite3.connect('chat_app.db')
-        cursor = conn.cursor()
-        try:
-            cursor.execute("""
-                SELECT COUNT(*) 
-                FROM private_messages m
-                JOIN users r ON m.recipient_id = r.user_id
-                WHERE r.username = ? AND m.read = 0
-            """, (username,))
-            return cursor.fetchone()[0]
-        finally:
-            conn.close()
+        recipient_id = self.user_ids.get(username)
+        if recipient_id is None:
+            return 0
+        with self.db.connection() as conn:
+            return conn.execute("SELECT COUNT(*) FROM private_messages WHERE recipient_id = ? AND read = 0",
+                                (recipient_id,)).fetchone()[0] # Answered from idx_private_recipient_read
+
+    """
+    load_unread_count - Loads a user's unread count, used by the unread counters
+
+    Private messages still queued on the MessageWriter are committed first so that
+    they are included in the count.
+
+    @param self: Server instance
+    @param username: String username that logged in
+    @return: Integer count of unread messages
+    """
+    def load_unread_count(self, username):
+        self.message_writer.flush()
+        return self.get_unread_message_count(username)
+
+    """
+    push_unread - Sends a user's unread count to their sessions
+
+    Only the newest count matters, so an older count still waiting in a slow
+    session's outbound queue is replaced under the coalesce policy.
+
+    @param self: Server instance
+    @param username: String username whose count changed
+    @param unread_count: Integer new unread count
+    @param sessions: Iterable of sessions to notify, defaults to every session of the user
+    @param only_if_unread: Boolean skip the notification when the count is zero
+    """
+    def push_unread(self, username, unread_count, sessions=None, only_if_unread=False):
+        if only_if_unread and not unread_count:
+            return
+        notification = Protocol.encode_event(
+            "notification", kind="unread", unread=unread_count,
+            message=f"You have {unread_count} unread message{'' if unread_count == 1 else 's'}!")
+        for client_socket in (self.sessions.user_sessions(username) if sessions is None else sessions):
+            try:
+                client_socket.send_frame(notification, coalesce_key="unread")
+            except:
+                pass
 
     """
     check_unread_messages - Checks and notifies client of unread messages
     
-    check_unread_messages looks up unread message count for the client's username
-    and if there are unread messages, sends a notification to the client's socket
-    with the count.
+    check_unread_messages looks up the unread message count for the client's username
+    in the in-memory counters and if there are unread messages, sends a notification
+    to the client's socket with the count. Counts are also pushed whenever they change,
+    so clients do not need to poll.
     
     @param self: Server instance  
     @param client_socket: Socket object for the client to notify
@@ -1034,82 +1911,40 @@ class Server:
     def check_unread_messages(self, client_socket):
         if client_socket in self.client_info:
             username = self.client_info[client_socket]
-            unread_count = self.get_unread_message_count(username)
-            if unread_count > 0:
-                notification = f"/notification You have {unread_count} unread message{'s' if unread_count > 1 else ''}!"
-                try:
-                    client_socket.send(notification.encode())
-                except:
-                    pass
-
-
-    def remove_client(self, client_socket, client_name):
-        """
-        Cleanly removes a client from the server and performs all necessary cleanup
-        """
-        print(f"Starting cleanup for client {client_name}")
+            self.push_unread(username, self.unread.load(username), [client_socket], only_if_unread=True)
 
-        try:
-            # Remove from chatrooms first
-            if client_name:
-                for chatroom in list(self.active_chatrooms.keys()):
-                    if client_name in self.active_chatrooms[chatroom]:
-                        print(f"Removing {client_name} from chatroom {chatroom}")
-                        self.active_chatrooms[chatroom].remove(client_name)
-                        
-                        # Remove empty chatrooms
-                        if not self.active_chatrooms[chatroom]:
-                            del self.active_chatrooms[chatroom]
-                            print(f"Removed empty chatroom {chatroom}")
-                        else:
-                            # Notify others in chatroom
-                            try:
-                                self.broadcast_chatroom_message(chatroom, "Server", f"{client_name} has disconnected")
-                            except Exception as e:
-                                print(f"Error broadcasting disconnect message: {e}")
-
-            # Remove from client tracking structures
-            if client_socket in Server.clients:
-                print(f"Removing client from Server.clients. Before: {len(Server.clients)}")
-                Server.clients.remove(client_socket)
-                print(f"After removal: {len(Server.clients)}")
-
-            if client_socket in self.client_info:
-                print(f"Removing client from client_info")
-                del self.client_info[client_socket]
-
-            # Close the socket
-            try:
-                client_socket.close()
-                print("Closed client socket")
-            except Exception as e:
-                print(f"Error closing client socket: {e}")
-
-            print(f"Successfully completed cleanup for client {client_name}")
-
-        except Exception as e:
-            print(f"Error during client cleanup: {e}")
 
-    
 """
 ServerStatus manages server monitoring interface display and real-time updates.
 
 ServerStatus provides UI generation methods to display server metrics, active connections,
 chatroom status and related information. Works with the server_menu() to create a live 
 monitoring dashboard.
+
+The layout is built once and only its changing panels are replaced, and only when the
+state they show changed: the session registry's version, the number of connections,
+the selected page or the clock's second. Long client and chatroom lists are cut to
+one page, so a busy server does not turn every redraw into a walk over every session.
 """
 class ServerStatus:
+    CLIENTS_PER_PAGE = 20 # Connected clients listed per page
+    ROOMS_SHOWN = 10 # Largest chatrooms listed
+    ROOM_USERS_SHOWN = 5 # Members named under each listed chatroom
+    STATUS_SECONDS = 5 # Counters in the status panel are read again this often
+
     def __init__(self, server):
         self.server = server
         self.stop_event = Event()
-
+        self.page = 0
+        self.rendered = None # (clock, state) key of the panels currently shown
+        self.layout = self.build_layout()
 
     """
-    generate_layout Creates and updates the server monitoring interface layout
+    build_layout Creates the monitoring interface layout and its static panels
 
-    @return: Layout object containing full server monitoring interface
+    @return: Layout object whose header and status panels are filled in by generate_layout
     """
-    def generate_layout(self) -> Layout:
+    def build_layout(self) -> Layout:
     
         layout = Layout()
         
@@ -1132,50 +1967,27 @@ class ServerStatus:
             Layout(name="status", ratio=2),
         )
         
-        # Update header with live information
-        current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        layout["header"]["left"].update(
-            Panel(
-                Align.center(f"[cyan]Server Status: RUNNING[/cyan]\nTime: {current_time}"),
-                style="green"
-            )
-        )
         layout["header"]["middle"].update(
             Panel(
                 Align.center("[bold]Server Management Console[/bold]"),
                 style="cyan"
             )
         )
-        layout["header"]["right"].update(
-            Panel(
-                Align.center(
-                    f"[green]Active Clients: {len(Server.clients)}[/green]\n"
-                ),
-                style="green"
-            )
-        )
         
         # Menu options
         menu_content = """
 1. [cyan]View Active Connections[/cyan]\n
 2. [cyan]User Management[/cyan]\n
 3. [red]Shutdown Server[/red]\n
+4. [cyan]Profile Hot Paths[/cyan]\n
+5. [cyan]View Server Logs[/cyan]\n
+n/p. [cyan]Next / Previous Page[/cyan]\n
 
         """
         layout["body"]["menu"].update(
             Panel(menu_content, title="[bold]Server Options[/bold]", border_style="cyan")
         )
         
-        # Live status information
-        status_content = self.generate_status_content()
-        layout["body"]["status"].update(
-            Panel(
-                status_content,
-                title="[bold]Server Status[/bold]",
-                border_style="green"
-            )
-        )
-        
         # Server details in footer
         addr = self.server.socket.getsockname()
         layout["footer"].update(
@@ -1187,6 +1999,64 @@ class ServerStatus:
         
         return layout
 
+    """
+    generate_layout Updates the server monitoring interface layout if the server state changed
+
+    Only the clock in the header changes every second. The rest of the header and the
+    status panel are rebuilt when sessions, connections or the page change, and every
+    STATUS_SECONDS for the counters.
+
+    @return: Layout object containing full server monitoring interface
+    """
+    def generate_layout(self) -> Layout:
+        clock = int(time.time())
+        state = (self.server.sessions.version, len(Server.clients), self.page,
+                 int(time.monotonic() // self.STATUS_SECONDS))
+        rendered_clock, rendered_state = self.rendered or (None, None)
+        
+        # Update header with the current time
+        if clock != rendered_clock:
+            current_time = datetime.fromtimestamp(clock).strftime("%Y-%m-%d %H:%M:%S")
+            self.layout["header"]["left"].update(
+                Panel(
+                    Align.center(f"[cyan]Server Status: RUNNING[/cyan]\nTime: {current_time}"),
+                    style="green"
+                )
+            )
+        self.rendered = (clock, state)
+        if state == rendered_state:
+            return self.layout
+        
+        self.layout["header"]["right"].update(
+            Panel(
+                Align.center(
+                    f"[green]Active Clients: {len(Server.clients)}[/green]\n"
+                ),
+                style="green"
+            )
+        )
+        
+        # Live status information
+        status_content = self.generate_status_content()
+        self.layout["body"]["status"].update(
+            Panel(
+                status_content,
+                title="[bold]Server Status[/bold]",
+                border_style="green"
+            )
+        )
+        
+        return self.layout
+
+    """
+    change_page Moves the connected clients list to another page
+
+    @param step: Integer pages to move, negative to go back
+    """
+    def change_page(self, step):
+        pages = max(1, -(-len(self.server.client_info) // self.CLIENTS_PER_PAGE))
+        self.page = min(max(self.page + step, 0), pages - 1)
+
     """
     generate_status_content creates status information for display
 
@@ -1196,25 +2066,427 @@ class ServerStatus:
         
         status = []
         
-        # Active clients section
-        status.append("[bold cyan]Connected Clients:[/bold cyan]")
-        for client_socket, username in self.server.client_info.items():
-            try:
-                addr = client_socket.getpeername()
-                status.append(f"  • [green]{username}[/green] ({addr[0]}:{addr[1]})")
-            except:
+        # Active clients section, one page at a time
+        clients = self.server.client_info
+        pages = max(1, -(-len(clients) // self.CLIENTS_PER_PAGE))
+        self.page = min(self.page, pages - 1) # Clients may have left since the page was chosen
+        first = self.page * self.CLIENTS_PER_PAGE
+        status.append(f"[bold cyan]Connected Clients:[/bold cyan] page {self.page + 1}/{pages}, {len(clients)} logged in")
+        # islice runs in C without releasing the GIL, so handlers cannot resize the dictionary while it is sliced
+        for client_socket, username in list(itertools.islice(clients.items(), first, first + self.CLIENTS_PER_PAGE)):
+            peer = self.server.client_peers.get(client_socket)
+            if peer is None:
                 continue
+            addr = peer[0]
+            status.append(f"  • [green]{username}[/green] ({addr[0]}:{addr[1]})")
         
-        # Active chatrooms section
-        status.append("\n[bold cyan]Active Chatrooms:[/bold cyan]")
-        for room_name, users in self.server.active_chatrooms.items():
-            status.append(f"  • [yellow]{room_name}[/yellow] ({len(users)} users)")
-            for user in users:
+        # Active chatrooms section, largest first
+        rooms = self.server.sessions.rooms
+        status.append(f"\n[bold cyan]Active Chatrooms:[/bold cyan] {len(rooms)} with connected members")
+        for room_name, members in heapq.nlargest(self.ROOMS_SHOWN, list(rooms.items()), key=lambda room: len(room[1])):
+            status.append(f"  • [yellow]{room_name}[/yellow] ({len(members)} users)")
+            for user in itertools.islice(members.values(), self.ROOM_USERS_SHOWN):
                 status.append(f"    ◦ [green]{user}[/green]")
+            if len(members) > self.ROOM_USERS_SHOWN:
+                status.append(f"    ◦ [dim]{len(members) - self.ROOM_USERS_SHOWN} more[/dim]")
+        if len(rooms) > self.ROOMS_SHOWN:
+            status.append(f"  • [dim]{len(rooms) - self.ROOMS_SHOWN} smaller chatrooms not shown[/dim]")
+
+        # Password hashing section
+        hasher = self.server.password_hasher
+        status.append("\n[bold cyan]Authentication Pool:[/bold cyan]")
+        status.append(f"  • {hasher.in_flight}/{hasher.max_in_flight} in flight on {hasher.workers} workers, "
+                      f"queue depth {hasher.queue_depth()}, {hasher.rejected} rejected as busy")
+
+        # Identity cache section
+        status.append("\n[bold cyan]Identity Cache:[/bold cyan]")
+        for label, cache in (("Users", self.server.user_ids), ("Chatrooms", self.server.chatroom_ids)):
+            status.append(f"  • {label}: {len(cache.entries)} cached, {cache.hits} hits / {cache.misses} misses "
+                          f"({cache.hit_rate():.0%})")
+        history = self.server.room_history
+        status.append(f"  • Unread counters: {len(self.server.unread.counts)} users tracked, "
+                      f"{self.server.unread.loads} loaded from the database")
+        status.append(f"  • Room history: {len(history.rooms)} rooms buffered, {history.warmups} warmed from the database")
+        segments, archived = self.server.archive.stats()
+        status.append(f"  • Archive: {archived} messages in {segments} segments")
+
+        profiler = self.server.profiler
+        if profiler.running():
+            status.append(f"  • Profiler: sampling, {max(0, profiler.ends_at - time.monotonic()):.0f}s left")
+        elif profiler.last_summary is not None:
+            summary = profiler.last_summary
+            hottest = summary["self"][0][0] if summary["self"] else "nothing"
+            status.append(f"  • Profiler: last profile {os.path.basename(summary['path'])}, hottest {hottest}")
+        server_log = self.server.server_log
+        status.append(f"  • Log: {server_log.path}, {server_log.queued()} records queued, {server_log.dropped} dropped")
+        if self.server.metrics is not None:
+            host, port = self.server.metrics.http_server.server_address[:2]
+            status.append(f"  • Metrics: http://{host}:{port}/metrics")
+
+        # Cluster section
+        cluster = self.server.cluster
+        if cluster is not None:
+            status.append("\n[bold cyan]Cluster:[/bold cyan]")
+            status.append(f"  • Node {cluster.node_id} of {len(cluster.nodes)}, "
+                          f"{len(cluster.links)} links open")
+            status.append(f"  • {cluster.forwarded_commands} commands forwarded, {cluster.remote_commands} received, "
+                          f"{len(cluster.local_sessions)} local / {len(cluster.remote_sessions)} remote sessions")
+
+        # Outbound queue section
+        stats = self.server.outbound_stats
+        status.append("\n[bold cyan]Outbound Queues:[/bold cyan]")
+        status.append(f"  • Policy {self.server.slow_consumer_policy}, {self.server.outbound_limit} bytes per client")
+        status.append(f"  • {stats.queued_frames} frames / {stats.queued_bytes} bytes queued, "
+                      f"{stats.dropped_frames} frames / {stats.dropped_bytes} bytes dropped, "
+                      f"{stats.coalesced_frames} coalesced, {stats.disconnects} slow consumers disconnected")
         
         return "\n".join(status)
 
+
+"""
+AsyncConnection adapts an asyncio stream to the connection methods used by Server.
+
+AsyncConnection lets the asyncio engine hand its connections to the shared Server
+command handlers, which only call send_message, send_frame, getpeername and close.
+Sends go into the connection's OutboundQueue, which is drained by a writer task that
+respects the transport's flow control, so a slow reader neither blocks the loop nor
+grows the transport buffer without limit. The queue may be filled from any thread
+(the server menu or an executor worker); the writer task is woken on the event loop.
+"""
+class AsyncConnection:
+    def __init__(self, writer, loop, outbound):
+        self.writer = writer
+        self.loop = loop
+        self.loop_thread = threading.get_ident() # Connections are created on the event loop thread
+        self.peername = writer.get_extra_info('peername')
+        self.reader = Protocol.FrameReader() # Per-connection receive buffer
+        self.ready = asyncio.Event() # Set when the outbound queue has frames or was closed
+        self.outbound = outbound
+        self.outbound.on_ready = self.wake
+
+    def send_message(self, message, coalesce_key=None):
+        self.send_frame(Protocol.encode_frame(message), coalesce_key)
+
+    """
+    send_frame Queues already encoded frame bytes for the writer task
+
+    @param frame: Bytes produced by Protocol.encode_frame
+    @param coalesce_key: Hashable key for the coalesce policy
+    @param droppable: Boolean the frame may be discarded when the client falls behind
+    """
+    def send_frame(self, frame, coalesce_key=None, droppable=False):
+        if not self.outbound.put(frame, coalesce_key, droppable) and self.outbound.overflowed:
+            self.call_on_loop(self.writer.transport.abort) # Slow consumer was disconnected by the policy
+
+    """
+    write_loop Writes queued frames to the stream until the queue is closed
+
+    Every frame queued since the last write is sent with one write call, and the
+    task waits for the transport to drain before taking more.
+    """
+    async def write_loop(self):
+        try:
+            while True:
+                self.ready.clear()
+                frames = self.outbound.take(block=False)
+                if frames is None:
+                    break
+                if frames:
+                    self.writer.write(b"".join(frames))
+                    await self.writer.drain()
+                else:
+                    await self.ready.wait()
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            self.writer.close()
+
+    def wake(self):
+        self.call_on_loop(self.ready.set)
+
+    def call_on_loop(self, callback):
+        if threading.get_ident() == self.loop_thread:
+            callback()
+        else:
+            self.loop.call_soon_threadsafe(callback)
+
+    def getpeername(self):
+        return self.peername
+
+    """
+    close Closes the connection after the queued frames have been written
+    """
+    def close(self):
+        self.outbound.close()
+
+
+"""
+AsyncServer serves the chat command set from a single asyncio event loop.
+
+AsyncServer replaces the thread-per-connection model of Server with one event loop that
+multiplexes every client connection, so a single process can hold tens of thousands of
+mostly idle connections. Commands are executed by the shared Server.handle_command.
+Only the commands listed in LOOP_COMMANDS, which read nothing but the in-memory session
+index, run on the loop itself; every other command may hash a password, query the
+database or wait for the MessageWriter, so it runs in the loop's default executor and
+a slow one does not stall the other clients. A new command is therefore off the loop
+unless it is added to the list.
+"""
+class AsyncServer(Server):
+
+    LOOP_COMMANDS = ("/view_chatroom_users", "/exit_chatroom") # Purely in-memory, cheap enough for the event loop
+
+    """
+    runs_on_loop Checks whether a command may run on the event loop thread
+
+    In cluster mode room commands may open a link to another node, so none of them do.
+
+    @param self: AsyncServer instance
+    @param message: Decoded command string received from the client
+    @return: Boolean True for commands in LOOP_COMMANDS outside cluster mode
+    """
+    def runs_on_loop(self, message):
+        return self.cluster is None and message.split(" ", 1)[0] in self.LOOP_COMMANDS
+
+    """
+    listen Runs the event loop until the server is shut down
+
+    @param self: AsyncServer instance
+    """
+    def listen(self):
+        asyncio.run(self.serve())
+
+    """
+    serve Starts accepting connections on the already bound server socket
+
+    serve raises the open file limit where the platform allows it, widens the accept
+    backlog and waits until shutdown_server asks the loop to stop.
+
+    @param self: AsyncServer instance
+    """
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        self.stop_event = asyncio.Event()
+
+        try:
+            import resource # Not available on Windows
+            soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard)) # Every client connection needs a file descriptor
+        except (ImportError, ValueError, OSError):
+            pass
+
+        self.socket.listen(socket.SOMAXCONN) # Absorb reconnect bursts
+        self.socket.setblocking(False)
+        server = await asyncio.start_server(self.handle_connection, sock=self.socket)
+        async with server:
+            await self.stop_event.wait()
+
+    """
+    handle_connection Processes all incoming commands from one connected client
+
+    handle_connection is the asyncio counterpart of handle_client. It reads messages
+    from the stream and passes them to handle_command until the client disconnects.
+
+    @param self: AsyncServer instance
+    @param reader: asyncio.StreamReader for the client connection
+    @param writer: asyncio.StreamWriter for the client connection
+    """
+    async def handle_connection(self, reader, writer):
+        client_socket = AsyncConnection(writer, self.loop, self.new_outbound_queue())
+        self.loop.create_task(client_socket.write_loop())
+        peer = client_socket.getpeername()
+        log.info("Connection accepted", extra={"peer": f"{peer[0]}:{peer[1]}"})
+        if self.metrics is not None:
+            self.metrics.inc("chitchat_accepted_connections_total")
+        Server.clients.append(client_socket)
+        self.client_peers[client_socket] = (client_socket.getpeername(), datetime.now())
+        client_name = None
+
+        try:
+            while True:
+                data = await reader.read(Protocol.RECV_SIZE)
+                if not data:
+                    break
+
+                for frame in client_socket.reader.feed(data): # A single read may carry several pipelined frames
+                    message = frame.decode('utf-8')
+                    if self.runs_on_loop(message):
+                        client_name = self.run_command(client_socket, message, client_name)
+                    else:
+                        client_name = await self.loop.run_in_executor(
+                            None, self.run_command, client_socket, message, client_name)
+
+        except Exception as e:
+            log.warning("Error handling client", extra={"user": client_name, "error": str(e)})
+        finally:
+            self.drop_client(client_socket, client_name)
+
+    """
+    close_listener Stops the event loop, which closes the listening socket
+
+    @param self: AsyncServer instance
+    """
+    def close_listener(self):
+        self.loop.call_soon_threadsafe(self.stop_event.set)
+        log.info("Server socket closed")
+
+
+"""
+run_worker Runs one server process of worker mode until it is told to stop
+
+The parent process handles Ctrl+C for the whole group and stops the workers with
+SIGTERM, which shuts the worker down like the server menu's shutdown option.
+
+@param engine_name String "threaded" or "asyncio"
+@param options Dictionary of Server keyword arguments
+"""
+def run_worker(engine_name, options):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    ServerLogger.detach_inherited() # The parent's log queue has no listener in this process
+    engine = AsyncServer if engine_name == "asyncio" else Server
+    server = engine(**options)
+
+    def stop(signum, frame):
+        if engine is AsyncServer: # The event loop runs on this thread and must keep running to be stopped
+            threading.Thread(target=server.shutdown_server).start()
+        else:
+            server.shutdown_server() # Its sys.exit ends the accept loop
+    signal.signal(signal.SIGTERM, stop)
+    server.listen()
+
+
+"""
+run_workers Serves one port from several processes that share it with SO_REUSEPORT
+
+Each worker is a complete headless server with its own interpreter, so the chat
+service can use more than one core. The workers share the database and relay room
+messages, private messages, unread counts and presence over a WorkerBus hub owned by
+this process. Only the first worker compacts the message archive. With a metrics port,
+worker i serves its metrics on metrics_port + i. Worker i logs to server-i.log and this
+process to server.log, so the processes never rotate the same file.
+
+@param engine_name String "threaded" or "asyncio"
+@param workers Integer number of worker processes
+@param options Dictionary of Server keyword arguments
+"""
+def run_workers(engine_name, workers, options):
+    # The parent logs the migration and the bus hub to the unnumbered log file
+    server_log = ServerLogger.ServerLogger(options.get("log_path", "server.log"), options.get("log_level", "INFO"),
+                                           echo=True)
+
+    # Create or upgrade the database once, before the workers open it concurrently
+    db = DatabasePool.DatabasePool(options.get("db_path", "chat_app.db"), size=1)
+    with db.connection() as conn:
+        Migrations.migrate(conn)
+    db.close()
+
+    bus_path = os.path.join(tempfile.gettempdir(), f"chitchat-{os.getpid()}.bus")
+    hub = WorkerBus.BusHub(bus_path)
+    hub.start()
+    if options.get("auth_workers") is None: # Share the cores between the workers' hashing pools
+        options["auth_workers"] = max(1, ((os.cpu_count() or 2) - 1) // workers)
+
+    processes = []
+    for index in range(workers):
+        worker_options = dict(options, reuse_port=True, headless=True, bus_path=bus_path,
+                              compact_interval=options.get("compact_interval", 3600) if index == 0 else 0)
+        if options.get("metrics_port"): # One endpoint per worker
+            worker_options["metrics_port"] = options["metrics_port"] + index
+        root, extension = os.path.splitext(options.get("log_path", "server.log"))
+        worker_options["log_path"] = f"{root}-{index}{extension}"
+        process = multiprocessing.Process(target=run_worker, args=(engine_name, worker_options), name=f"worker-{index}")
+        process.start()
+        processes.append(process)
+    log.info("Workers started, press Ctrl+C to stop", extra={"workers": workers, "engine": engine_name,
+                                                             "port": options['PORT']})
+
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        log.info("Stopping workers")
+        for process in processes:
+            process.terminate() # SIGTERM, handled by run_worker
+        for process in processes:
+            process.join(10)
+            if process.is_alive():
+                process.kill()
+    finally:
+        hub.close()
+        server_log.close()
+
     
 if __name__ == '__main__':
-    server = Server('0.0.0.0', 7632) # Uses Localhost IP for testing   
-    server.listen() # Start listening for incoming connections
\ No newline at end of file
+    multiprocessing.freeze_support() # Lets the password hashing workers start from a PyInstaller build
+    parser = argparse.ArgumentParser(description="Run the ChitChat server")
+    parser.add_argument("--engine", choices=["threaded", "asyncio"], default="threaded",
+                        help="threaded: one thread per client, asyncio: single event loop for all clients")
+    parser.add_argument("--durability", choices=MessageWriter.DURABILITY_MODES, default="batched",
+                        help="batched: acknowledge before the group commit, sync: wait for the commit")
+    parser.add_argument("--auth-workers", type=int, default=None,
+                        help="Password hashing processes (default: CPU count - 1)")
+    parser.add_argument("--max-auth-in-flight", type=int, default=None,
+                        help="Concurrent logins/registrations before clients are told to retry (default: 4 per worker)")
+    parser.add_argument("--slow-consumer-policy", choices=OutboundQueue.POLICIES, default="drop_oldest",
+                        help="What to do when a client's outbound queue is full")
+    parser.add_argument("--history-size", type=int, default=50,
+                        help="Recent messages per chatroom replayed to users joining it")
+    parser.add_argument("--outbound-limit", type=int, default=OutboundQueue.DEFAULT_MAX_BYTES,
+                        help="Bytes queued for one client before the slow consumer policy applies")
+    parser.add_argument("--retention-days", type=int, default=None,
+                        help="Days chatroom messages stay in the database before they are archived (default: forever)")
+    parser.add_argument("--private-retention-days", type=int, default=None,
+                        help="Days read private messages stay in the database before they are archived (default: forever)")
+    parser.add_argument("--archive-dir", default=None,
+                        help="Directory of the archive segments (default: the database path plus .archive)")
+    parser.add_argument("--compact-interval", type=int, default=3600,
+                        help="Seconds between archive compactions")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Server processes sharing the port with SO_REUSEPORT, without the server menu (default: 1)")
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="Serve Prometheus metrics on http://127.0.0.1:PORT/metrics (default: off)")
+    parser.add_argument("--port", type=int, default=None,
+                        help="Client port (default: the node's port in --cluster-config, otherwise 7632)")
+    parser.add_argument("--node-id", default=None,
+                        help="This server's id in --cluster-config")
+    parser.add_argument("--cluster-config", default=None,
+                        help="JSON file listing the cluster nodes; chatrooms are sharded across them, but every node "
+                             "must run from the same directory, sharing chat_app.db and --archive-dir")
+    parser.add_argument("--log-file", default=None,
+                        help="Server log, rotated at 10 MB (default: server.log, server-NODE.log in cluster mode)")
+    parser.add_argument("--log-level", choices=["DEBUG", "INFO", "WARNING", "ERROR"], default="INFO",
+                        help="DEBUG also logs every command with its user and latency")
+    args = parser.parse_args()
+
+    port, cluster_nodes, compact_interval = args.port or 7632, None, args.compact_interval
+    if args.cluster_config or args.node_id:
+        if not (args.cluster_config and args.node_id):
+            parser.error("--cluster-config and --node-id must be given together")
+        if args.workers > 1:
+            parser.error("--workers cannot be combined with cluster mode")
+        try:
+            cluster_nodes = ClusterNode.load_config(args.cluster_config)
+        except (OSError, ValueError) as e:
+            parser.error(str(e))
+        node = next((node for node in cluster_nodes if node["id"] == args.node_id), None)
+        if node is None:
+            parser.error(f"Node '{args.node_id}' is not in {args.cluster_config}")
+        port = args.port or node["port"]
+        if node is not cluster_nodes[0]:
+            compact_interval = 0 # The nodes share the database and archive; the first node compacts them
+
+    options = dict(HOST='0.0.0.0', PORT=port, durability=args.durability, auth_workers=args.auth_workers,
+                   max_auth_in_flight=args.max_auth_in_flight, slow_consumer_policy=args.slow_consumer_policy,
+                   outbound_limit=args.outbound_limit, history_size=args.history_size,
+                   retention_days=args.retention_days, private_retention_days=args.private_retention_days,
+                   archive_dir=args.archive_dir, compact_interval=compact_interval,
+                   metrics_port=args.metrics_port, log_level=args.log_level) # Uses Localhost IP for testing
+    if cluster_nodes:
+        options.update(node_id=args.node_id, cluster_nodes=cluster_nodes)
+    options["log_path"] = args.log_file or (f"server-{args.node_id}.log" if cluster_nodes else "server.log")
+    if args.workers > 1:
+        run_workers(args.engine, args.workers, options)
+    else:
+        engine = AsyncServer if args.engine == "asyncio" else Server
+        server = engine(**options)
+        server.listen() # Start listening for incoming connections
\ No newline at end of file
@@ -12,6 +12,7 @@ Options:
   --messages NUM      Number of messages per client (default: 5)
   --interval SECONDS  Delay between messages (default: 0.5)
   --chatroom NAME     Chatroom name to use (default: "StressTest")
+  --batch NUM         Messages pipelined per send call (default: 1)
 """
 
 import socket
@@ -21,11 +22,12 @@ import random
 import argparse
 import sys
 from concurrent.futures import ThreadPoolExecutor
+import Protocol
 
 class TestClient:
     """Simulates a client connection to the chat server."""
     
-    def __init__(self, host, port, client_id, messages, interval, chatroom):
+    def __init__(self, host, port, client_id, messages, interval, chatroom, batch=1):
         """Initialize test client with connection parameters."""
         self.host = host
         self.port = port
@@ -35,6 +37,7 @@ class TestClient:
         self.messages = messages
         self.interval = interval
         self.chatroom = chatroom
+        self.batch = max(1, batch)
         self.socket = None
         
     def connect(self):
@@ -42,19 +45,18 @@ class TestClient:
         try:
             self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.socket.connect((self.host, self.port))
+            self.socket = Protocol.Connection(self.socket)
             print(f"Client {self.client_id}: Connected to server")
             
             # Register the user
-            self.socket.send(f"/register {self.username} {self.password}".encode())
-            response = self.socket.recv(1024).decode()
+            response = self.request_with_retry(f"/register {self.username} {self.password}")
             
             # If registration fails (likely because user exists), try to login
-            if "successful" not in response.lower():
-                self.socket.send(f"/login {self.username} {self.password}".encode())
-                response = self.socket.recv(1024).decode()
+            if response["type"] != "ack":
+                response = self.request_with_retry(f"/login {self.username} {self.password}")
                 
-            if "successful" not in response.lower():
-                print(f"Client {self.client_id}: Authentication failed - {response}")
+            if response["type"] != "ack":
+                print(f"Client {self.client_id}: Authentication failed - {response['message']}")
                 self.socket.close()
                 return False
                 
@@ -67,25 +69,42 @@ class TestClient:
                 self.socket.close()
             return False
             
+    def request(self, command):
+        """Send a command and return its ack or error event, skipping pushed chat events."""
+        self.socket.send_message(command)
+        name = command.split(" ", 1)[0]
+        while True:
+            event = self.socket.recv_event()
+            if event is None:
+                raise ConnectionError("Connection closed by server")
+            if event["type"] in ("ack", "error") and event.get("command") == name:
+                return event
+
+    def request_with_retry(self, command, attempts=5):
+        """Send an authentication command, backing off while the server reports it is busy."""
+        for attempt in range(attempts):
+            response = self.request(command)
+            if not response.get("busy"):
+                break
+            time.sleep(0.1 * 2 ** attempt + random.random() * 0.1)
+        return response
+            
     def join_or_create_chatroom(self):
         """Join the specified chatroom or create it if it doesn't exist."""
         try:
             # First try to join the chatroom
-            self.socket.send(f"/join_chatroom {self.chatroom}".encode())
-            response = self.socket.recv(1024).decode()
+            response = self.request(f"/join_chatroom {self.chatroom}")
             
             # If joining fails, create the chatroom
-            if "joined" not in response.lower():
-                self.socket.send(f"/create_chatroom {self.chatroom}".encode())
-                response = self.socket.recv(1024).decode()
+            if response["type"] != "ack":
+                response = self.request(f"/create_chatroom {self.chatroom}")
                 
-                if "created" not in response.lower():
-                    print(f"Client {self.client_id}: Failed to create/join chatroom - {response}")
+                if response["type"] != "ack":
+                    print(f"Client {self.client_id}: Failed to create/join chatroom - {response['message']}")
                     return False
                     
                 # Try joining again after creating
-                self.socket.send(f"/join_chatroom {self.chatroom}".encode())
-                response = self.socket.recv(1024).decode()
+                response = self.request(f"/join_chatroom {self.chatroom}")
                 
             print(f"Client {self.client_id}: Joined chatroom {self.chatroom}")
             
@@ -101,11 +120,11 @@ class TestClient:
         """Listen for and handle incoming messages from the server."""
         try:
             while True:
-                response = self.socket.recv(1024).decode()
-                if not response:
+                event = self.socket.recv_event()
+                if event is None:
                     break
-                # Just a minimal handler for server responses
-                if "exit" in response.lower():
+                # Just a minimal handler for server events
+                if event["type"] == "ack" and event.get("command") == "/exit_chatroom":
                     break
         except:
             pass
@@ -113,14 +132,17 @@ class TestClient:
     def send_messages(self):
         """Send a series of test messages to the chatroom."""
         try:
-            for i in range(self.messages):
-                message = f"Test message {i+1} from client {self.client_id} at {time.time()}"
-                self.socket.send(f"/chatroom_message {self.chatroom} {message}".encode())
-                print(f"Client {self.client_id}: Sent message {i+1}/{self.messages}")
+            for start in range(0, self.messages, self.batch):
+                batch = []
+                for i in range(start, min(start + self.batch, self.messages)):
+                    message = f"Test message {i+1} from client {self.client_id} at {time.time()}"
+                    batch.append(f"/chatroom_message {self.chatroom} {message}")
+                self.socket.send_messages(batch) # Pipeline the whole batch in one send call
+                print(f"Client {self.client_id}: Sent message {start+len(batch)}/{self.messages}")
                 time.sleep(self.interval)
                 
             # Exit the chatroom
-            self.socket.send(f"/exit_chatroom {self.chatroom}".encode())
+            self.socket.send_message(f"/exit_chatroom {self.chatroom}")
             time.sleep(0.5)  # Wait for exit confirmation
             
             return True
@@ -133,7 +155,7 @@ class TestClient:
         """Close the connection to the server."""
         try:
             if self.socket:
-                self.socket.send("/exit".encode())
+                self.socket.send_message("/exit")
                 self.socket.close()
                 print(f"Client {self.client_id}: Disconnected from server")
         except:
@@ -160,6 +182,7 @@ def run_stress_test(args):
     print(f"Server: {args.host}:{args.port}")
     print(f"Messages per client: {args.messages}")
     print(f"Interval between messages: {args.interval} seconds")
+    print(f"Messages per send call: {args.batch}")
     print(f"Chatroom: {args.chatroom}\n")
     
     start_time = time.time()
@@ -175,7 +198,8 @@ def run_stress_test(args):
                 i+1, 
                 args.messages, 
                 args.interval, 
-                args.chatroom
+                args.chatroom,
+                args.batch
             )
             futures.append(executor.submit(client.run))
             
@@ -208,6 +232,7 @@ if __name__ == "__main__":
     parser.add_argument("--messages", type=int, default=5, help="Messages per client")
     parser.add_argument("--interval", type=float, default=0.5, help="Delay between messages (seconds)")
     parser.add_argument("--chatroom", default="StressTest", help="Chatroom name to use")
+    parser.add_argument("--batch", type=int, default=1, help="Messages pipelined per send call")
     
     args = parser.parse_args()
     
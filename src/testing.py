@@ -1,6 +1,7 @@
 import socket
 import threading
 import time
+import Protocol
 
 TARGET_HOST = "127.0.0.1"
 TARGET_PORT = 7632
@@ -10,7 +11,7 @@ def worker(client_id):
     try:
         s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         s.connect((TARGET_HOST, TARGET_PORT))
-        s.send(f"/login TestUser{client_id} TestPass".encode())
+        s.sendall(Protocol.encode_frame(f"/login TestUser{client_id} TestPass"))
         time.sleep(1)
         s.close()
     except Exception as e:
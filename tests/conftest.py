@@ -0,0 +1,63 @@
+"""
+Shared fixtures of the ChitChat test suite.
+
+The server modules live flat in src/ and import each other by name, so src/ is put on
+the import path the same way running them from that directory does.
+"""
+
+import os
+import sys
+import socket
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+import bcrypt # noqa: E402
+import server # noqa: E402
+import Protocol # noqa: E402
+import OutboundQueue # noqa: E402
+
+PASSWORD = "test-password"
+
+
+"""
+chat_server Runs a headless Server on a temporary database without accepting clients
+"""
+@pytest.fixture
+def chat_server(tmp_path):
+    instance = server.Server('127.0.0.1', 0, db_path=str(tmp_path / "chat.db"), auth_workers=1, compact_interval=0,
+                             headless=True, log_path=str(tmp_path / "server.log"), log_level="ERROR")
+    yield instance
+    try:
+        instance.shutdown_server()
+    except SystemExit:
+        pass
+
+
+"""
+add_users Inserts users directly, sharing one password hash so no bcrypt pool is needed
+
+@param chat_server Server owning the database
+@param usernames Strings to register
+"""
+def add_users(chat_server, *usernames):
+    salt = bcrypt.gensalt(4)
+    password_hash = bcrypt.hashpw(PASSWORD.encode('utf-8'), salt).decode('utf-8')
+    with chat_server.db.connection() as conn:
+        conn.executemany("INSERT INTO users (username, password_hash, salt) VALUES (?, ?, ?)",
+                         [(username, password_hash, salt.decode('utf-8')) for username in usernames])
+        conn.commit()
+
+
+"""
+open_session Registers a logged in session whose client end the test reads
+
+@param chat_server Server the session belongs to
+@param username String username the session is logged in as
+@return Protocol.Connection of the client end, timing out after 5 seconds
+"""
+def open_session(chat_server, username):
+    server_side, client_side = socket.socketpair()
+    client_side.settimeout(5)
+    chat_server.sessions.add_user(OutboundQueue.QueuedConnection(server_side, OutboundQueue.OutboundQueue()), username)
+    return Protocol.Connection(client_side)
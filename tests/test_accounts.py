@@ -0,0 +1,29 @@
+import socket
+import pytest
+import Protocol
+import OutboundQueue
+from conftest import add_users
+
+
+def test_removed_user_is_disconnected(chat_server, monkeypatch):
+    add_users(chat_server, "alice", "bob")
+    sessions = {}
+    for username in ("alice", "bob"):
+        server_side, client_side = socket.socketpair()
+        client_side.settimeout(5)
+        session = OutboundQueue.QueuedConnection(server_side, OutboundQueue.OutboundQueue())
+        chat_server.sessions.add_user(session, username)
+        sessions[username] = Protocol.Connection(client_side)
+    monkeypatch.setattr("builtins.input", lambda prompt="": "alice")
+    monkeypatch.setattr("time.sleep", lambda seconds: None)
+
+    chat_server.remove_user_account()
+
+    event = Protocol.decode_event(sessions["alice"].recv_message())
+    assert (event["type"], event["kind"]) == ("notification", "account_removed")
+    assert sessions["alice"].recv_message() is None # Closed after the notice
+    sessions["bob"].socket.settimeout(0.2)
+    with pytest.raises(socket.timeout): # Still connected, nothing sent
+        sessions["bob"].recv_message()
+    for connection in sessions.values():
+        connection.close()
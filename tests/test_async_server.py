@@ -0,0 +1,60 @@
+import socket
+import threading
+import pytest
+import Protocol
+import server
+
+
+"""
+RecordingServer notes the thread each command of the asyncio server ran on
+"""
+class RecordingServer(server.AsyncServer):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.threads = {}
+        self.handled = threading.Semaphore(0)
+
+    def run_command(self, client_socket, message, client_name):
+        try:
+            return super().run_command(client_socket, message, client_name)
+        finally:
+            self.threads[message.split(" ", 1)[0]] = threading.current_thread()
+            self.handled.release()
+
+
+@pytest.fixture
+def async_server(tmp_path):
+    instance = RecordingServer('127.0.0.1', 0, db_path=str(tmp_path / "chat.db"), auth_workers=1, compact_interval=0,
+                               headless=True, log_path=str(tmp_path / "server.log"), log_level="ERROR")
+    loop_thread = threading.Thread(target=instance.listen, daemon=True)
+    loop_thread.start()
+    yield instance
+    try:
+        instance.shutdown_server()
+    except SystemExit:
+        pass
+    loop_thread.join(5)
+
+
+"""
+run_commands Sends commands on one connection and waits until the server handled each
+"""
+def run_commands(async_server, *messages):
+    with socket.create_connection(async_server.socket.getsockname(), timeout=5) as client:
+        client.sendall(Protocol.encode_frames(messages))
+        for _ in messages:
+            assert async_server.handled.acquire(timeout=5)
+    return async_server.threads
+
+
+@pytest.mark.parametrize("message", ["/get_messages 0 20", "/history lobby 0 20", "/search all 20 hello"])
+def test_database_commands_run_off_the_event_loop(async_server, message):
+    threads = run_commands(async_server, "/view_chatroom_users lobby", message)
+    loop_thread = threads["/view_chatroom_users"]
+    assert threads[message.split(" ", 1)[0]] is not loop_thread
+
+
+def test_only_listed_commands_run_on_the_event_loop(async_server):
+    assert async_server.runs_on_loop("/view_chatroom_users lobby")
+    for message in ("/get_messages", "/history lobby", "/search all 20 hello", "/check_messages", "/some_future_command"):
+        assert not async_server.runs_on_loop(message)
@@ -0,0 +1,104 @@
+import time
+import socket
+import threading
+import ClusterNode
+import OutboundQueue
+import Protocol
+import server
+from conftest import PASSWORD, add_users
+
+
+def start_nodes(handler):
+    config = [{"id": node_id, "host": "127.0.0.1", "port": 0, "cluster_port": 0} for node_id in ("a", "b")]
+    nodes = {}
+    for node in config:
+        nodes[node["id"]] = ClusterNode.ClusterNode(node["id"], config, handler)
+        node["cluster_port"] = nodes[node["id"]].socket.getsockname()[1] # Shared with the other node's config
+    return nodes
+
+
+def test_slow_client_does_not_hold_up_other_clients():
+    received, release, done = [], threading.Event(), threading.Event()
+
+    def handler(origin, message):
+        if message["type"] == "node_down":
+            return
+        if message["message"] == "slow":
+            assert release.wait(5)
+        received.append((message["session"], message["message"]))
+        if len(received) == 4:
+            done.set()
+
+    nodes = start_nodes(handler)
+    try:
+        first = next(session for session in range(1, 100)
+                     if hash(("a", session)) % ClusterNode.DISPATCH_THREADS !=
+                     hash(("a", 1)) % ClusterNode.DISPATCH_THREADS) # Lands on another dispatch thread
+        for session, message in ((1, "slow"), (1, "after slow"), (first, "one"), (first, "two")):
+            nodes["a"].send("b", {"type": "command", "session": session, "username": "u", "message": message})
+        time.sleep(0.3)
+        assert received == [(first, "one"), (first, "two")]
+        release.set()
+        assert done.wait(5)
+        assert received[2:] == [(1, "slow"), (1, "after slow")] # One client's messages keep their order
+    finally:
+        release.set()
+        for node in nodes.values():
+            node.close()
+
+
+def test_concurrent_sends_share_one_link():
+    nodes = start_nodes(lambda origin, message: None)
+    try:
+        links = []
+        threads = [threading.Thread(target=lambda: links.append(nodes["a"].link("b"))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        assert len(links) == 8 and all(link is links[0] for link in links)
+        assert nodes["a"].links == {"b": links[0]}
+    finally:
+        for node in nodes.values():
+            node.close()
+
+
+def connect(chat_server, username):
+    server_side, client_side = socket.socketpair()
+    client_side.settimeout(5)
+    session = OutboundQueue.QueuedConnection(server_side, OutboundQueue.OutboundQueue())
+    chat_server.handle_command(session, f"/login {username} {PASSWORD}", None)
+    client = Protocol.Connection(client_side)
+    assert Protocol.decode_event(client.recv_message())["type"] == "ack"
+    assert Protocol.decode_event(client.recv_message())["kind"] == "unread" # Pushed on every login
+    return client
+
+
+def test_private_message_reaches_a_user_on_another_node(tmp_path):
+    config = [{"id": node_id, "host": "127.0.0.1", "port": 0, "cluster_port": 0} for node_id in ("a", "b")]
+    servers = {}
+    try:
+        for node in config:
+            servers[node["id"]] = server.Server('127.0.0.1', 0, db_path=str(tmp_path / "chat.db"), auth_workers=1,
+                                                compact_interval=0, headless=True, node_id=node["id"],
+                                                cluster_nodes=config, log_path=str(tmp_path / f"server-{node['id']}.log"),
+                                                log_level="ERROR")
+            node["cluster_port"] = servers[node["id"]].cluster.socket.getsockname()[1]
+        add_users(servers["a"], "alice", "bob")
+        alice = connect(servers["b"], "alice")
+        deadline = time.monotonic() + 5
+        while not servers["a"].remote_online.get("alice") and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert servers["a"].remote_online["alice"] == {"b"}
+
+        assert servers["a"].send_private_message("bob", "alice", "hello") == (True, "Message sent and delivered successfully!")
+        events = [Protocol.decode_event(alice.recv_message()) for _ in range(2)]
+        assert (events[0]["type"], events[0]["message"]) == ("private", "hello")
+        assert (events[1]["kind"], events[1]["unread"]) == ("unread", 1) # Counted on alice's node too
+        alice.close()
+    finally:
+        for instance in servers.values():
+            try:
+                instance.shutdown_server()
+            except SystemExit:
+                pass
@@ -0,0 +1,133 @@
+import threading
+import DatabasePool
+import MessageWriter
+
+
+def test_connections_are_opened_once_in_wal_mode(tmp_path):
+    db = DatabasePool.DatabasePool(str(tmp_path / "chat.db"), size=2)
+    try:
+        with db.connection() as conn:
+            assert conn.execute("PRAGMA journal_mode").fetchone() == ("wal",)
+            first = conn
+        with db.connection() as conn:
+            assert conn is first # The warm connection is handed out again
+    finally:
+        db.close()
+
+
+def test_release_rolls_back_an_open_transaction(tmp_path):
+    db = DatabasePool.DatabasePool(str(tmp_path / "chat.db"), size=1)
+    try:
+        with db.connection() as conn:
+            conn.execute("CREATE TABLE numbers (n INTEGER)")
+            conn.commit()
+            conn.execute("INSERT INTO numbers VALUES (1)") # Left uncommitted
+        with db.connection() as conn:
+            assert not conn.in_transaction
+            assert conn.execute("SELECT COUNT(*) FROM numbers").fetchone() == (0,)
+    finally:
+        db.close()
+
+
+def test_acquire_waits_for_a_released_connection(tmp_path):
+    db = DatabasePool.DatabasePool(str(tmp_path / "chat.db"), size=1)
+    taken = db.acquire()
+    acquired = threading.Event()
+    waiter = threading.Thread(target=lambda: db.release(db.acquire()) or acquired.set())
+    waiter.start()
+    assert not acquired.wait(0.2) # Every connection is in use
+    db.release(taken)
+    assert acquired.wait(5)
+    waiter.join(5)
+    db.close()
+
+
+def test_fetches_are_timed(tmp_path):
+    observed = []
+    db = DatabasePool.DatabasePool(str(tmp_path / "chat.db"), size=1,
+                                   observer=lambda sql, seconds: observed.append(sql))
+    try:
+        with db.connection() as conn:
+            conn.execute("CREATE TABLE numbers (n INTEGER)")
+            conn.executemany("INSERT INTO numbers VALUES (?)", [(n,) for n in range(10)])
+            del observed[:]
+            select = "SELECT n FROM numbers ORDER BY n"
+            cursor = conn.execute(select)
+            assert cursor.fetchone() == (0,)
+            assert cursor.fetchmany(3) == [(1,), (2,), (3,)]
+            assert len(cursor.fetchall()) == 6
+    finally:
+        db.close()
+    assert observed == [select] * 4 # The execute and each fetch
+
+
+def test_flush_barriers_are_not_counted_as_batches(tmp_path):
+    db = DatabasePool.DatabasePool(str(tmp_path / "chat.db"), size=1)
+    with db.connection() as conn:
+        conn.execute("CREATE TABLE numbers (n INTEGER)")
+        conn.commit()
+    writer = MessageWriter.MessageWriter(db)
+    writer.start()
+    try:
+        writer.flush(5)
+        writer.flush(5)
+        assert (writer.batches_committed, writer.rows_committed) == (0, 0)
+        future = writer.submit("INSERT INTO numbers VALUES (?)", (1,))
+        writer.flush(5)
+        assert future.result(5) is not None
+        assert (writer.batches_committed, writer.rows_committed) == (1, 1)
+    finally:
+        writer.stop()
+        db.close()
+
+
+def start_writer(tmp_path, **options):
+    db = DatabasePool.DatabasePool(str(tmp_path / "chat.db"), size=1)
+    with db.connection() as conn:
+        conn.execute("CREATE TABLE numbers (n INTEGER NOT NULL)")
+        conn.commit()
+    writer = MessageWriter.MessageWriter(db, **options)
+    writer.start()
+    return db, writer
+
+
+def test_rows_queued_together_share_one_commit(tmp_path):
+    db, writer = start_writer(tmp_path, max_delay=1.0)
+    try:
+        futures = [writer.submit("INSERT INTO numbers VALUES (?)", (n,)) for n in range(50)]
+        writer.flush(5)
+        assert len({future.result(5) for future in futures}) == 50
+        assert (writer.batches_committed, writer.rows_committed) == (1, 50)
+    finally:
+        writer.stop()
+    with db.connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM numbers").fetchone() == (50,)
+    db.close()
+
+
+def test_a_failing_row_does_not_discard_its_batch(tmp_path):
+    db, writer = start_writer(tmp_path, max_delay=1.0)
+    try:
+        good = writer.submit("INSERT INTO numbers VALUES (?)", (1,))
+        bad = writer.submit("INSERT INTO numbers VALUES (?)", (None,)) # Violates NOT NULL
+        last = writer.submit("INSERT INTO numbers VALUES (?)", (2,))
+        writer.flush(5)
+        assert good.result(5) and last.result(5)
+        assert bad.exception(5) is not None
+    finally:
+        writer.stop()
+    with db.connection() as conn:
+        assert conn.execute("SELECT n FROM numbers ORDER BY n").fetchall() == [(1,), (2,)]
+    db.close()
+
+
+def test_sync_writes_return_once_committed(tmp_path):
+    db, writer = start_writer(tmp_path, durability="sync")
+    try:
+        future = writer.write("INSERT INTO numbers VALUES (?)", (1,))
+        assert future.done()
+        with db.connection() as conn:
+            assert conn.execute("SELECT n FROM numbers").fetchall() == [(1,)]
+    finally:
+        writer.stop()
+        db.close()
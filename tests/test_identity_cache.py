@@ -0,0 +1,41 @@
+import threading
+import IdentityCache
+
+
+def test_ids_are_loaded_once_and_missing_names_are_not_cached():
+    ids = {"alice": 1}
+    loads = []
+    cache = IdentityCache.IdentityCache(lambda name: loads.append(name) or ids.get(name))
+    assert cache.get("alice") == 1 and cache.get("alice") == 1
+    assert cache.get("bob") is None
+    ids["bob"] = 2 # Registered later
+    assert cache.get("bob") == 2
+    assert loads == ["alice", "bob", "bob"]
+    assert (cache.hits, cache.misses) == (1, 3)
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = IdentityCache.IdentityCache(lambda name: len(name), capacity=2)
+    cache.get("a")
+    cache.get("bb")
+    cache.get("a") # Now the most recently used
+    cache.get("ccc")
+    assert list(cache.entries) == ["a", "ccc"]
+
+
+def test_invalidate_discards_a_load_already_running():
+    loading, release = threading.Event(), threading.Event()
+
+    def loader(name):
+        loading.set()
+        assert release.wait(5)
+        return 1 # The id the user had before it was removed
+
+    cache = IdentityCache.IdentityCache(loader)
+    lookup = threading.Thread(target=cache.get, args=("alice",))
+    lookup.start()
+    assert loading.wait(5)
+    cache.invalidate("alice")
+    release.set()
+    lookup.join(5)
+    assert "alice" not in cache.entries
@@ -0,0 +1,153 @@
+import pytest
+import DatabasePool
+import MessageArchive
+import Migrations
+
+OLD = "2020-01-01 00:00:00"
+CUTOFF = "2021-01-01 00:00:00"
+
+
+@pytest.fixture
+def archive(tmp_path):
+    db = DatabasePool.DatabasePool(str(tmp_path / "chat.db"), size=1)
+    with db.connection() as conn:
+        Migrations.migrate(conn)
+        conn.executemany("INSERT INTO users (user_id, username, password_hash, salt) VALUES (?, ?, '', '')",
+                         [(1, "alice"), (2, "bob"), (3, "carol")])
+        conn.executemany("INSERT INTO chatrooms (chatroom_id, name, admin_id) VALUES (?, ?, 1)",
+                         [(1, "lobby"), (2, "quiet")])
+        conn.commit()
+    yield MessageArchive.MessageArchive(db, str(tmp_path / "chat.db.archive"), segment_size=3)
+    db.close()
+
+
+def add_private(archive, sender_id, recipient_id, read, timestamp=OLD):
+    with archive.db.connection() as conn:
+        message_id = conn.execute("INSERT INTO private_messages (sender_id, recipient_id, message, timestamp, read) "
+                                  "VALUES (?, ?, 'hi', ?, ?)", (sender_id, recipient_id, timestamp, read)).lastrowid
+        conn.commit()
+    return message_id
+
+
+def add_room(archive, chatroom_id, user_id, count):
+    with archive.db.connection() as conn:
+        conn.executemany("INSERT INTO messages (chatroom_id, user_id, message, timestamp) VALUES (?, ?, 'hi', ?)",
+                         [(chatroom_id, user_id, OLD)] * count)
+        conn.commit()
+
+
+def live_private(archive):
+    with archive.db.connection() as conn:
+        return [row[0] for row in conn.execute("SELECT message_id FROM private_messages ORDER BY message_id")]
+
+
+def test_private_compaction_continues_from_its_mark(archive):
+    unread = add_private(archive, 1, 2, read=0)
+    read = [add_private(archive, 1, 2, read=1) for _ in range(4)]
+    recent = add_private(archive, 2, 1, read=1, timestamp="2022-01-01 00:00:00")
+
+    assert archive.compact_private(CUTOFF) == 4
+    assert live_private(archive) == [unread, recent]
+    assert archive.private_mark == read[-1] # The recent message stops the scan and is not passed
+
+    scanned = []
+    archive_private = archive.archive_private
+    archive.archive_private = lambda cutoff, after_id, upto_id=None: \
+        scanned.append((after_id, upto_id)) or archive_private(cutoff, after_id, upto_id)
+    assert archive.compact_private(CUTOFF) == 0
+    assert scanned == [(0, read[-1]), (read[-1], None)]
+
+    with archive.db.connection() as conn:
+        conn.execute("UPDATE private_messages SET read = 1 WHERE message_id = ?", (unread,))
+        conn.commit()
+    assert archive.compact_private(CUTOFF) == 1 # Read below the mark since the last compaction
+    assert live_private(archive) == [recent]
+    assert [record["message_id"] for record in archive.private_messages(2, 0, 10)] == list(reversed([unread] + read))
+
+
+def test_purge_reads_only_the_segments_of_the_user(archive):
+    add_room(archive, 1, 1, 3) # alice's lobby segment
+    add_room(archive, 2, 2, 3) # bob's quiet segment
+    add_room(archive, 1, 2, 2) # A lobby segment shared by bob and carol
+    add_room(archive, 1, 3, 1)
+    archive.compact(room_days=1)
+    assert archive.stats() == (3, 9)
+
+    read = []
+    read_segment = archive.read_segment
+    archive.read_segment = lambda path: read.append(path) or read_segment(path)
+    archive.purge_user(2)
+    assert len(read) == 2 and not any("room-1-1-3" in path for path in read)
+    assert archive.stats() == (2, 4) # The quiet segment is gone and the shared one rewritten
+    assert [record["sender_id"] for record in archive.room_messages(1, 0, 10)] == [1, 1, 1, 3]
+    with archive.db.connection() as conn:
+        assert conn.execute("SELECT user_id FROM archive_senders ORDER BY user_id").fetchall() == [(1,), (3,)]
+
+
+def test_purge_indexes_segments_archived_before_the_sender_index(archive):
+    add_room(archive, 1, 1, 3)
+    add_room(archive, 1, 2, 3)
+    archive.compact(room_days=1)
+    with archive.db.connection() as conn: # As left by schema version 6
+        conn.execute("DELETE FROM archive_senders")
+        conn.execute("UPDATE archive_segments SET senders_indexed = 0")
+        conn.commit()
+
+    archive.purge_user(2)
+    assert [record["sender_id"] for record in archive.room_messages(1, 0, 10)] == [1, 1, 1]
+    with archive.db.connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM archive_segments WHERE senders_indexed = 0").fetchone() == (0,)
+        assert conn.execute("SELECT user_id FROM archive_senders").fetchall() == [(1,)]
+
+
+def searchable(archive):
+    if not archive.search_index:
+        pytest.skip("SQLite was built without FTS5")
+    return archive
+
+
+def test_search_uses_the_index_across_every_segment(archive):
+    searchable(archive)
+    with archive.db.connection() as conn:
+        conn.execute("INSERT INTO messages (chatroom_id, user_id, message, timestamp) VALUES (1, 3, 'Café opens', ?)", (OLD,))
+        conn.commit()
+    add_room(archive, 1, 1, 900) # 300 more segments, past what a scan of the newest ones would reach
+    add_room(archive, 2, 2, 2)
+    with archive.db.connection() as conn:
+        conn.execute("INSERT INTO messages (chatroom_id, user_id, message, timestamp) VALUES (2, 2, 'cafe closed', ?)", (OLD,))
+        conn.commit()
+    private = add_private(archive, 2, 1, read=1)
+    archive.compact(room_days=1, private_days=1)
+
+    read = []
+    read_segment = archive.read_segment
+    archive.read_segment = lambda path: read.append(path) or read_segment(path)
+    assert [record["message"] for record in archive.search('"cafe"', 1, chatroom_id=1)] == ["Café opens"]
+    assert len(read) == 1 # Only the segment holding the match
+    assert {record["message"] for record in archive.search('"caf"*', 1)} == {"Café opens", "cafe closed"}
+    assert [record["sender"] for record in archive.search('"cafe"', 1, sender_id=2)] == ["bob"]
+    assert archive.search('"user2"', 1) == [] # Sender tokens are not searched as text
+    assert [(record["kind"], record["message_id"]) for record in archive.search('"hi"', 1, rooms=False)] == \
+        [("private", private)]
+    assert archive.search('"hi"', 3, rooms=False) == [] # Not carol's conversation
+
+    archive.purge_user(3) # Rewrites the first lobby segment, shifting the positions after it
+    assert archive.search('"cafe"', 1, chatroom_id=1) == []
+    found = archive.search('"hi"', 1, chatroom_id=1, private=False, limit=1000)
+    assert sorted(record["message_id"] for record in found) == \
+        [record["message_id"] for record in archive.room_messages(1, 0, 1000)]
+
+
+def test_search_indexes_segments_archived_before_the_text_index(archive):
+    searchable(archive)
+    add_room(archive, 1, 1, 3)
+    archive.search_index = False # As written by schema version 7
+    archive.compact(room_days=1)
+    archive.search_index, archive.text_backfilled = True, False
+    with archive.db.connection() as conn:
+        assert conn.execute("SELECT text_indexed FROM archive_segments").fetchall() == [(0,)]
+
+    assert len(archive.search('"hi"', 1)) == 3
+    with archive.db.connection() as conn:
+        assert conn.execute("SELECT text_indexed FROM archive_segments").fetchall() == [(1,)]
+    assert len(archive.search('"hi"', 1)) == 3 # Indexed once
@@ -0,0 +1,63 @@
+import sqlite3
+import pytest
+import Migrations
+
+
+@pytest.fixture
+def conn(tmp_path):
+    connection = sqlite3.connect(str(tmp_path / "chat.db"))
+    yield connection
+    connection.close()
+
+
+def names(conn, kind):
+    return {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = ?", (kind,))}
+
+
+def test_fresh_database_reaches_the_latest_version(conn):
+    assert Migrations.migrate(conn) == Migrations.LATEST_VERSION
+    assert Migrations.schema_version(conn) == Migrations.LATEST_VERSION
+    assert {"users", "chatrooms", "chatroom_members", "messages", "private_messages",
+            "archive_segments"} <= names(conn, "table")
+    indexes = names(conn, "index")
+    assert {"idx_private_recipient_id", "idx_messages_chatroom_id"} <= indexes
+    assert not {"idx_private_recipient_time", "idx_messages_chatroom_time"} & indexes # Dropped by versions 3 and 4
+
+
+def test_unversioned_database_keeps_its_data(conn):
+    # A chat_app.db from before versioning: the original tables, user_version 0
+    conn.execute("CREATE TABLE users (user_id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT UNIQUE NOT NULL, "
+                 "password_hash TEXT NOT NULL, salt TEXT NOT NULL)")
+    conn.execute("CREATE TABLE chatrooms (chatroom_id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT UNIQUE NOT NULL, "
+                 "admin_id INTEGER)")
+    conn.execute("INSERT INTO users (username, password_hash, salt) VALUES ('alice', 'hash', 'salt')")
+    conn.execute("INSERT INTO chatrooms (name, admin_id) VALUES ('lobby', 1)")
+    conn.commit()
+
+    Migrations.migrate(conn)
+    assert conn.execute("SELECT username FROM users").fetchall() == [("alice",)]
+    assert conn.execute("SELECT name, retention_days FROM chatrooms").fetchall() == [("lobby", None)]
+
+
+def test_upgrade_resumes_from_the_recorded_version(conn):
+    for target, description, statements in Migrations.MIGRATIONS[:3]: # Stop at version 3
+        for statement in statements:
+            conn.execute(statement)
+    conn.execute("PRAGMA user_version = 3")
+    conn.commit()
+
+    assert Migrations.migrate(conn) == Migrations.LATEST_VERSION
+    assert "idx_messages_chatroom_id" in names(conn, "index")
+
+
+def test_migrating_twice_changes_nothing(conn):
+    Migrations.migrate(conn)
+    schema = conn.execute("SELECT type, name, sql FROM sqlite_master ORDER BY name").fetchall()
+    assert Migrations.migrate(conn) == Migrations.LATEST_VERSION
+    assert conn.execute("SELECT type, name, sql FROM sqlite_master ORDER BY name").fetchall() == schema
+
+
+def test_newer_database_is_refused(conn):
+    conn.execute(f"PRAGMA user_version = {Migrations.LATEST_VERSION + 1}")
+    with pytest.raises(RuntimeError):
+        Migrations.migrate(conn)
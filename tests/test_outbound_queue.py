@@ -0,0 +1,117 @@
+import socket
+import pytest
+import OutboundQueue
+
+
+def frame(size, tag=b"x"):
+    return tag * size
+
+
+def test_frames_are_taken_in_order():
+    outbound = OutboundQueue.OutboundQueue(max_bytes=100)
+    for tag in (b"a", b"b", b"c"):
+        assert outbound.put(frame(10, tag))
+    assert outbound.take(block=False) == [frame(10, b"a"), frame(10, b"b"), frame(10, b"c")]
+    assert outbound.take(block=False) == []
+
+
+def test_drop_oldest_keeps_the_newest_frames():
+    stats = OutboundQueue.OutboundStats()
+    outbound = OutboundQueue.OutboundQueue(max_bytes=30, policy="drop_oldest", stats=stats)
+    for tag in (b"a", b"b", b"c", b"d"):
+        assert outbound.put(frame(10, tag), droppable=True)
+    assert outbound.take(block=False) == [frame(10, b"b"), frame(10, b"c"), frame(10, b"d")]
+    assert (stats.dropped_frames, stats.dropped_bytes) == (1, 10)
+
+
+def test_drop_oldest_never_drops_responses():
+    outbound = OutboundQueue.OutboundQueue(max_bytes=30, policy="drop_oldest")
+    assert outbound.put(frame(10, b"A")) # An ack the client waits for
+    assert outbound.put(frame(10, b"b"), droppable=True)
+    assert outbound.put(frame(10, b"c"), droppable=True)
+    assert outbound.put(frame(10, b"E")) # An error the client waits for
+    assert outbound.take(block=False) == [frame(10, b"A"), frame(10, b"c"), frame(10, b"E")]
+    assert outbound.dropped_frames == 1
+
+
+def test_drop_oldest_drops_new_chat_when_only_responses_are_queued():
+    outbound = OutboundQueue.OutboundQueue(max_bytes=20, policy="drop_oldest")
+    assert outbound.put(frame(10, b"A"))
+    assert outbound.put(frame(10, b"B"))
+    assert outbound.put(frame(10, b"c"), droppable=True)
+    assert outbound.take(block=False) == [frame(10, b"A"), frame(10, b"B")]
+    assert (outbound.dropped_frames, outbound.dropped_bytes) == (1, 10)
+
+
+def test_drop_oldest_disconnects_when_a_response_cannot_fit():
+    stats = OutboundQueue.OutboundStats()
+    outbound = OutboundQueue.OutboundQueue(max_bytes=20, policy="drop_oldest", stats=stats)
+    assert outbound.put(frame(10, b"A"))
+    assert outbound.put(frame(10, b"B"))
+    assert not outbound.put(frame(10, b"C"))
+    assert outbound.overflowed and stats.disconnects == 1
+
+
+def test_oversized_response_to_an_idle_consumer_is_queued():
+    outbound = OutboundQueue.OutboundQueue(max_bytes=20, policy="drop_oldest")
+    assert outbound.put(frame(10, b"c"), droppable=True)
+    assert outbound.put(frame(50, b"A"))
+    assert outbound.take(block=False) == [frame(50, b"A")]
+
+
+def test_disconnect_closes_the_queue():
+    stats = OutboundQueue.OutboundStats()
+    outbound = OutboundQueue.OutboundQueue(max_bytes=30, policy="disconnect", stats=stats)
+    for tag in (b"a", b"b", b"c"):
+        assert outbound.put(frame(10, tag), droppable=True)
+    assert not outbound.put(frame(10, b"d"), droppable=True)
+    assert outbound.overflowed and outbound.closed and stats.disconnects == 1
+    assert outbound.take(block=False) is None # The backlog of a disconnected consumer is discarded
+
+
+def test_coalesce_replaces_the_queued_frame_in_place():
+    stats = OutboundQueue.OutboundStats()
+    outbound = OutboundQueue.OutboundQueue(max_bytes=100, policy="coalesce", stats=stats)
+    outbound.put(frame(5, b"1"), coalesce_key="unread")
+    outbound.put(frame(5, b"m"))
+    outbound.put(frame(5, b"2"), coalesce_key="unread")
+    assert outbound.take(block=False) == [frame(5, b"2"), frame(5, b"m")]
+    assert stats.coalesced_frames == 1
+
+
+def test_coalesce_replacement_respects_the_limit():
+    outbound = OutboundQueue.OutboundQueue(max_bytes=30, policy="coalesce")
+    outbound.put(frame(5, b"1"), coalesce_key="unread")
+    outbound.put(frame(10, b"c"), droppable=True)
+    outbound.put(frame(10, b"d"), droppable=True)
+    assert outbound.put(frame(15, b"2"), coalesce_key="unread") # Grows the queue to 35 bytes
+    assert outbound.take(block=False) == [frame(15, b"2"), frame(10, b"d")]
+    assert outbound.dropped_frames == 1
+
+
+def test_close_still_delivers_queued_frames():
+    outbound = OutboundQueue.OutboundQueue()
+    outbound.put(frame(3))
+    outbound.close()
+    assert not outbound.put(frame(3))
+    assert outbound.take() == [frame(3)]
+    assert outbound.take() is None
+
+
+def test_connection_of_a_client_that_already_hung_up():
+    server_socket = socket.socket()
+    server_socket.bind(("127.0.0.1", 0))
+    server_socket.listen()
+    client = socket.create_connection(server_socket.getsockname())
+    accepted, _ = server_socket.accept()
+    client.close()
+    server_socket.close()
+    accepted.shutdown(socket.SHUT_RDWR) # getpeername now fails with ENOTCONN
+    connection = OutboundQueue.QueuedConnection(accepted, OutboundQueue.OutboundQueue())
+    assert connection.getpeername() == ("disconnected", 0)
+    connection.abort()
+
+
+def test_unknown_policy_is_rejected():
+    with pytest.raises(ValueError):
+        OutboundQueue.OutboundQueue(policy="ignore")
@@ -0,0 +1,94 @@
+from conftest import add_users
+
+
+def add_private_messages(chat_server, sender, recipient, count):
+    sender_id, recipient_id = chat_server.user_ids.get(sender), chat_server.user_ids.get(recipient)
+    with chat_server.db.connection() as conn:
+        conn.executemany("INSERT INTO private_messages (sender_id, recipient_id, message) VALUES (?, ?, ?)",
+                         [(sender_id, recipient_id, f"message {index}") for index in range(count)])
+        conn.commit()
+
+
+def add_room_messages(chat_server, room, sender, count):
+    chat_server.create_chatroom(room, sender)
+    chatroom_id, user_id = chat_server.chatroom_ids.get(room), chat_server.user_ids.get(sender)
+    with chat_server.db.connection() as conn:
+        conn.executemany("INSERT INTO messages (chatroom_id, user_id, message) VALUES (?, ?, ?)",
+                         [(chatroom_id, user_id, f"message {index}") for index in range(count)])
+        conn.commit()
+
+
+def test_inbox_pages_cover_every_message_once(chat_server):
+    add_users(chat_server, "alice", "bob")
+    add_private_messages(chat_server, "bob", "alice", 45)
+
+    seen, cursor, pages = [], 0, 0
+    while True:
+        page = chat_server.get_private_messages("alice", cursor, 20)
+        seen += [message["message"] for message in page["messages"]]
+        pages += 1
+        if not page["has_more"]:
+            assert page["next_cursor"] is None
+            break
+        cursor = page["next_cursor"]
+    assert pages == 3
+    assert seen == [f"message {index}" for index in reversed(range(45))] # Newest first, no gaps or repeats
+
+
+def test_inbox_page_exactly_at_the_end(chat_server):
+    add_users(chat_server, "alice", "bob")
+    add_private_messages(chat_server, "bob", "alice", 40)
+
+    first = chat_server.get_private_messages("alice", 0, 20)
+    second = chat_server.get_private_messages("alice", first["next_cursor"], 20)
+    assert len(second["messages"]) == 20
+    assert not second["has_more"] and second["next_cursor"] is None
+    oldest = second["messages"][-1]["message_id"]
+    assert chat_server.get_private_messages("alice", oldest, 20)["messages"] == []
+
+
+def test_inbox_merges_archived_messages_newer_than_a_live_unread_one(chat_server):
+    add_users(chat_server, "alice", "bob")
+    bob, alice = chat_server.user_ids.get("bob"), chat_server.user_ids.get("alice")
+    with chat_server.db.connection() as conn:
+        conn.executemany("INSERT INTO private_messages (sender_id, recipient_id, message, timestamp, read) "
+                         "VALUES (?, ?, ?, ?, ?)",
+                         [(bob, alice, "unread", "2020-01-01 00:00:00", 0)] +
+                         [(bob, alice, f"read {index}", "2020-01-01 00:00:00", 1) for index in range(30)] +
+                         [(bob, alice, f"new {index}", "2022-01-01 00:00:00", 0) for index in range(5)])
+        conn.commit()
+    assert chat_server.archive.compact_private("2021-01-01 00:00:00") == 30 # The unread one stays live
+
+    seen, cursor = [], 0
+    while True:
+        page = chat_server.get_private_messages("alice", cursor, 3)
+        seen += [message["message"] for message in page["messages"]]
+        if not page["has_more"]:
+            break
+        cursor = page["next_cursor"]
+    assert seen == ([f"new {index}" for index in reversed(range(5))] +
+                    [f"read {index}" for index in reversed(range(30))] + ["unread"])
+
+
+def test_inbox_limit_is_clamped(chat_server):
+    add_users(chat_server, "alice", "bob")
+    add_private_messages(chat_server, "bob", "alice", 150)
+
+    assert len(chat_server.get_private_messages("alice", 0, 10 ** 6)["messages"]) == chat_server.INBOX_MAX_PAGE_SIZE
+    assert len(chat_server.get_private_messages("alice", 0, 0)["messages"]) == chat_server.INBOX_PAGE_SIZE
+    assert chat_server.get_private_messages("nobody", 0, 20)["messages"] == []
+
+
+def test_room_history_pages_walk_backwards(chat_server):
+    add_users(chat_server, "alice")
+    add_room_messages(chat_server, "lobby", "alice", 25)
+
+    first = chat_server.get_room_history("lobby", 0, 10)
+    assert [message["message"] for message in first["messages"]] == [f"message {index}" for index in range(15, 25)]
+    assert first["has_more"] and first["next_cursor"] == first["messages"][0]["message_id"]
+
+    second = chat_server.get_room_history("lobby", first["next_cursor"], 10)
+    third = chat_server.get_room_history("lobby", second["next_cursor"], 10)
+    assert [message["message"] for message in third["messages"]] == [f"message {index}" for index in range(5)]
+    assert not third["has_more"] and third["next_cursor"] is None
+    assert chat_server.get_room_history("missing", 0, 10) is None
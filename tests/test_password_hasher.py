@@ -0,0 +1,27 @@
+import bcrypt
+import pytest
+import PasswordHasher
+
+
+@pytest.fixture
+def hasher():
+    instance = PasswordHasher.PasswordHasher(workers=1, max_in_flight=1)
+    yield instance
+    instance.shutdown()
+
+
+def test_hash_matches_bcrypt(hasher):
+    salt = bcrypt.gensalt(4)
+    assert hasher.hashpw(b"secret", salt) == bcrypt.hashpw(b"secret", salt)
+    assert (hasher.completed, hasher.in_flight) == (1, 0)
+
+
+def test_hashes_beyond_the_limit_are_rejected(hasher):
+    hasher.slots.acquire() # The only slot is taken by a running hash
+    try:
+        with pytest.raises(PasswordHasher.ServerBusy):
+            hasher.hashpw(b"secret", bcrypt.gensalt(4))
+    finally:
+        hasher.slots.release()
+    assert (hasher.rejected, hasher.completed) == (1, 0)
+    hasher.hashpw(b"secret", bcrypt.gensalt(4)) # Admitted again once the slot is free
@@ -0,0 +1,57 @@
+import Protocol
+from conftest import add_users, open_session
+
+
+def next_event(connection):
+    return Protocol.decode_event(connection.recv_message())
+
+
+def test_private_message_reaches_every_session_of_the_recipient(chat_server):
+    add_users(chat_server, "alice", "bob")
+    phone, laptop = open_session(chat_server, "alice"), open_session(chat_server, "alice")
+
+    assert chat_server.send_private_message("bob", "alice", "hello") == (True, "Message sent and delivered successfully!")
+    for connection in (phone, laptop):
+        event = next_event(connection)
+        assert (event["type"], event["sender"], event["message"]) == ("private", "bob", "hello")
+        connection.close()
+
+
+def test_private_message_to_an_offline_user_is_stored(chat_server):
+    add_users(chat_server, "alice", "bob")
+    assert chat_server.send_private_message("bob", "alice", "later") == \
+        (True, "Message saved and will be delivered when recipient comes online.")
+    chat_server.message_writer.flush()
+    assert [message["message"] for message in chat_server.get_private_messages("alice")["messages"]] == ["later"]
+
+
+def test_unread_count_is_pushed_as_it_changes(chat_server):
+    add_users(chat_server, "alice", "bob")
+    alice = open_session(chat_server, "alice")
+    chat_server.unread.load("alice") # As on login
+
+    chat_server.send_private_message("bob", "alice", "one")
+    chat_server.send_private_message("bob", "alice", "two")
+    events = [next_event(alice) for _ in range(4)]
+    assert [event["unread"] for event in events if event["type"] == "notification"] == [1, 2]
+
+    chat_server.message_writer.flush()
+    newest = chat_server.get_private_messages("alice")["messages"][0]["message_id"]
+    assert chat_server.mark_messages_as_read("alice", [newest]) == (1, 1)
+    assert next_event(alice)["unread"] == 1
+    alice.close()
+
+
+def test_unread_count_is_taken_back_when_the_insert_fails(chat_server):
+    add_users(chat_server, "alice", "bob")
+    alice = open_session(chat_server, "alice")
+    chat_server.unread.load("alice")
+    with chat_server.db.connection() as conn:
+        conn.execute("CREATE TRIGGER refuse BEFORE INSERT ON private_messages BEGIN SELECT RAISE(ABORT, 'disk full'); END")
+        conn.commit()
+
+    chat_server.send_private_message("bob", "alice", "lost")
+    events = [next_event(alice) for _ in range(3)] # The message, its count, then the correction
+    assert [event["unread"] for event in events if event["type"] == "notification"] == [1, 0]
+    assert chat_server.unread.get("alice") == 0
+    alice.close()
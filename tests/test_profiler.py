@@ -0,0 +1,20 @@
+import Profiler
+
+
+def test_profile_is_summarized_and_saved(tmp_path):
+    profiler = Profiler.Profiler(interval=0.001)
+    assert profiler.start(0.05, str(tmp_path))
+    summary = profiler.wait()
+    assert summary["samples"] > 0 and summary["path"].startswith(str(tmp_path))
+    assert profiler.last_error is None
+
+
+def test_unwritable_directory_is_reported(tmp_path):
+    blocker = tmp_path / "profiles"
+    blocker.write_text("a file where the directory should be")
+    profiler = Profiler.Profiler(interval=0.001)
+    profiler.start(0.02, str(tmp_path))
+    profiler.wait()
+    assert profiler.start(0.02, str(blocker))
+    assert profiler.wait() is None # The earlier profile is not shown as this one's result
+    assert "Could not write" in profiler.last_error
@@ -0,0 +1,70 @@
+import socket
+import pytest
+import Protocol
+import OutboundQueue
+from conftest import add_users
+
+
+def test_single_frame_split_across_reads():
+    reader = Protocol.FrameReader()
+    frame = Protocol.encode_frame("/login alice secret")
+    assert reader.feed(frame[:2]) == [] # Inside the header
+    assert reader.feed(frame[2:7]) == [] # Inside the payload
+    assert reader.feed(frame[7:]) == [b"/login alice secret"]
+    assert reader.buffer == bytearray()
+
+
+def test_pipelined_frames_in_one_read():
+    reader = Protocol.FrameReader()
+    data = Protocol.encode_frames(["one", "two", "three"])
+    assert reader.feed(data) == [b"one", b"two", b"three"]
+
+
+def test_pipelined_frames_ending_in_a_partial_frame():
+    reader = Protocol.FrameReader()
+    data = Protocol.encode_frames(["first", "second"])
+    cut = len(Protocol.encode_frame("first")) + 3
+    assert reader.feed(data[:cut]) == [b"first"]
+    assert reader.feed(data[cut:]) == [b"second"]
+
+
+def test_byte_by_byte_delivery():
+    reader = Protocol.FrameReader()
+    data = Protocol.encode_frames(["héllo", "", "wörld"])
+    frames = []
+    for index in range(len(data)):
+        frames += reader.feed(data[index:index + 1])
+    assert frames == ["héllo".encode('utf-8'), b"", "wörld".encode('utf-8')]
+
+
+def test_oversized_frame_is_rejected():
+    reader = Protocol.FrameReader()
+    with pytest.raises(Protocol.ProtocolError):
+        reader.feed(Protocol.HEADER.pack(Protocol.MAX_FRAME_SIZE + 1))
+    with pytest.raises(Protocol.ProtocolError):
+        Protocol.encode_frame(b"x" * (Protocol.MAX_FRAME_SIZE + 1))
+
+
+
+def test_event_round_trip():
+    frame = Protocol.encode_event("ack", command="/login", message="ok", unread=3)
+    (payload,) = Protocol.FrameReader().feed(frame)
+    assert Protocol.decode_event(payload) == {"type": "ack", "command": "/login", "message": "ok", "unread": 3}
+    with pytest.raises(Protocol.ProtocolError):
+        Protocol.decode_event(b'{"type": "unknown"}')
+
+
+def test_server_answers_with_typed_events(chat_server):
+    server_side, client_side = socket.socketpair()
+    client_side.settimeout(5)
+    session, client = OutboundQueue.QueuedConnection(server_side, OutboundQueue.OutboundQueue()), \
+        Protocol.Connection(client_side)
+    add_users(chat_server, "alice")
+
+    chat_server.handle_command(session, "/create_chatroom lobby", None)
+    assert Protocol.decode_event(client.recv_message()) == \
+        {"type": "error", "command": "/create_chatroom", "message": "Please login or register first."}
+    chat_server.handle_command(session, "/create_chatroom lobby", "alice")
+    event = Protocol.decode_event(client.recv_message())
+    assert (event["type"], event["command"], event["room"]) == ("ack", "/create_chatroom", "lobby")
+    client.close()
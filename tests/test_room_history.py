@@ -0,0 +1,107 @@
+import threading
+import Protocol
+import RoomHistory
+from conftest import add_users, open_session
+
+
+def other_stripe(history, room):
+    return next(name for name in (f"room-{index}" for index in range(1000))
+                if history.stripe(name) is not history.stripe(room))
+
+
+def test_warm_up_does_not_block_other_rooms():
+    loading, release = threading.Event(), threading.Event()
+
+    def loader(room, count):
+        if room == "slow":
+            loading.set()
+            release.wait(5)
+        return [{"message_id": 1, "message": f"{room} history"}]
+
+    history = RoomHistory.RoomHistory(loader)
+    fast = other_stripe(history, "slow")
+    warming = threading.Thread(target=history.recent, args=("slow",))
+    warming.start()
+    try:
+        assert loading.wait(5)
+        assert history.recent(fast) == [{"message_id": 1, "message": f"{fast} history"}]
+        assert history.record(fast, {"message_id": None, "message": "new"}, lambda: "queued") == "queued"
+        assert [entry["message"] for entry in history.recent(fast)] == [f"{fast} history", "new"]
+    finally:
+        release.set()
+        warming.join(5)
+    assert history.warmups == 2
+
+
+def test_message_recorded_during_warm_up_waits_for_it():
+    committed = []
+    loading, release = threading.Event(), threading.Event()
+
+    def loader(room, count):
+        loading.set()
+        release.wait(5)
+        return list(committed)
+
+    history = RoomHistory.RoomHistory(loader)
+    warming = threading.Thread(target=history.recent, args=("lobby",))
+    warming.start()
+    assert loading.wait(5)
+    recording = threading.Thread(target=history.record,
+                                 args=("lobby", {"message": "late"}, lambda: committed.append({"message": "late"})))
+    recording.start()
+    recording.join(0.2)
+    assert recording.is_alive() and not committed # Persisted only after the warm-up query
+    release.set()
+    warming.join(5)
+    recording.join(5)
+    assert history.recent("lobby") == [{"message": "late"}]
+
+
+def test_clear_during_warm_up_discards_the_loaded_messages():
+    loading, release = threading.Event(), threading.Event()
+
+    def loader(room, count):
+        loading.set()
+        release.wait(5)
+        return [{"message": "stale"}]
+
+    history = RoomHistory.RoomHistory(loader)
+    warming = threading.Thread(target=history.recent, args=("lobby",))
+    warming.start()
+    assert loading.wait(5)
+    history.clear()
+    release.set()
+    warming.join(5)
+    assert "lobby" not in history.rooms
+
+
+def join(chat_server, username, room):
+    client = open_session(chat_server, username)
+    (session,) = chat_server.sessions.user_sessions(username)
+    chat_server.handle_command(session, f"/join_chatroom {room}", username)
+    event = Protocol.decode_event(client.recv_message())
+    client.close()
+    return event
+
+
+def test_join_cursor_skips_replayed_messages_that_were_not_stored(chat_server):
+    add_users(chat_server, "alice", "bob", "carol")
+    chat_server.create_chatroom("lobby", "alice")
+    assert join(chat_server, "alice", "lobby")["history_cursor"] == 0 # Nothing to replay; warms the buffer
+    with chat_server.db.connection() as conn:
+        conn.execute("CREATE TRIGGER refuse BEFORE INSERT ON messages BEGIN SELECT RAISE(ABORT, 'disk full'); END")
+        conn.commit()
+    chat_server.broadcast_chatroom_message("lobby", "alice", "lost")
+
+    event = join(chat_server, "bob", "lobby")
+    assert [entry["message"] for entry in event["history"]] == ["lost"]
+    assert event["history_cursor"] == 1 # Below every stored message, not None
+
+    with chat_server.db.connection() as conn:
+        conn.execute("DROP TRIGGER refuse")
+        conn.commit()
+    chat_server.broadcast_chatroom_message("lobby", "alice", "stored")
+    chat_server.message_writer.flush()
+    event = join(chat_server, "carol", "lobby")
+    assert [entry["message"] for entry in event["history"]] == ["lost", "stored"]
+    assert event["history_cursor"] == event["history"][1]["message_id"]
@@ -0,0 +1,51 @@
+import pytest
+from conftest import add_users
+
+
+@pytest.fixture
+def searchable(chat_server):
+    if not chat_server.search_enabled:
+        pytest.skip("SQLite was built without FTS5")
+    add_users(chat_server, "alice", "bob", "carol")
+    chat_server.create_chatroom("lobby", "alice")
+    ids = {name: chat_server.user_ids.get(name) for name in ("alice", "bob", "carol")}
+    with chat_server.db.connection() as conn:
+        conn.executemany("INSERT INTO messages (chatroom_id, user_id, message) VALUES (?, ?, ?)",
+                         [(chat_server.chatroom_ids.get("lobby"), ids["alice"], text) for text in
+                          ("deploy the release tonight", "lunch?", "release notes: deploy, deploy, deploy")])
+        conn.executemany("INSERT INTO private_messages (sender_id, recipient_id, message) VALUES (?, ?, ?)",
+                         [(ids["bob"], ids["alice"], "the release is done"),
+                          (ids["bob"], ids["carol"], "secret release plans")])
+        conn.commit()
+    return chat_server
+
+
+def test_results_are_ranked_and_private_messages_stay_private(searchable):
+    ok, _, results = searchable.search_messages("alice", "deploy")
+    assert ok
+    assert [result["message"] for result in results] == ["release notes: deploy, deploy, deploy",
+                                                         "deploy the release tonight"] # More matches rank first
+    _, _, results = searchable.search_messages("alice", "release", "private")
+    assert [result["message"] for result in results] == ["the release is done"] # Not bob's message to carol
+
+
+def test_prefixes_scopes_and_literal_punctuation(searchable):
+    assert [result["message"] for result in searchable.search_messages("alice", "lun*", "room:lobby")[2]] == ["lunch?"]
+    assert searchable.search_messages("alice", "release", "user:bob")[2][0]["kind"] == "private"
+    assert searchable.search_messages("alice", 'deploy" OR "lunch')[0] # Operators are searched for, not run
+    assert searchable.search_messages("alice", "   ") == (False, "Search query is empty.", [])
+    assert not searchable.search_messages("alice", "deploy", "room:nowhere")[0]
+
+
+
+def test_archived_matches_are_found_through_the_index(searchable):
+    with searchable.db.connection() as conn:
+        conn.execute("UPDATE messages SET timestamp = '2020-01-01 00:00:00' WHERE message = 'deploy the release tonight'")
+        conn.commit()
+    assert searchable.archive.compact(room_days=1) == 1
+
+    _, _, results = searchable.search_messages("alice", "tonight")
+    assert [(result["message"], result["room"]) for result in results] == [("deploy the release tonight", "lobby")]
+    assert isinstance(results[0]["rank"], float) # Sorted with the live matches by bm25
+    assert len(searchable.search_messages("alice", "deploy")[2]) == 2
+    assert searchable.search_messages("alice", "tonight", "user:bob")[2] == []
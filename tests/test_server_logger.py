@@ -0,0 +1,70 @@
+import json
+import logging
+import multiprocessing
+import ServerLogger
+
+
+def write_lines(path, lines, newline_at_end=True):
+    path.write_text("\n".join(lines) + ("\n" if newline_at_end else ""), encoding="utf-8")
+
+
+def test_tail_returns_the_last_lines(tmp_path):
+    path = tmp_path / "server.log"
+    lines = [f"line {index} " + "x" * (index % 50) for index in range(2000)]
+    write_lines(path, lines)
+    assert ServerLogger.tail(str(path), 20) == lines[-20:]
+    assert ServerLogger.tail(str(path), 20, block_size=7) == lines[-20:] # Blocks smaller than a line
+
+
+def test_tail_of_short_and_empty_files(tmp_path):
+    path = tmp_path / "server.log"
+    write_lines(path, ["only", "two"], newline_at_end=False)
+    assert ServerLogger.tail(str(path), 20) == ["only", "two"]
+    assert ServerLogger.tail(str(path), 1) == ["two"]
+    assert ServerLogger.tail(str(path), 0) == []
+    path.write_bytes(b"")
+    assert ServerLogger.tail(str(path), 5) == []
+
+
+def test_tail_keeps_multibyte_characters(tmp_path):
+    path = tmp_path / "server.log"
+    lines = ["héllo wörld ✓"] * 30
+    write_lines(path, lines)
+    assert ServerLogger.tail(str(path), 25, block_size=5) == lines[-25:]
+
+
+def test_records_are_written_as_json(tmp_path):
+    path = tmp_path / "server.log"
+    server_log = ServerLogger.ServerLogger(str(path), "DEBUG")
+    try:
+        server_log.command("/login", "alice", 0.0125)
+        logging.getLogger("chitchat.cluster").warning("Link closed", extra={"node": "b"})
+    finally:
+        server_log.close()
+    command, warning = [json.loads(line) for line in ServerLogger.tail(str(path), 2)]
+    assert (command["level"], command["command"], command["user"], command["latency_ms"]) == \
+        ("DEBUG", "/login", "alice", 12.5)
+    assert (warning["logger"], warning["message"], warning["node"]) == ("chitchat.cluster", "Link closed", "b")
+
+
+def log_from_forked_worker(path):
+    ServerLogger.detach_inherited()
+    worker_log = ServerLogger.ServerLogger(path)
+    try:
+        assert logging.getLogger(ServerLogger.LOGGER_NAME).handlers == [worker_log.handler]
+        logging.getLogger("chitchat").info("From the worker")
+    finally:
+        worker_log.close()
+
+
+def test_forked_worker_logs_only_through_its_own_logger(tmp_path):
+    parent_log = ServerLogger.ServerLogger(str(tmp_path / "server.log"))
+    try:
+        worker = multiprocessing.get_context("fork").Process(target=log_from_forked_worker,
+                                                             args=(str(tmp_path / "server-0.log"),))
+        worker.start()
+        worker.join(10)
+        assert worker.exitcode == 0
+    finally:
+        parent_log.close()
+    assert json.loads(ServerLogger.tail(str(tmp_path / "server-0.log"), 1)[0])["message"] == "From the worker"
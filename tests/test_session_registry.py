@@ -0,0 +1,39 @@
+import SessionRegistry
+
+
+def test_room_members_follow_joins_and_exits():
+    sessions = SessionRegistry.SessionRegistry()
+    sessions.join_room("s1", "alice", "lobby")
+    sessions.join_room("s2", "bob", "lobby")
+    sessions.join_room("s2", "bob", "quiet")
+    assert sessions.room_members("lobby") == {"s1": "alice", "s2": "bob"}
+
+    assert sessions.leave_room("s1", "lobby")
+    assert not sessions.leave_room("s1", "lobby") # Already gone
+    assert sessions.room_users("lobby") == {"bob"}
+    assert sorted(sessions.remove_session("s2")) == ["lobby", "quiet"]
+    assert sessions.active_rooms() == {} # Rooms without connected members are forgotten
+
+
+def test_member_snapshots_are_never_modified():
+    sessions = SessionRegistry.SessionRegistry()
+    sessions.join_room("s1", "alice", "lobby")
+    members = sessions.room_members("lobby")
+    version = sessions.version
+    sessions.join_room("s2", "bob", "lobby")
+    sessions.leave_room("s1", "lobby")
+    assert members == {"s1": "alice"} # A broadcast iterating it is not disturbed
+    assert sessions.room_members("lobby") == {"s2": "bob"}
+    assert sessions.version == version + 2
+
+
+def test_a_user_may_be_logged_in_from_several_sessions():
+    sessions = SessionRegistry.SessionRegistry()
+    sessions.add_user("phone", "alice")
+    sessions.add_user("laptop", "alice")
+    assert sessions.user_sessions("alice") == {"phone", "laptop"}
+    sessions.remove_session("phone")
+    assert sessions.is_online("alice") and sessions.user_sessions("alice") == {"laptop"}
+    sessions.add_user("laptop", "bob") # Logged in again under another name
+    assert not sessions.is_online("alice")
+    assert sessions.user_sessions("alice") == frozenset()
@@ -0,0 +1,35 @@
+import UnreadCounters
+
+
+def test_counts_are_loaded_once_and_adjusted_by_writes():
+    stored = {"alice": 2}
+    counters = UnreadCounters.UnreadCounters(lambda username: stored[username])
+    assert counters.load("alice") == 2
+    stored["alice"] = 99 # Not read again while tracked
+    assert counters.load("alice") == 2 and counters.loads == 1
+    assert counters.record("alice", lambda: 1) == 3
+    assert counters.record("alice", lambda: -5) == 0 # Never below zero
+
+
+def test_untracked_users_still_run_the_write():
+    writes = []
+    counters = UnreadCounters.UnreadCounters(lambda username: 0)
+    assert counters.record("bob", lambda: writes.append("insert") or 1) is None
+    assert writes == ["insert"]
+    counters.load("bob")
+    counters.forget("bob") # Last session disconnected
+    assert counters.get("bob") is None
+
+
+def test_revert_is_skipped_after_a_reload():
+    counters = UnreadCounters.UnreadCounters(lambda username: 0)
+    counters.load("alice")
+    generation = counters.generation("alice")
+    counters.record("alice", lambda: 1)
+    assert counters.revert("alice", 1, generation) == 0
+
+    counters.record("alice", lambda: 1)
+    counters.forget("alice")
+    counters.load("alice") # Counted from the database, where the failed row never was
+    assert counters.revert("alice", 1, generation) is None
+    assert counters.get("alice") == 0
@@ -0,0 +1,35 @@
+import json
+import socket
+import threading
+import Protocol
+import WorkerBus
+
+
+def test_stalled_worker_does_not_hold_up_the_bus(tmp_path):
+    hub = WorkerBus.BusHub(str(tmp_path / "bus.sock"))
+    hub.start()
+    stalled = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) # Says hello, then never reads
+    stalled.connect(hub.path)
+    stalled.sendall(Protocol.encode_frame(json.dumps({"type": "hello", "origin": 1})))
+    received, done = [], threading.Event()
+
+    def handler(event):
+        if event["type"] != "room":
+            return # The publisher's hello
+        received.append(event["entry"]["number"])
+        if len(received) == 2000:
+            done.set()
+
+    receiver = WorkerBus.WorkerBus(hub.path, handler)
+    publisher = WorkerBus.WorkerBus(hub.path, lambda event: None)
+    try:
+        threading.Thread(target=lambda: [publisher.publish("room", room="general", entry={"number": number, "text": "x" * 1000})
+                                         for number in range(2000)], # Far more than the stalled worker's socket buffers
+                         daemon=True).start()
+        assert done.wait(10)
+        assert received == list(range(2000))
+    finally:
+        publisher.close()
+        receiver.close()
+        stalled.close()
+        hub.close()